@@ -0,0 +1,347 @@
+"""
+Collects low-confidence production predictions for labeling.
+
+Uploads the model is unsure about are the ones worth labeling, but they
+end up as anonymous uuid files in static/uploads. The prediction routes
+hand each upload and its probability vector to an ActiveLearningQueue.
+That costs one put() on a bounded queue; a background thread does the rest:
+
+* computes the uncertainty of the prediction
+      max_prob  top-1 probability
+      margin    top-1 minus top-2 probability
+      entropy   of the distribution, divided by log(num_classes) so it is in [0, 1]
+  and appends it to active_learning/predictions.jsonl;
+* keeps the `capacity` most informative uploads in a min-heap keyed by
+  the configured score (1 - margin by default), skipping uploads that are
+  the same or nearly the same image as one already kept (SHA-1 of the file,
+  then a 64-bit difference hash so repeated webcam frames count once).
+
+`export` copies the kept uploads into a new batch folder laid out like the
+training dataset, one sub-folder per predicted class:
+
+    active_learning/exports/batch_<timestamp>/<class>/<sha1>.<ext>
+
+Annotators move misfiled images to the right folder and copy the batch
+into the dataset, where `python train.py incremental` picks them up.
+Images already in an earlier batch leave the heap and are never kept or
+exported again. predictions.jsonl is only ever appended to and keeps the
+full history of the metrics. The heap is rebuilt on start-up from
+candidates.json, a snapshot of the kept records and of how far into the log
+they go, plus the log lines after it, so a restart loses nothing. The
+snapshot is rewritten once COMPACT_FACTOR times the capacity lines have
+been appended since it was taken, so start-up stays fast.
+
+Usage:
+    python active_learning.py stats
+    python active_learning.py export --limit 200 --score entropy
+"""
+import os
+import json
+import heapq
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+DEFAULT_DIR = 'active_learning'
+LOG_FILE = 'predictions.jsonl'
+CANDIDATES_FILE = 'candidates.json'
+EXPORTS_DIR = 'exports'
+SCORES = ('margin', 'entropy', 'least_confident')
+NEAR_DUPLICATE_BITS = 4 # Difference hashes this close are treated as the same image
+COMPACT_FACTOR = 4 # Log lines allowed per kept record before the candidates are snapshotted again
+
+
+def uncertainty(probabilities):
+    """
+    Uncertainty metrics of one probability vector.
+    Returns:
+        dict: max_prob, margin and entropy (normalized to [0, 1]).
+    """
+    p = np.clip(np.asarray(probabilities, dtype=np.float64).ravel(), 1e-12, 1.0)
+    p = p / p.sum()
+    top = np.sort(p)[::-1]
+    entropy = float(-np.sum(p * np.log(p)) / np.log(len(p))) if len(p) > 1 else 0.0
+    return {
+        'max_prob': round(float(top[0]), 6),
+        'margin': round(float(top[0] - top[1]) if len(top) > 1 else 1.0, 6),
+        'entropy': round(entropy, 6),
+    }
+
+
+def informativeness(metrics, score='margin'):
+    """Higher is more worth labeling."""
+    if score == 'entropy':
+        return metrics['entropy']
+    if score == 'least_confident':
+        return 1.0 - metrics['max_prob']
+    return 1.0 - metrics['margin']
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def difference_hash(path):
+    """64-bit dHash: signs of horizontal gradients of a 9x8 grey thumbnail (None if unreadable)."""
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ActiveLearningQueue:
+    """Bounded priority queue of the most informative predictions, fed off the request path."""
+
+    def __init__(self, directory=DEFAULT_DIR, capacity=500, score='margin', max_pending=1000, start=True):
+        """
+        Args:
+            directory (str): Holds the prediction log and the exported batches.
+            capacity (int): Uploads kept as labeling candidates.
+            score (str): 'margin', 'entropy' or 'least_confident'.
+            max_pending (int): Predictions waiting for the background thread;
+                beyond that new ones are dropped rather than slowing requests.
+            start (bool): Start the background thread (the CLI only reads the log).
+        """
+        if score not in SCORES:
+            raise ValueError(f"Unknown score '{score}', expected one of {SCORES}")
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.candidates_path = os.path.join(directory, CANDIDATES_FILE)
+        self.capacity = capacity
+        self.score = score
+        self.dropped = 0
+        self._heap = [] # (score, sha1, record); the least informative kept record on top
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._log_lines = 0 # Appended since the last snapshot
+        os.makedirs(directory, exist_ok=True)
+        self._exported = self.exported_hashes()
+        self._reload()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name='active-learning', daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._heap)
+
+    # --- Request path ---
+
+    def record(self, upload_path, probabilities, predicted_class, source='upload'):
+        """Hands a prediction to the background thread; never blocks."""
+        try:
+            self._pending.put_nowait((upload_path, np.array(probabilities, dtype=np.float32), predicted_class,
+                                      source, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        except queue.Full:
+            self.dropped += 1
+
+    # --- Background thread ---
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            try:
+                self._process(*item)
+            except Exception as e:
+                print(f"Active learning: could not record {item[0]}: {e}")
+
+    def _process(self, upload_path, probabilities, predicted_class, source, created_at):
+        record = {
+            'upload': upload_path,
+            'predicted_class': predicted_class,
+            'source': source,
+            'created_at': created_at,
+            **uncertainty(probabilities),
+            'sha1': file_sha1(upload_path),
+            'dhash': difference_hash(upload_path),
+        }
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n') # One short append per line, safe across worker processes
+        self._log_lines += 1
+        self._offer(record)
+        if self._log_lines > COMPACT_FACTOR * self.capacity:
+            self.compact()
+
+    def _offer(self, record):
+        """Keeps the record if it is among the `capacity` most informative distinct images."""
+        if record['sha1'] in self._exported:
+            return # Already handed to the annotators
+        score = informativeness(record, self.score)
+        with self._lock:
+            for i, (kept_score, sha1, kept) in enumerate(self._heap):
+                if sha1 == record['sha1'] or (record['dhash'] is not None and kept['dhash'] is not None and
+                                              _hamming(record['dhash'], kept['dhash']) <= NEAR_DUPLICATE_BITS):
+                    if score > kept_score: # Keep the copy the model was least sure about
+                        self._heap[i] = (score, record['sha1'], record)
+                        heapq.heapify(self._heap)
+                    return
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, (score, record['sha1'], record))
+            elif score > self._heap[0][0]:
+                heapq.heapreplace(self._heap, (score, record['sha1'], record))
+
+    def _reload(self):
+        """
+        Rebuilds the heap from the last snapshot and the log lines appended
+        after it, skipping uploads that no longer exist.
+        """
+        offset = 0
+        if os.path.exists(self.candidates_path):
+            with open(self.candidates_path) as f:
+                snapshot = json.load(f)
+            offset = snapshot['log_offset']
+            for record in snapshot['records']:
+                if os.path.exists(record['upload']):
+                    self._offer(record)
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path) as f:
+            if offset <= os.path.getsize(self.log_path): # Otherwise the log was replaced: read it all
+                f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # A line torn by a crash
+                self._log_lines += 1
+                if os.path.exists(record['upload']):
+                    self._offer(record)
+        if self._log_lines > COMPACT_FACTOR * self.capacity:
+            self.compact()
+
+    def _forget_exported(self):
+        """Drops exported images from the heap (caller holds the lock)."""
+        kept = [item for item in self._heap if item[1] not in self._exported]
+        if len(kept) != len(self._heap):
+            heapq.heapify(kept)
+            self._heap = kept
+
+    def compact(self):
+        """
+        Snapshots the kept records to candidates.json, so start-up reads them
+        instead of the whole log. The log itself is left untouched. Lines
+        another process appended before the snapshot are only in the log,
+        which costs this queue at most a few candidates.
+        """
+        self._exported = self.exported_hashes() # Picks up batches exported by the CLI too
+        offset = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0 # Before the heap: later lines are re-read
+        with self._lock:
+            self._forget_exported()
+            records = [record for _, _, record in self._heap]
+        tmp_path = self.candidates_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'log_offset': offset, 'records': records}, f)
+        os.replace(tmp_path, self.candidates_path)
+        self._log_lines = 0
+
+    def close(self):
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join(timeout=5)
+
+    # --- Export ---
+
+    def candidates(self, limit=None):
+        """Kept records, most informative first."""
+        with self._lock:
+            ranked = [record for _, _, record in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+        return ranked[:limit] if limit else ranked
+
+    def exported_hashes(self):
+        """SHA-1s of every image in earlier export batches (they are the file names)."""
+        hashes = set()
+        for _, _, filenames in os.walk(os.path.join(self.directory, EXPORTS_DIR)):
+            hashes.update(os.path.splitext(name)[0] for name in filenames if name != 'labels.json')
+        return hashes
+
+    def export(self, limit=None, output=None):
+        """
+        Copies the most informative, not yet exported uploads into a class-folder batch.
+        Returns:
+            tuple: (batch directory, number of images exported)
+        """
+        seen = self.exported_hashes()
+        batch = output or os.path.join(self.directory, EXPORTS_DIR,
+                                       f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        rows = []
+        for record in self.candidates():
+            if limit and len(rows) >= limit:
+                break
+            if record['sha1'] in seen or not os.path.exists(record['upload']):
+                continue
+            folder = os.path.join(batch, record['predicted_class'])
+            os.makedirs(folder, exist_ok=True)
+            target = os.path.join(folder, record['sha1'] + os.path.splitext(record['upload'])[1].lower())
+            shutil.copy2(record['upload'], target)
+            seen.add(record['sha1'])
+            rows.append(dict(record, file=os.path.relpath(target, batch),
+                             score=round(informativeness(record, self.score), 6)))
+        if rows:
+            with open(os.path.join(batch, 'labels.json'), 'w') as f:
+                json.dump({'score': self.score, 'exported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                           'images': rows}, f, indent=2)
+            self.compact() # Frees their heap slots for new candidates and drops them from the snapshot
+        return batch, len(rows)
+
+
+def from_config(config):
+    """Builds the app's queue from ACTIVE_LEARNING_* settings, or None when disabled."""
+    if not config.get('ACTIVE_LEARNING_ENABLED'):
+        return None
+    return ActiveLearningQueue(config['ACTIVE_LEARNING_DIR'], config['ACTIVE_LEARNING_CAPACITY'],
+                               config['ACTIVE_LEARNING_SCORE'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and export low-confidence production predictions.")
+    parser.add_argument('--dir', default=DEFAULT_DIR)
+    parser.add_argument('--capacity', type=int, default=500)
+    parser.add_argument('--score', choices=SCORES, default='margin')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Summarize the prediction log and the current candidates.")
+    export = sub.add_parser('export', help="Write the top candidates as a class-folder batch.")
+    export.add_argument('--limit', type=int, default=None)
+    export.add_argument('--output', default=None, help="Batch directory (default: <dir>/exports/batch_<time>).")
+    args = parser.parse_args()
+
+    candidates = ActiveLearningQueue(args.dir, args.capacity, args.score, start=False)
+    if args.command == 'export':
+        batch, count = candidates.export(args.limit, args.output)
+        if count:
+            print(f"Exported {count} images to {batch}")
+        else:
+            print("Nothing new to export.")
+        return
+
+    ranked = candidates.candidates()
+    print(f"{len(ranked)} candidates (score: {args.score}), {len(candidates.exported_hashes())} already exported")
+    counts = {}
+    for record in ranked:
+        counts[record['predicted_class']] = counts.get(record['predicted_class'], 0) + 1
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {count:5d}  {name}")
+    for record in ranked[:10]:
+        print(f"  max_prob {record['max_prob']:.3f}  margin {record['margin']:.3f}  entropy {record['entropy']:.3f}"
+              f"  {record['upload']}")
+
+
+if __name__ == '__main__':
+    main()
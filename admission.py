@@ -0,0 +1,221 @@
+"""
+Admission control and load shedding for the prediction routes.
+
+Every prediction holds a decoded image array and a saved upload while it
+waits for the model, so unbounded concurrency turns a traffic spike into
+memory pressure. The AdmissionController in front of inference:
+
+* caps the number of requests inside the model (in-flight limit),
+* lets a bounded number of requests wait briefly for a slot, with
+  interactive (camera) requests always served before bulk ones and a
+  reserved share of slots that bulk requests may not take,
+* rate-limits each user with a token bucket keyed on current_user.id,
+* rejects everything else immediately: 429 when the user is over their
+  rate, 503 when the server is saturated, both with a Retry-After header.
+  A shed request gives its rate-limit token back, so a busy server does
+  not also eat into the user's budget. Fetch/API callers get a JSON error;
+  browser form posts get their page back with the error flashed.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import flash, jsonify, make_response, request
+from flask_login import current_user
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        """
+        Raises:
+            ValueError: rate is not positive (take() divides by it), or capacity below one token.
+        """
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        if capacity < 1:
+            raise ValueError(f"Token bucket capacity must be at least 1, got {capacity}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Takes one token if available.
+        Returns:
+            float: 0.0 on success, otherwise the seconds until a token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Gives back a token taken by a request that was not served after all."""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionController:
+    """Bounded, two-lane admission in front of model inference."""
+
+    def __init__(self, max_in_flight=4, reserved_interactive=1, max_queue=8, queue_timeout=2.0,
+                 user_rate=0.5, user_burst=5, max_tracked_users=10000):
+        """
+        Args:
+            max_in_flight (int): Requests allowed inside inference at once.
+            reserved_interactive (int): Slots only interactive requests may use.
+            max_queue (int): Requests allowed to wait for a slot; more are shed.
+            queue_timeout (float): Seconds a request may wait before it is shed.
+            user_rate (float): Sustained predictions per second per user.
+            user_burst (int): Bucket size, i.e. how many predictions a user may burst.
+        Raises:
+            ValueError: user_rate is not positive or user_burst is below 1.
+        """
+        TokenBucket(user_rate, user_burst) # Reject a bad ADMISSION_USER_* at start-up, not on the first request
+        self.max_in_flight = max_in_flight
+        self.reserved_interactive = min(reserved_interactive, max_in_flight - 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_tracked_users = max_tracked_users
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._service_time = 0.5 # EWMA of seconds per admitted request, used for Retry-After
+        self._buckets = OrderedDict()
+        self._buckets_lock = threading.Lock()
+        self.stats = {'admitted': 0, 'rate_limited': 0, 'shed': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a controller from the ADMISSION_* keys of a Flask config."""
+        return cls(max_in_flight=config['ADMISSION_MAX_IN_FLIGHT'],
+                   reserved_interactive=config['ADMISSION_RESERVED_INTERACTIVE'],
+                   max_queue=config['ADMISSION_MAX_QUEUE'],
+                   queue_timeout=config['ADMISSION_QUEUE_TIMEOUT'],
+                   user_rate=config['ADMISSION_USER_RATE'],
+                   user_burst=config['ADMISSION_USER_BURST'])
+
+    def _check_rate(self, user_id):
+        """Returns 0.0 if the user may proceed, else the seconds to wait."""
+        with self._buckets_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+                if len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False) # Forget the least recently seen user
+            else:
+                self._buckets.move_to_end(user_id)
+            return bucket.take()
+
+    def _refund(self, user_id):
+        with self._buckets_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is not None:
+                bucket.refund()
+
+    def _has_slot(self, lane):
+        if lane == INTERACTIVE:
+            return self._in_flight < self.max_in_flight
+        # Bulk work never takes the reserved slots and always yields to waiting interactive requests
+        return (self._waiting[INTERACTIVE] == 0 and
+                self._in_flight < self.max_in_flight - self.reserved_interactive)
+
+    def _retry_after(self):
+        """Rough seconds until the current backlog has drained."""
+        backlog = self._in_flight + sum(self._waiting.values())
+        return max(1.0, backlog * self._service_time / self.max_in_flight)
+
+    def acquire(self, lane, user_id):
+        """
+        Tries to admit one request.
+        Returns:
+            tuple: (status, retry_after) where status is 'ok', 'rate_limited' or 'overloaded'.
+        """
+        wait = self._check_rate(user_id)
+        if wait:
+            self.stats['rate_limited'] += 1
+            return 'rate_limited', wait
+
+        status, retry_after = self._acquire_slot(lane)
+        if status != 'ok':
+            self._refund(user_id) # Shed for lack of a slot: the user's rate is not to blame
+        return status, retry_after
+
+    def _acquire_slot(self, lane):
+        with self._cond:
+            if not self._has_slot(lane):
+                if sum(self._waiting.values()) >= self.max_queue:
+                    self.stats['shed'] += 1
+                    return 'overloaded', self._retry_after()
+                self._waiting[lane] += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while not self._has_slot(lane):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats['shed'] += 1
+                            return 'overloaded', self._retry_after()
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[lane] -= 1
+            self._in_flight += 1
+            self.stats['admitted'] += 1
+            return 'ok', 0.0
+
+    def release(self, service_time=None):
+        """Frees a slot and wakes the waiters (interactive ones win via _has_slot)."""
+        with self._cond:
+            self._in_flight -= 1
+            if service_time is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            self._cond.notify_all()
+
+    def limit(self, lane=BULK, page=None):
+        """
+        Decorator for Flask views; must be applied below @login_required.
+        Only POSTs are admitted (GETs just render forms). Rejected requests
+        get status 429/503 and a Retry-After header, with a JSON error body,
+        or for browser form posts the flashed error on the re-rendered page.
+        Args:
+            lane (str): INTERACTIVE or BULK.
+            page (callable): Renders the view's HTML page; None for JSON-only routes.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if request.method != 'POST':
+                    return view(*args, **kwargs)
+                status, retry_after = self.acquire(lane, current_user.id)
+                if status != 'ok':
+                    if status == 'rate_limited':
+                        message, code = 'Too many predictions, please slow down.', 429
+                    else:
+                        message, code = 'Server is busy, please try again shortly.', 503
+                    if page is not None and request.accept_mimetypes.best == 'text/html':
+                        flash(message, 'warning') # A form post navigated here: show the page, not raw JSON
+                        response = make_response(page(), code)
+                    else:
+                        response = jsonify({'error': message, 'reason': status})
+                        response.status_code = code
+                    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+                    return response
+                start = time.monotonic()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(time.monotonic() - start)
+            return wrapped
+        return decorator
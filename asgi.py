@@ -0,0 +1,196 @@
+"""
+ASGI serving mode for the Flask app.
+
+Run with an ASGI server, e.g.:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+or simply `python asgi.py`.
+
+The adapter receives every request body on the event loop, so a slow upload
+or an idle camera client costs a coroutine instead of a whole thread. Once
+the body is complete the request is dispatched by route:
+
+* prediction routes (decode + model inference) go to a dedicated, bounded
+  inference executor so they never starve the rest of the site,
+* everything else runs on a general-purpose thread pool. No route is run on
+  the event loop itself: even the info pages load the session from the
+  SQLite session store, static files are read from disk and /assets may
+  rebuild a bundle, and any of those would stall every other connection.
+
+The WSGI app itself is unchanged; `python test.py` still runs the threaded
+development server, and bench_concurrency.py compares the two modes.
+"""
+import io
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from test import app
+
+# CPU-bound routes: image decode + forward pass
+INFERENCE_PATHS = ('/predict', '/predict_camera', '/similar')
+
+app.config.setdefault('ASGI_INFERENCE_WORKERS', 2) # Threads allowed inside inference at once
+app.config.setdefault('ASGI_BLOCKING_WORKERS', 8) # Threads for every other route
+
+
+class WsgiAsgiAdapter:
+    """Minimal ASGI -> WSGI bridge with per-route executors."""
+
+    def __init__(self, wsgi_app, inference_workers=2, blocking_workers=8, max_content_length=None):
+        self.wsgi_app = wsgi_app
+        self.max_content_length = max_content_length # Bodies above this get a 413 before being buffered
+        self.inference_executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix='inference')
+        self.blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='blocking')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self._reject_websocket(receive, send)
+        # Any other scope type is left alone: returning closes it without a traceback
+
+    async def _reject_websocket(self, receive, send):
+        """The app has no websocket routes: refuse the handshake (the server answers 403)."""
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.inference_executor.shutdown(wait=True)
+                self.blocking_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _executor_for(self, path, method):
+        """Returns the executor to run the request on."""
+        if path in INFERENCE_PATHS and method == 'POST':
+            return self.inference_executor
+        return self.blocking_executor
+
+    async def _read_body(self, receive):
+        """
+        Collects the request body without holding a thread while the client sends it.
+        Returns:
+            BytesIO: The body, or None if the client disconnected first.
+        Raises:
+            RequestEntityTooLarge: The body grew past max_content_length.
+        """
+        body = io.BytesIO()
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_content_length is not None and size > self.max_content_length:
+                raise RequestEntityTooLarge()
+            body.write(chunk)
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    def _declared_length(self, scope):
+        """The Content-Length header as an int (None if absent or malformed)."""
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length':
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    async def _send_error(self, send, error):
+        """Sends a werkzeug HTTPException as the response, without touching the WSGI app."""
+        response = error.get_response()
+        headers = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response.headers.items()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    def _environ(self, scope, body):
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope['query_string'].decode('ascii'),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        server = scope.get('server') or ('localhost', 80)
+        environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1')
+            value = value.decode('latin1')
+            if name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            elif name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _run_wsgi(self, environ):
+        """Runs the WSGI app to completion; returns (status, headers, body)."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    async def _http(self, scope, receive, send):
+        declared = self._declared_length(scope)
+        try:
+            if self.max_content_length is not None and declared is not None and declared > self.max_content_length:
+                raise RequestEntityTooLarge()
+            body = await self._read_body(receive)
+        except RequestEntityTooLarge as e:
+            await self._send_error(send, e) # Same 413 Flask would give, minus the buffering
+            return
+        if body is None:
+            return # Client went away before finishing the upload
+        environ = self._environ(scope, body)
+        executor = self._executor_for(scope['path'], scope['method'])
+        loop = asyncio.get_running_loop()
+        status, headers, payload = await loop.run_in_executor(executor, self._run_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+application = WsgiAsgiAdapter(app.wsgi_app,
+                              inference_workers=app.config['ASGI_INFERENCE_WORKERS'],
+                              blocking_workers=app.config['ASGI_BLOCKING_WORKERS'],
+                              max_content_length=app.config['MAX_CONTENT_LENGTH'])
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The ASGI mode needs an ASGI server: pip install uvicorn")
+    uvicorn.run('asgi:application', host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,231 @@
+"""
+Static asset bundles: minified, fingerprinted and precompressed.
+
+Each page used to pull style.css, its own stylesheet (often style.css a
+second time) and script.js as separate, unversioned files. `build` joins
+the sources of every bundle in BUNDLES, minifies them, writes them as
+<name>.<content hash>.<ext> next to .gz (and .br, when the optional
+`brotli` package is installed) copies, and records the names in
+manifest.json. Templates link bundles through asset_url('home.css'), and
+the /assets/ route serves the fingerprinted files with immutable
+far-future cache headers and the best encoding the browser accepts.
+
+Without a build (development), the same URLs serve the bundles assembled
+on the fly from the sources, uncached.
+
+Usage:
+    python assets.py build            # writes static/dist/ and its manifest
+    python assets.py build --prune    # also deletes files of older builds
+"""
+import os
+import re
+import json
+import gzip
+import hashlib
+import argparse
+import posixpath
+
+from flask import Response, abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'static/dist'
+MANIFEST = 'manifest.json'
+STATIC_URL_PATH = '/static'
+# Where sources are looked up: the deployed static/ layout first, then the repository root
+SOURCE_DIRS = {'CSS': ('static/CSS', '.'), 'js': ('static/js', '.')}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Bundle name -> sources (paths relative to static/), in cascade order
+BUNDLES = {
+    'site.css': ['CSS/style.css'],
+    'home.css': ['CSS/style.css', 'CSS/home.css'],
+    'predict.css': ['CSS/style.css', 'CSS/home.css'],
+    'about.css': ['CSS/style.css', 'CSS/about.css'],
+    'contact.css': ['CSS/style.css', 'CSS/contact.css'],
+    'description.css': ['CSS/style.css', 'CSS/description.css'],
+    'detail.css': ['CSS/style.css', 'CSS/detail_page.css'],
+    'how_it_works.css': ['CSS/style.css', 'CSS/how_it_works.css'],
+    'methodology.css': ['CSS/style.css', 'CSS/methodology.css'],
+    'site.js': ['js/script.js'],
+}
+
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+
+
+def read_source(source):
+    """Reads a source file given by its path relative to static/."""
+    folder, name = source.split('/', 1)
+    for base in SOURCE_DIRS[folder]:
+        path = os.path.join(base, name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+    raise FileNotFoundError(f"Asset source '{source}' not found in {SOURCE_DIRS[folder]}")
+
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def rebase_css_urls(css, source):
+    """Rewrites relative url(...) references to absolute /static/ URLs, since bundles are served from /assets/."""
+    folder = posixpath.dirname(source)
+
+    def rebase(match):
+        target = match.group(2).strip()
+        if target.startswith(('/', 'data:', 'http:', 'https:', '#')):
+            return match.group(0)
+        return f"url('{STATIC_URL_PATH}/{posixpath.normpath(posixpath.join(folder, target))}')"
+    return _CSS_URL.sub(rebase, css)
+
+
+_CSS_STRING = r'"(?:\\.|[^"\\])*"' + r"|'(?:\\.|[^'\\])*'"
+_CSS_STRING_OR_COMMENT = re.compile(_CSS_STRING + r'|/\*.*?\*/', re.S)
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    return text.replace(': ', ':').replace(';}', '}')
+
+
+def minify_css(css):
+    """Drops comments and redundant whitespace, leaving strings untouched."""
+    css = _CSS_STRING_OR_COMMENT.sub(lambda m: '' if m.group().startswith('/*') else m.group(), css)
+    parts, pos = [], 0
+    for match in re.finditer(_CSS_STRING, css):
+        parts.append(_squeeze_css(css[pos:match.start()]))
+        parts.append(match.group())
+        pos = match.end()
+    parts.append(_squeeze_css(css[pos:]))
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    """
+    Conservative JS minification: indentation, blank lines and whole-line
+    // comments go, line breaks stay (so automatic semicolon insertion and
+    regex literals are never affected). Uses rjsmin instead when installed.
+    """
+    try:
+        import rjsmin
+        return rjsmin.jsmin(js)
+    except ImportError:
+        pass
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def build_bundle(name):
+    """Returns the minified content of a bundle."""
+    sources = BUNDLES[name]
+    if name.endswith('.css'):
+        return '\n'.join(minify_css(rebase_css_urls(read_source(s), s)) for s in sources)
+    return ';\n'.join(minify_js(read_source(s)) for s in sources)
+
+
+def fingerprinted_name(name, content):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+
+def build(dist_dir=DIST_DIR, prune=False):
+    """
+    Builds every bundle into dist_dir and writes the manifest.
+    Returns:
+        dict: Bundle name -> fingerprinted file name.
+    """
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for name in BUNDLES:
+        content = build_bundle(name).encode('utf-8')
+        filename = fingerprinted_name(name, content)
+        path = os.path.join(dist_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        sizes = f"{len(content)} B, gzip {os.path.getsize(path + '.gz')} B"
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+            sizes += f", br {os.path.getsize(path + '.br')} B"
+        manifest[name] = filename
+        print(f"{name:18s} -> {filename} ({sizes})")
+
+    tmp_path = os.path.join(dist_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(dist_dir, MANIFEST))
+
+    if prune:
+        keep = set(manifest.values())
+        for filename in os.listdir(dist_dir):
+            base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+            if filename != MANIFEST and base not in keep:
+                os.remove(os.path.join(dist_dir, filename))
+    if brotli is None:
+        print("brotli is not installed; only gzip copies were written (pip install brotli).")
+    return manifest
+
+
+class AssetManifest:
+    """Resolves bundle names to fingerprinted URLs and serves the files."""
+
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = dist_dir
+        manifest_path = os.path.join(dist_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.files = json.load(f)
+        else:
+            self.files = {}
+            print(f"No asset manifest in {dist_dir}; serving unbundled development assets "
+                  f"(run `python assets.py build`).")
+        self.built = set(self.files.values())
+
+    def url(self, name):
+        """Template helper: the URL of a bundle, fingerprinted when built."""
+        return url_for('asset', filename=self.files.get(name, name))
+
+    def send(self, filename):
+        """Response for /assets/<filename>, picking brotli or gzip copies when accepted."""
+        mimetype = MIMETYPES.get(os.path.splitext(filename)[1])
+        if filename in self.built:
+            encoding = None
+            for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if request.accept_encodings[candidate] and os.path.exists(
+                        os.path.join(self.dist_dir, filename + suffix)):
+                    encoding = candidate
+                    filename += suffix
+                    break
+            response = send_from_directory(os.path.abspath(self.dist_dir), filename, mimetype=mimetype)
+            response.headers['Cache-Control'] = IMMUTABLE
+            response.headers['Vary'] = 'Accept-Encoding'
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            return response
+        if filename in BUNDLES:
+            response = Response(build_bundle(filename), mimetype=mimetype) # Rebuilt per request so edits show up
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        abort(404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build minified, fingerprinted, precompressed asset bundles.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('--dist-dir', default=DIST_DIR)
+    build_parser.add_argument('--prune', action='store_true', help="Delete files of previous builds.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.dist_dir, args.prune)
+
+
+if __name__ == '__main__':
+    main()
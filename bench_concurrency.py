@@ -0,0 +1,162 @@
+"""
+Concurrency benchmark: threaded WSGI server vs. the ASGI mode (asgi.py).
+
+For each mode the app is started in a subprocess, a number of "slow"
+clients open uploads and trickle the body without finishing it (like idle
+camera clients on a bad connection), and meanwhile a burst of info-page
+requests is timed. The report shows latency percentiles, errors and how
+many OS threads the server needed.
+
+Usage:
+    python bench_concurrency.py --mode both --slow-clients 500 --requests 1000 --concurrency 50
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+import numpy as np
+
+HOST = '127.0.0.1'
+
+
+def start_server(mode, port):
+    """Starts the app in a subprocess and waits until it accepts connections."""
+    if mode == 'wsgi':
+        cmd = [sys.executable, '-c', f"from test import app; app.run(host='{HOST}', port={port}, threaded=True)"]
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', HOST, '--port', str(port),
+               '--log-level', 'warning', '--backlog', '4096']
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120 # Model loading can take a while
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with code {process.returncode}")
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+def thread_count(pid):
+    """Number of OS threads of a process (Linux only, else None)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def slow_upload(port, hold, stop):
+    """Opens an upload and sends its body a few bytes at a time until stopped."""
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port)
+    except OSError:
+        return False
+    body_length = 1024 * 1024
+    writer.write((f"POST /login HTTP/1.1\r\nHost: {HOST}\r\n"
+                  f"Content-Type: application/x-www-form-urlencoded\r\n"
+                  f"Content-Length: {body_length}\r\n\r\n").encode())
+    try:
+        while not stop.is_set():
+            writer.write(b'a')
+            await writer.drain()
+            try:
+                await asyncio.wait_for(stop.wait(), hold)
+            except asyncio.TimeoutError:
+                pass
+    except OSError:
+        return False
+    finally:
+        writer.close()
+    return True
+
+
+async def timed_get(port, path, timeout):
+    """Returns (latency_seconds, status) for one GET; status is None on failure."""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, port), timeout)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(data.split(b' ', 2)[1]) if data else None
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        status = None
+    return time.perf_counter() - start, status
+
+
+async def run_load(port, path, slow_clients, requests, concurrency, timeout, server_pid):
+    stop = asyncio.Event()
+    slow = [asyncio.create_task(slow_upload(port, 1.0, stop)) for _ in range(slow_clients)]
+    await asyncio.sleep(2.0) # Let the slow clients connect
+    threads_loaded = thread_count(server_pid)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await timed_get(port, path, timeout)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*slow, return_exceptions=True)
+
+    latencies = np.array([lat for lat, status in results if status is not None and status < 500]) * 1000
+    return {
+        'ok': int(len(latencies)),
+        'errors': requests - int(len(latencies)),
+        'requests_per_second': len(latencies) / wall if wall else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'server_threads': threads_loaded,
+    }
+
+
+def benchmark(mode, args):
+    process = start_server(mode, args.port)
+    try:
+        return asyncio.run(run_load(args.port, args.path, args.slow_clients, args.requests,
+                                    args.concurrency, args.timeout, process.pid))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare threaded WSGI and ASGI serving under concurrency.")
+    parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'), default='both')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--path', default='/about', help="Info page to time.")
+    parser.add_argument('--slow-clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    modes = ('wsgi', 'asgi') if args.mode == 'both' else (args.mode,)
+    print(f"{args.slow_clients} slow uploads held open, {args.requests} GET {args.path} at concurrency {args.concurrency}\n")
+    print(f"{'mode':6s} {'ok':>6s} {'errors':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'threads':>8s}")
+    for mode in modes:
+        r = benchmark(mode, args)
+        fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8s}"
+        print(f"{mode:6s} {r['ok']:6d} {r['errors']:7d} {r['requests_per_second']:8.1f} "
+              f"{fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])} {str(r['server_threads']):>8s}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Login throughput under concurrent prediction load.
+
+Runs a steady inference load on a few threads (the real model via
+--model, or a synthetic NumPy workload) and fires a burst of logins at the
+same time, either hashing inline on the request threads (the old
+behaviour) or through the bounded CredentialVerifier pool. Reports login
+throughput and how much the inference latency degrades in each mode.
+
+Usage:
+    python bench_login.py --logins 200 --login-concurrency 50
+    python bench_login.py --model resnet152v2 --method pbkdf2:sha256
+"""
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from passwords import DEFAULT_METHOD, CredentialVerifier, CredentialBusy
+
+
+def synthetic_inference(size=512):
+    """A CPU-bound stand-in for model.predict when no model is given."""
+    a = np.random.rand(size, size).astype(np.float32)
+
+    def step():
+        b = a
+        for _ in range(4):
+            b = np.tanh(b @ a)
+        return b
+    return step
+
+
+def model_inference(spec):
+    from model_registry import load_registered_model
+
+    model, entry = load_registered_model(spec)
+    batch = np.random.rand(1, *entry['target_size'], 3).astype(np.float32)
+    return lambda: model.predict(batch, verbose=0)
+
+
+def inference_load(step, threads, stop):
+    """Runs `step` in a loop on several threads; returns the latency list (filled until stop)."""
+    latencies = []
+
+    def loop():
+        while not stop.is_set():
+            start = time.perf_counter()
+            step()
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=loop, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    return latencies, workers
+
+
+def login_burst(mode, stored_hash, password, logins, concurrency, verifier):
+    """Fires `logins` verifications from `concurrency` request threads."""
+    latencies, rejected = [], 0
+
+    def one():
+        nonlocal rejected
+        start = time.perf_counter()
+        try:
+            if mode == 'inline':
+                ok = check_password_hash(stored_hash, password)
+            else:
+                ok, _ = verifier.verify(stored_hash, password)
+            assert ok
+        except CredentialBusy:
+            rejected += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(logins):
+            pool.submit(one)
+    return latencies, rejected, time.perf_counter() - start
+
+
+def percentiles(seconds):
+    if not seconds:
+        return '-', '-'
+    ms = np.array(seconds) * 1000
+    return f"{np.percentile(ms, 50):.1f}", f"{np.percentile(ms, 95):.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login throughput alongside prediction load.")
+    parser.add_argument('--method', default=DEFAULT_METHOD, help="werkzeug hash method of the stored password.")
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--login-concurrency', type=int, default=50, help="Simultaneous login requests.")
+    parser.add_argument('--hash-workers', type=int, default=2, help="CredentialVerifier pool size.")
+    parser.add_argument('--max-pending', type=int, default=1000)
+    parser.add_argument('--inference-threads', type=int, default=2)
+    parser.add_argument('--model', default=None, help="Registry spec; default is a synthetic workload.")
+    parser.add_argument('--baseline-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    password = 'correct horse battery staple'
+    stored_hash = generate_password_hash(password, args.method)
+    step = model_inference(args.model) if args.model else synthetic_inference()
+    verifier = CredentialVerifier(args.method, args.hash_workers, args.max_pending, timeout=600)
+
+    stop = threading.Event()
+    latencies, workers = inference_load(step, args.inference_threads, stop)
+    time.sleep(args.baseline_seconds)
+    baseline = list(latencies)
+
+    print(f"{args.logins} logins ({args.method}) at concurrency {args.login_concurrency}, "
+          f"{args.inference_threads} inference threads\n")
+    print(f"{'mode':10s} {'logins/s':>9s} {'rejected':>9s} {'login p50':>10s} {'login p95':>10s} "
+          f"{'infer p50':>10s} {'infer p95':>10s}")
+    p50, p95 = percentiles(baseline)
+    print(f"{'no logins':10s} {'-':>9s} {'-':>9s} {'-':>10s} {'-':>10s} {p50:>10s} {p95:>10s}")
+    for mode in ('inline', 'executor'):
+        mark = len(latencies)
+        login_latencies, rejected, wall = login_burst(mode, stored_hash, password, args.logins,
+                                                      args.login_concurrency, verifier)
+        during = latencies[mark:]
+        lp50, lp95 = percentiles(login_latencies)
+        ip50, ip95 = percentiles(during)
+        print(f"{mode:10s} {len(login_latencies) / wall:9.1f} {rejected:9d} {lp50:>10s} {lp95:>10s} "
+              f"{ip50:>10s} {ip95:>10s}")
+
+    stop.set()
+    for worker in workers:
+        worker.join()
+    verifier.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Per-request allocations and RSS of the preprocessing paths under sustained load.
+
+Compares three ways of turning an upload into model input:
+
+* legacy   what the request thread used to do: decode, float32 copy,
+           expand_dims, a new array for /255, then model.predict
+* inline   PreprocessPipeline with workers=0: the request thread decodes the
+           upload bytes straight into a preallocated shared-memory slot
+* workers  PreprocessPipeline with decode processes writing into the slots
+
+Two phases per mode. First, requests run one at a time under tracemalloc,
+which reports the peak transient bytes a single request allocates in the
+server process (Python and NumPy allocations, including OpenCV's output
+arrays; PIL's internal buffers are not traced). Then --concurrency client
+threads send requests for --duration seconds while the RSS of the server
+process (and of its decode workers) is sampled. The model is a cheap NumPy
+stand-in unless --model is given, so the numbers isolate preprocessing.
+
+Usage:
+    python bench_preprocess.py --method cv2 --concurrency 8 --duration 20
+    python bench_preprocess.py --model resnet152v2 --modes inline workers --workers 2
+"""
+import io
+import time
+import argparse
+import threading
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from preprocess_pool import PreprocessPipeline, decode_to_array
+
+
+class StubModel:
+    """Stand-in classifier: a softmax over a few pixel statistics (light on CPU and memory)."""
+
+    def __init__(self, num_classes=11):
+        self.num_classes = num_classes
+
+    def predict(self, x, batch_size=None, verbose=0):
+        means = x.mean(axis=(1, 2)) # (N, 3)
+        logits = np.resize(means, (len(x), self.num_classes))
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def make_uploads(count, width, height, quality=90, seed=0):
+    """Encoded JPEG uploads with some texture so they do not compress to nothing."""
+    rng = np.random.default_rng(seed)
+    uploads = []
+    for _ in range(count):
+        base = rng.integers(60, 200, 3)
+        noise = rng.normal(0, 25, (height, width, 1))
+        pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, 'JPEG', quality=quality)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def legacy_predict(model, data, size, method):
+    """The old request-thread path (load_image_array / load_camera_array + model.predict)."""
+    pixels = decode_to_array(data, size, method) # uint8
+    img_array = pixels.astype(np.float32) # image.img_to_array
+    img_array = np.expand_dims(img_array, axis=0)
+    img_array = img_array / 255.0 # New array
+    return model.predict(img_array, verbose=0)[0]
+
+
+def _memory(pid='self'):
+    """(VmRSS, VmHWM, RssShmem) of a process in MB (zeros where /proc is unavailable)."""
+    values = {'VmRSS:': 0.0, 'VmHWM:': 0.0, 'RssShmem:': 0.0}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key = line.split(' ', 1)[0].split('\t', 1)[0]
+                if key in values:
+                    values[key] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return values['VmRSS:'], values['VmHWM:'], values['RssShmem:']
+
+
+class Mode:
+    """One preprocessing path: predict(bytes) plus its decode worker pids."""
+
+    def __init__(self, name, model, size, method, workers, slots, max_batch):
+        self.name = name
+        self.pipeline = None
+        self.model, self.size, self.method = model, size, method
+        if name != 'legacy':
+            self.pipeline = PreprocessPipeline(model, size, workers=workers if name == 'workers' else 0,
+                                               slots=slots, max_batch=max_batch)
+
+    def predict(self, data):
+        if self.pipeline is None:
+            return legacy_predict(self.model, data, self.size, self.method)
+        return self.pipeline.predict(data, method=self.method)
+
+    def worker_pids(self):
+        pool = self.pipeline._pool if self.pipeline is not None else None
+        return list(pool.pids) if pool is not None else []
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+
+def allocations_per_request(mode, uploads, requests):
+    """Peak transient bytes traced per sequential request (median over `requests`)."""
+    for data in uploads[:4]:
+        mode.predict(data) # Warm-up: worker start-up, lazy imports, first-touch buffers
+    tracemalloc.start()
+    peaks = []
+    for i in range(requests):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        mode.predict(uploads[i % len(uploads)])
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return float(np.median(peaks))
+
+
+def sustained_load(mode, uploads, concurrency, duration, sample_every=0.2):
+    """Runs concurrent clients for `duration` seconds, sampling RSS; returns throughput, latency and memory."""
+    stop = threading.Event()
+    latencies, lock = [], threading.Lock()
+
+    def client(offset):
+        i = offset
+        while not stop.is_set():
+            start = time.perf_counter()
+            mode.predict(uploads[i % len(uploads)])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+            i += concurrency
+
+    rss_before = _memory()[0]
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    server, workers = [], []
+    while time.perf_counter() - started < duration:
+        time.sleep(sample_every)
+        server.append(_memory()[0])
+        workers.append(sum(_memory(pid)[0] for pid in mode.worker_pids()))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    ms = np.array(latencies) * 1000
+    return {
+        'requests_per_second': round(len(latencies) / wall, 1),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'rss_start_mb': round(rss_before, 1),
+        'rss_mean_mb': round(float(np.mean(server)), 1),
+        'rss_max_mb': round(float(np.max(server)), 1),
+        'rss_growth_mb': round(float(server[-1] - server[0]), 1), # Steady state should be ~0
+        'workers_rss_mb': round(float(np.mean(workers)), 1),
+        'shared_mb': round(_memory()[2], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocations per request and RSS of the preprocessing paths.")
+    parser.add_argument('--modes', nargs='+', choices=('legacy', 'inline', 'workers'),
+                        default=['legacy', 'inline', 'workers'])
+    parser.add_argument('--method', choices=('cv2', 'keras'), default='cv2', help="Camera (cv2) or upload (keras) decode.")
+    parser.add_argument('--model', default=None, help="Registry spec; default is a NumPy stand-in.")
+    parser.add_argument('--size', type=int, default=224)
+    parser.add_argument('--upload', default='1280x720', help="WIDTHxHEIGHT of the synthetic JPEG uploads.")
+    parser.add_argument('--uploads', type=int, default=16, help="Distinct uploads cycled through.")
+    parser.add_argument('--requests', type=int, default=50, help="Sequential requests traced per mode.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--slots', type=int, default=32)
+    parser.add_argument('--max-batch', type=int, default=8)
+    args = parser.parse_args()
+
+    model, size = StubModel(), (args.size, args.size)
+    if args.model:
+        from model_registry import load_registered_model
+        model, entry = load_registered_model(args.model)
+        size = tuple(entry['target_size'])
+    width, height = (int(v) for v in args.upload.lower().split('x'))
+    uploads = make_uploads(args.uploads, width, height)
+    input_mb = size[0] * size[1] * 3 * 4 / 2**20
+    print(f"{args.uploads} JPEG uploads {width}x{height} (~{np.mean([len(u) for u in uploads]) / 1024:.0f} KB), "
+          f"model input {size[0]}x{size[1]} ({input_mb:.2f} MB float32), method {args.method}")
+    print(f"{'mode':8s} {'alloc/req MB':>12s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'RSS MB':>8s} "
+          f"{'RSS max':>8s} {'growth':>7s} {'workers MB':>11s}")
+    for name in args.modes:
+        mode = Mode(name, model, size, args.method, args.workers, args.slots, args.max_batch)
+        try:
+            allocated = allocations_per_request(mode, uploads, args.requests)
+            r = sustained_load(mode, uploads, args.concurrency, args.duration)
+        finally:
+            mode.close()
+        print(f"{name:8s} {allocated / 2**20:12.2f} {r['requests_per_second']:8.1f} {r['p50_ms']:8.2f} "
+              f"{r['p95_ms']:8.2f} {r['rss_mean_mb']:8.1f} {r['rss_max_mb']:8.1f} {r['rss_growth_mb']:7.1f} "
+              f"{r['workers_rss_mb']:11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+Post-training compression of a saved Keras model.
+
+Two steps, each optional:
+
+1. Structured channel pruning. A Conv2D/Dense layer can lose output
+   channels when its output only passes through per-channel layers
+   (BatchNormalization, activations, padding, pooling, dropout) into a
+   single Conv2D/Dense consumer. In ResNet152V2 that covers the first two
+   convolutions of every bottleneck block and the dense head; the block
+   outputs feed residual additions and are left alone. The channels with
+   the smallest L1 norm (scaled by the following BatchNormalization) are
+   dropped, the kept counts rounded to a multiple of 8, and the model is
+   rebuilt with the smaller layers and sliced weights. Nested models (the
+   app wraps ResNet152V2 as a single layer of its classifier) are walked
+   recursively, each with its own graph. The result is a plain model of the
+   same layer types, so it loads through the usual load_model.
+2. Weight clustering. Every large kernel is replaced by at most N distinct
+   values (k-means on the weights). The in-memory model is unchanged, but
+   the .h5 file compresses far better for shipping. With
+   tensorflow-model-optimization installed, clustering of a flat model is
+   applied during the fine-tuning with tfmot; otherwise (or for nested
+   models, which tfmot cannot wrap) a NumPy k-means runs after it.
+
+The pruned model is fine-tuned briefly on the dataset cache. Load time,
+RSS and single-image latency are measured in fresh processes for the
+original and the compressed model.
+
+Usage:
+    python compress_model.py compress --model resnet152v2 --prune 0.3 --clusters 16 --epochs 2
+    python compress_model.py measure models/resnet152v2_compressed.h5
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import subprocess
+
+import numpy as np
+
+try:
+    import tensorflow_model_optimization as tfmot
+except ImportError:
+    tfmot = None # Clustering then falls back to clustering_numpy after fine-tuning
+
+from dataset_cache import DEFAULT_CACHE_DIR, DatasetCache
+from model_registry import load_class_indices, load_registered_model, register_model
+
+PRUNABLE = ('Conv2D', 'Dense')
+CHANNELWISE = ('BatchNormalization', 'Activation', 'ReLU', 'ZeroPadding2D', 'Dropout', 'MaxPooling2D',
+               'AveragePooling2D', 'GlobalAveragePooling2D')
+CHANNEL_MULTIPLE = 8 # Kept channel counts are rounded to this for vectorised kernels
+
+
+def _inbound_names(value):
+    """Layer names referenced by an inbound_nodes entry (Keras 2 lists or Keras 3 keras_history)."""
+    names = []
+    if isinstance(value, dict):
+        if 'keras_history' in value:
+            return [value['keras_history'][0]]
+        for item in value.values():
+            names.extend(_inbound_names(item))
+    elif isinstance(value, (list, tuple)):
+        if len(value) >= 3 and isinstance(value[0], str) and isinstance(value[1], int):
+            names.append(value[0]) # [layer_name, node_index, tensor_index, ...]
+        else:
+            for item in value:
+                names.extend(_inbound_names(item))
+    return names
+
+
+def _is_model(layer):
+    """True for a nested Functional model used as a layer."""
+    return hasattr(layer, 'layers') and hasattr(layer, 'get_layer')
+
+
+def leaf_layers(model):
+    """Every layer of the model, descending into nested models."""
+    for layer in model.layers:
+        if _is_model(layer):
+            yield from leaf_layers(layer)
+        else:
+            yield layer
+
+
+def layer_graph(model):
+    """
+    Reads the functional graph from the model config.
+    Returns:
+        tuple: ({layer name: [consumer names]}, set of output layer names)
+    """
+    config = model.get_config()
+    consumers = {layer['name']: [] for layer in config['layers']}
+    for layer in config['layers']:
+        for source in dict.fromkeys(_inbound_names(layer.get('inbound_nodes', []))):
+            consumers[source].append(layer['name'])
+    return consumers, set(_inbound_names(config['output_layers']))
+
+
+def prune_plan(model, ratio, prefix=''):
+    """
+    Chooses the channels to keep, recursing into nested models.
+    Args:
+        ratio (float): Share of the output channels removed from each prunable layer.
+        prefix (str): Path of `model` inside the outer model ('resnet152v2/' for a nested one).
+    Returns:
+        dict: {layer path: (kept channel indices, channel-wise layer paths after it, consumer path)},
+            a path being the layer name prefixed with the names of the models around it.
+    """
+    classes = {layer.name: layer.__class__.__name__ for layer in model.layers}
+    consumers, outputs = layer_graph(model)
+    plan = {}
+    for layer in model.layers:
+        if _is_model(layer):
+            plan.update(prune_plan(layer, ratio, f"{prefix}{layer.name}/"))
+            continue
+        if classes[layer.name] not in PRUNABLE or layer.name in outputs or layer.get_config().get('groups', 1) != 1:
+            continue
+        chain, current, consumer = [], layer.name, None
+        while len(consumers[current]) == 1 and current not in outputs:
+            current = consumers[current][0]
+            if classes[current] in CHANNELWISE:
+                chain.append(current)
+                continue
+            if classes[current] in PRUNABLE:
+                consumer = current
+            break
+        if consumer is None:
+            continue
+
+        kernel = layer.get_weights()[0]
+        importance = np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0) # L1 norm of each filter
+        if chain and classes[chain[0]] == 'BatchNormalization':
+            bn = model.get_layer(chain[0])
+            gamma, _, _, variance = bn.get_weights()
+            importance *= np.abs(gamma) / np.sqrt(variance + bn.epsilon) # Scale the filter really has after BN
+        channels = kernel.shape[-1]
+        n_keep = int(round(channels * (1 - ratio) / CHANNEL_MULTIPLE)) * CHANNEL_MULTIPLE
+        n_keep = min(channels, max(CHANNEL_MULTIPLE, n_keep))
+        if n_keep < channels:
+            plan[prefix + layer.name] = (np.sort(np.argsort(-importance)[:n_keep]),
+                                         [prefix + name for name in chain], prefix + consumer)
+    return plan
+
+
+def prune_model(model, ratio):
+    """
+    Returns a rebuilt copy of the model with the pruned layers made smaller.
+    Returns:
+        tuple: (pruned model, plan as returned by prune_plan)
+    """
+    from tensorflow.keras.models import clone_model
+
+    plan = prune_plan(model, ratio)
+    keep_out = {name: keep for name, (keep, _, _) in plan.items()}
+    keep_in = {consumer: keep for keep, _, consumer in plan.values()}
+    keep_channels = {layer: keep for keep, chain, _ in plan.values() for layer in chain}
+
+    def rebuild(source, prefix):
+        def clone(layer):
+            if _is_model(layer):
+                return rebuild(layer, f"{prefix}{layer.name}/")
+            config = layer.get_config()
+            if prefix + layer.name in keep_out:
+                config['filters' if 'filters' in config else 'units'] = len(keep_out[prefix + layer.name])
+            return layer.__class__.from_config(config)
+        return clone_model(source, clone_function=clone)
+
+    def copy_weights(source, target, prefix):
+        for layer in target.layers:
+            path = prefix + layer.name
+            if _is_model(layer):
+                copy_weights(source.get_layer(layer.name), layer, path + '/')
+                continue
+            weights = source.get_layer(layer.name).get_weights()
+            if not weights:
+                continue
+            if path in keep_channels:
+                weights = [w.take(keep_channels[path], axis=-1) for w in weights]
+            elif path in keep_in or path in keep_out:
+                kernel = weights[0]
+                if path in keep_in:
+                    kernel = kernel.take(keep_in[path], axis=-2) # Input channels: axis -2 for Conv2D and Dense
+                if path in keep_out:
+                    kernel = kernel.take(keep_out[path], axis=-1)
+                    weights[1:] = [w.take(keep_out[path], axis=-1) for w in weights[1:]]
+                weights[0] = kernel
+            layer.set_weights(weights)
+
+    pruned = rebuild(model, '')
+    copy_weights(model, pruned, '')
+    return pruned, plan
+
+
+def kmeans_1d(values, clusters=16, iterations=12):
+    """Replaces values by the nearest of `clusters` centroids (1-D k-means, linear initialisation)."""
+    flat = values.ravel()
+    centroids = np.linspace(flat.min(), flat.max(), clusters)
+    for _ in range(iterations):
+        assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, flat) # Centroids stay sorted
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.bincount(assignment, weights=flat, minlength=clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled]
+    assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, flat)
+    return centroids[assignment].reshape(values.shape).astype(values.dtype)
+
+
+def clustering_numpy(model, clusters=16, min_size=4096):
+    """Clusters the kernels of all Conv2D/Dense layers with at least min_size weights, nested ones too, in place."""
+    clustered = 0
+    for layer in leaf_layers(model):
+        if layer.__class__.__name__ not in PRUNABLE:
+            continue
+        weights = layer.get_weights()
+        if weights and weights[0].size >= min_size:
+            weights[0] = kmeans_1d(weights[0], clusters)
+            layer.set_weights(weights)
+            clustered += 1
+    print(f"Clustered the kernels of {clustered} layers to {clusters} values")
+    return model
+
+
+def fine_tune(model, cache, train_rows, val_rows, epochs, batch_size=32, learning_rate=1e-5, seed=42):
+    from tensorflow.keras.optimizers import Adam
+
+    model.compile(optimizer=Adam(learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    model.fit(cache.keras_sequence(train_rows, batch_size, seed=seed),
+              validation_data=cache.keras_sequence(val_rows, batch_size, shuffle=False), epochs=epochs)
+
+
+def compressed_mb(path):
+    """Size of a file after zlib compression (what weight clustering buys on disk and over the wire)."""
+    compressor, size = zlib.compressobj(6), 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            size += len(compressor.compress(chunk))
+    return round((size + len(compressor.flush())) / 2**20, 1)
+
+
+def _memory_mb():
+    """Resident memory in MB: total, private (RssAnon) and file-backed pages shared through the page cache."""
+    fields = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('VmRSS', 'RssAnon', 'RssFile'):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        fields['VmRSS'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Peak, where /proc is missing
+    return fields.get('VmRSS', 0.0), fields.get('RssAnon', 0.0), fields.get('RssFile', 0.0)
+
+
+def measure(path, runs=30, xnnpack=True):
+    """Loads a model the way the app does and times it (run in a fresh process for a fair RSS)."""
+    if path.endswith('.tflite'):
+        from export_model import TFLiteModel, _interpreter_module
+        _interpreter_module() # Import the runtime before the baseline
+        load = lambda: TFLiteModel(path, xnnpack=xnnpack)
+    else:
+        from tensorflow.keras.models import load_model
+        load = lambda: load_model(path, compile=False)
+
+    baseline = _memory_mb()
+    start = time.perf_counter()
+    model = load()
+    load_seconds = time.perf_counter() - start
+    x = np.random.default_rng(0).random((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+    model(x, training=False) # Warm-up
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model(x, training=False)
+        latencies.append(time.perf_counter() - start)
+    rss, anon, shared = (round(after - before, 1) for after, before in zip(_memory_mb(), baseline))
+    return {
+        'load_seconds': round(load_seconds, 2),
+        'rss_mb': rss, # Growth over the process with the runtime imported
+        'rss_anon_mb': anon,
+        'rss_file_mb': shared,
+        'latency_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'params': int(model.count_params()) if hasattr(model, 'count_params') else None,
+        'file_mb': round(os.path.getsize(path) / 2**20, 1),
+    }
+
+
+def measure_in_subprocess(path, extra_args=()):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', path, *extra_args],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compress(model_spec, prune=0.3, clusters=16, epochs=2, cache_dir=DEFAULT_CACHE_DIR, batch_size=32,
+             learning_rate=1e-5, validation_split=0.2, seed=42, output=None):
+    """
+    Prunes, fine-tunes and clusters a registered model and saves it as .h5.
+    Returns:
+        tuple: (output path, report dict, registry entry of the original)
+    """
+    model, entry = load_registered_model(model_spec)
+    cache = DatasetCache(cache_dir, entry['target_size'][0])
+    if load_class_indices(entry) != cache.class_indices:
+        raise ValueError("The dataset cache and the model use different class indices")
+    train_rows, val_rows = cache.split(validation_split, seed)
+    output = output or os.path.join('models', f"{entry['name']}_compressed.h5")
+
+    probs, labels = cache.predict(model, val_rows, batch_size)
+    accuracy_before = float(np.mean(np.argmax(probs, axis=1) == labels))
+
+    params_before = int(model.count_params())
+    pruned_layers = 0
+    if prune:
+        model, plan = prune_model(model, prune)
+        pruned_layers = len(plan)
+        print(f"Pruned {pruned_layers} layers: {params_before:,} -> {model.count_params():,} parameters")
+        if not plan:
+            print("Warning: no layer could be pruned; check the model graph.")
+    params_after = int(model.count_params())
+    # tfmot cannot wrap a model that contains another model
+    use_tfmot = tfmot is not None and not any(_is_model(layer) for layer in model.layers)
+    if clusters and use_tfmot:
+        cluster = tfmot.clustering.keras
+        model = cluster.cluster_weights(model, number_of_clusters=clusters,
+                                        cluster_centroids_init=cluster.CentroidInitialization.LINEAR)
+    if epochs:
+        fine_tune(model, cache, train_rows, val_rows, epochs, batch_size, learning_rate, seed)
+    if clusters:
+        model = cluster.strip_clustering(model) if use_tfmot else clustering_numpy(model, clusters)
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    model.save(output)
+    print(f"Compressed model saved to {output}")
+    probs, _ = cache.predict(model, val_rows, batch_size)
+    accuracy_after = float(np.mean(np.argmax(probs, axis=1) == labels))
+
+    report = {'prune': prune, 'clusters': clusters, 'fine_tune_epochs': epochs, 'val_images': int(len(val_rows)),
+              'pruned_layers': pruned_layers, 'pruned_params': params_before - params_after}
+    for role, path, accuracy in (('original', entry['path'], accuracy_before), ('compressed', output, accuracy_after)):
+        report[role] = dict(measure_in_subprocess(path), val_accuracy=round(accuracy, 4),
+                            compressed_file_mb=compressed_mb(path))
+    return output, report, entry
+
+
+def print_report(report):
+    print(f"\n{'':11s} {'val acc':>8s} {'params':>12s} {'file MB':>8s} {'zlib MB':>8s} {'load s':>7s} "
+          f"{'RSS MB':>7s} {'1-img ms':>9s}")
+    for role in ('original', 'compressed'):
+        r = report[role]
+        print(f"{role:11s} {r['val_accuracy']:8.2%} {r['params']:12,d} {r['file_mb']:8.1f} "
+              f"{r['compressed_file_mb']:8.1f} {r['load_seconds']:7.2f} {r['rss_mb']:7.1f} {r['latency_ms']:9.2f}")
+    if report['prune']:
+        print(f"Pruning removed {report['pruned_params']:,} parameters from {report['pruned_layers']} layers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune and cluster a trained model, then report the savings.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('compress', help="Compress a registered model.")
+    run.add_argument('--model', default='resnet152v2', help="Registry spec or model path.")
+    run.add_argument('--prune', type=float, default=0.3, help="Share of prunable channels removed (0 to skip).")
+    run.add_argument('--clusters', type=int, default=16, help="Distinct values per kernel (0 to skip).")
+    run.add_argument('--epochs', type=int, default=2, help="Fine-tuning epochs after pruning.")
+    run.add_argument('--learning-rate', type=float, default=1e-5)
+    run.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    run.add_argument('--batch-size', type=int, default=32)
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--output', default=None, help="Default: models/<name>_compressed.h5")
+    run.add_argument('--report', default='results/compress_report.json')
+    run.add_argument('--no-register', action='store_true')
+    probe = sub.add_parser('measure', help="Print load time, RSS and latency of a model file as JSON.")
+    probe.add_argument('path')
+    probe.add_argument('--no-xnnpack', action='store_true', help="TFLite only: run without the XNNPACK delegate.")
+    args = parser.parse_args()
+
+    if args.command == 'measure':
+        print(json.dumps(measure(args.path, xnnpack=not args.no_xnnpack)))
+        return
+
+    output, report, source = compress(args.model, args.prune, args.clusters, args.epochs, args.cache_dir, args.batch_size,
+                              args.learning_rate, seed=args.seed, output=args.output)
+    print_report(report)
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+    if not args.no_register:
+        register_model(f"{source['name']}_compressed", output, source['target_size'], fmt='h5',
+                       class_indices=source.get('class_indices'),
+                       metrics={'val_accuracy': report['compressed']['val_accuracy'],
+                                'latency_ms': report['compressed']['latency_ms']},
+                       notes=f"{args.model} pruned {args.prune:.0%}, {args.clusters} weight clusters",
+                       source=args.model)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+SQLite access for the users table, shared by the app and the admin scripts.
+"""
+import sqlite3
+
+DATABASE = 'users.db'
+
+
+def get_db_connection(path=None):
+    """Establishes a connection to the SQLite database."""
+    conn = sqlite3.connect(path or DATABASE)
+    conn.row_factory = sqlite3.Row # Allows accessing columns by name
+    return conn
+
+
+def init_db(path=None):
+    """
+    Creates the users table if it doesn't exist, plus case-insensitive
+    unique indexes on username and email. Registration relies on these
+    constraints instead of looking the names up first, and logins use them
+    through `COLLATE NOCASE` lookups.
+    """
+    conn = get_db_connection(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            registered_at TEXT NOT NULL
+        );
+    ''')
+    for column in ('username', 'email'):
+        try:
+            conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_{column}_nocase '
+                         f'ON users ({column} COLLATE NOCASE)')
+        except sqlite3.IntegrityError:
+            # Existing rows differ only by case; keep the lookups fast and leave the cleanup to an admin
+            print(f"Warning: duplicate {column}s ignoring case; creating a non-unique index instead.")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_users_{column}_nocase_nonunique '
+                         f'ON users ({column} COLLATE NOCASE)')
+    conn.commit()
+    conn.close()
+
+
+def duplicate_field(error):
+    """
+    Tells which unique field an IntegrityError from an INSERT into users hit.
+    Returns:
+        str: 'username', 'email' or None.
+    """
+    message = str(error)
+    for column in ('username', 'email'):
+        if f'users.{column}' in message or f'idx_users_{column}' in message:
+            return column
+    return None
@@ -0,0 +1,307 @@
+"""
+Preprocessed dataset cache for the vitamin deficiency dataset.
+
+The class-folder dataset (one sub-folder per class, as read by
+`flow_from_directory` in the notebooks) is decoded and resized once into a
+memory-mapped uint8 array per target size, together with a label array and
+a small JSON index. Training, evaluation and batch prediction then read
+zero-copy slices of that array instead of decoding every JPEG/PNG again.
+
+Usage:
+    python dataset_cache.py pack --dataset dataset/vitamin_project_dataset --sizes 128 224
+    python dataset_cache.py info --size 224
+"""
+import os
+import json
+import zlib
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_DATASET_DIR = 'dataset/vitamin_project_dataset'
+DEFAULT_CACHE_DIR = 'dataset_cache'
+DEFAULT_SIZES = (128, 224) # 128 for the MobileNet models, 224 for ResNet152V2
+
+# Same extensions Keras' flow_from_directory accepts
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+def _cache_paths(cache_dir, size):
+    """Returns the (images, labels, index) file paths for one target size."""
+    prefix = os.path.join(cache_dir, f'vitamin_{size}')
+    return prefix + '.npy', prefix + '_labels.npy', prefix + '_index.json'
+
+
+def list_dataset(dataset_dir):
+    """
+    Lists the images of a class-folder dataset.
+    Args:
+        dataset_dir (str): Directory with one sub-folder per class.
+    Returns:
+        tuple: (files, labels, class_indices) where files are paths relative
+        to dataset_dir. Classes are sorted alphabetically, matching
+        flow_from_directory so the indices line up with class_indices.json.
+    """
+    classes = sorted(d for d in os.listdir(dataset_dir)
+                     if os.path.isdir(os.path.join(dataset_dir, d)))
+    class_indices = {name: i for i, name in enumerate(classes)}
+    files, labels = [], []
+    for name in classes:
+        for root, _, filenames in sorted(os.walk(os.path.join(dataset_dir, name))):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(os.path.relpath(os.path.join(root, filename), dataset_dir))
+                    labels.append(class_indices[name])
+    return files, labels, class_indices
+
+
+def is_validation(rel, validation_split=0.2, seed=42):
+    """
+    Tells which side of the train/validation split a dataset file is on.
+    The answer hangs only on the seed and the file's relative path, never on
+    the rest of the dataset, so training, evaluation, distillation and
+    compression all agree, and images added later (incremental training)
+    cannot move a validation image into training. Every class ends up with
+    close to `validation_split` of its images in validation.
+    """
+    key = f"{seed}:{rel.replace(os.sep, '/')}".encode('utf-8')
+    return zlib.crc32(key) % 10000 < validation_split * 10000
+
+
+def split_files(files, validation_split=0.2, seed=42):
+    """
+    Train/validation split of a list of dataset-relative paths.
+    Returns:
+        tuple: (train_indices, val_indices) into files, both sorted.
+    """
+    val = np.array([is_validation(rel, validation_split, seed) for rel in files], dtype=bool)
+    return np.flatnonzero(~val), np.flatnonzero(val)
+
+
+def decode_image(path, size):
+    """
+    Decodes an image file into a (size, size, 3) uint8 RGB array.
+    Uses nearest-neighbour resizing, the default of keras' load_img, so the
+    cached pixels are identical to what the generators used to produce.
+    """
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        if img.size != (size, size):
+            img = img.resize((size, size), Image.NEAREST)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def _decode_job(args):
+    """Pool helper: decodes one (path, size) pair."""
+    path, size = args
+    try:
+        return decode_image(path, size)
+    except Exception as e:
+        print(f"Skipping unreadable image {path}: {e}")
+        return None
+
+
+def pack_dataset(dataset_dir=DEFAULT_DATASET_DIR, cache_dir=DEFAULT_CACHE_DIR,
+                 sizes=DEFAULT_SIZES, workers=None):
+    """
+    Decodes the dataset once per target size into memory-mapped .npy files.
+    Args:
+        dataset_dir (str): Class-folder dataset to read.
+        cache_dir (str): Output directory for the cache files.
+        sizes (iterable): Square target sizes to produce.
+        workers (int): Decode processes (defaults to the CPU count).
+    Returns:
+        dict: Number of packed images per size.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    files, labels, class_indices = list_dataset(dataset_dir)
+    if not files:
+        raise ValueError(f"No images found under {dataset_dir}")
+    paths = [os.path.join(dataset_dir, f) for f in files]
+
+    packed = {}
+    with Pool(processes=workers) as pool:
+        for size in sizes:
+            images_path, labels_path, index_path = _cache_paths(cache_dir, size)
+            images = np.lib.format.open_memmap(images_path, mode='w+', dtype=np.uint8,
+                                               shape=(len(paths), size, size, 3))
+            kept = []
+            jobs = ((path, size) for path in paths)
+            for i, pixels in enumerate(pool.imap(_decode_job, jobs, chunksize=16)):
+                if pixels is not None:
+                    images[len(kept)] = pixels
+                    kept.append(i)
+            images.flush()
+            del images
+
+            if len(kept) != len(paths):
+                # Drop the trailing rows left over by unreadable files
+                full = np.load(images_path, mmap_mode='r')
+                trimmed = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                                    shape=(len(kept),) + full.shape[1:])
+                trimmed[:] = full[:len(kept)]
+                trimmed.flush()
+                del trimmed, full
+                os.replace(images_path + '.tmp', images_path)
+
+            np.save(labels_path, np.asarray([labels[i] for i in kept], dtype=np.int32))
+            with open(index_path, 'w') as f:
+                json.dump({
+                    'dataset_dir': os.path.abspath(dataset_dir),
+                    'target_size': [size, size],
+                    'class_indices': class_indices,
+                    'files': [files[i] for i in kept],
+                }, f)
+            packed[size] = len(kept)
+            print(f"Packed {len(kept)} images at {size}x{size} into {images_path}")
+    return packed
+
+
+def to_model_input(batch):
+    """Converts a uint8 batch into the float32 [0, 1] input the models expect."""
+    return np.multiply(batch, 1.0 / 255.0, dtype=np.float32)
+
+
+class DatasetCache:
+    """Read-only view over one packed target size."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, size=224):
+        images_path, labels_path, index_path = _cache_paths(cache_dir, size)
+        if not os.path.exists(images_path):
+            raise FileNotFoundError(f"No dataset cache for size {size} in {cache_dir}; "
+                                    f"run `python dataset_cache.py pack` first.")
+        self.size = size
+        self.images = np.load(images_path, mmap_mode='r') # (N, size, size, 3) uint8, not loaded into RAM
+        self.labels = np.load(labels_path)
+        with open(index_path) as f:
+            index = json.load(f)
+        self.class_indices = index['class_indices']
+        self.files = index['files']
+        self.dataset_dir = index['dataset_dir']
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def num_classes(self):
+        return len(self.class_indices)
+
+    @property
+    def class_labels(self):
+        """Class names ordered by index."""
+        return sorted(self.class_indices, key=self.class_indices.get)
+
+    def split(self, validation_split=0.2, seed=42):
+        """
+        Train/validation split of the cache row indices (see is_validation).
+        Returns:
+            tuple: (train_indices, val_indices), each sorted so that batches
+            over them stay as contiguous as possible.
+        """
+        return split_files(self.files, validation_split, seed)
+
+    def batches(self, indices=None, batch_size=32):
+        """
+        Yields (images, labels, rows) batches.
+        Without indices the batches are plain slices of the memory map, so no
+        pixel data is copied until the caller touches it. With an index array
+        each contiguous run is still sliced; only scattered rows are gathered.
+        """
+        if indices is None:
+            for start in range(0, len(self), batch_size):
+                stop = min(start + batch_size, len(self))
+                yield self.images[start:stop], self.labels[start:stop], np.arange(start, stop)
+            return
+        indices = np.asarray(indices)
+        for start in range(0, len(indices), batch_size):
+            rows = indices[start:start + batch_size]
+            if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+                yield self.images[rows[0]:rows[-1] + 1], self.labels[rows], rows
+            else:
+                yield self.images[rows], self.labels[rows], rows
+
+    def predict(self, model, indices=None, batch_size=32):
+        """
+        Runs batch prediction over the cache.
+        Returns:
+            tuple: (probabilities, true_labels) as numpy arrays.
+        """
+        probs, labels = [], []
+        for images, batch_labels, _ in self.batches(indices, batch_size):
+            probs.append(model.predict(to_model_input(images), verbose=0))
+            labels.append(batch_labels)
+        return np.concatenate(probs), np.concatenate(labels)
+
+    def keras_sequence(self, indices=None, batch_size=32, shuffle=True, augment=None, seed=None,
+                       soft_targets=None):
+        """
+        Builds a keras Sequence for model.fit / model.evaluate.
+        Args:
+            indices: Rows to use (defaults to the whole cache).
+            shuffle (bool): Reshuffle the rows at the end of every epoch.
+            augment (callable): Optional fn(float_batch) -> float_batch.
+            soft_targets: Optional (N, num_classes) array aligned with the cache
+                rows (e.g. teacher logits); batches then yield (x, (y, soft)).
+        """
+        from tensorflow.keras.utils import Sequence, to_categorical
+
+        cache = self
+        rows = np.arange(len(self)) if indices is None else np.asarray(indices)
+
+        class _CacheSequence(Sequence):
+            def __init__(self):
+                super().__init__()
+                self.rows = rows.copy()
+                self.rng = np.random.default_rng(seed)
+                if shuffle:
+                    self.rng.shuffle(self.rows)
+
+            def __len__(self):
+                return int(np.ceil(len(self.rows) / batch_size))
+
+            def __getitem__(self, i):
+                batch_rows = np.sort(self.rows[i * batch_size:(i + 1) * batch_size])
+                x = to_model_input(cache.images[batch_rows])
+                if augment is not None:
+                    x = augment(x)
+                y = to_categorical(cache.labels[batch_rows], cache.num_classes)
+                if soft_targets is not None:
+                    return x, (y, soft_targets[batch_rows])
+                return x, y
+
+            def on_epoch_end(self):
+                if shuffle:
+                    self.rng.shuffle(self.rows)
+
+        return _CacheSequence()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack or inspect the preprocessed dataset cache.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pack = sub.add_parser('pack', help="Decode the dataset into memory-mapped arrays.")
+    pack.add_argument('--dataset', default=DEFAULT_DATASET_DIR)
+    pack.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    pack.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    pack.add_argument('--workers', type=int, default=None)
+
+    info = sub.add_parser('info', help="Print a summary of a packed size.")
+    info.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    info.add_argument('--size', type=int, default=224)
+
+    args = parser.parse_args()
+    if args.command == 'pack':
+        pack_dataset(args.dataset, args.cache_dir, args.sizes, args.workers)
+    else:
+        cache = DatasetCache(args.cache_dir, args.size)
+        counts = np.bincount(cache.labels, minlength=cache.num_classes)
+        print(f"{len(cache)} images at {cache.size}x{cache.size} from {cache.dataset_dir}")
+        for name in cache.class_labels:
+            print(f"  {cache.class_indices[name]:2d}  {name}: {counts[cache.class_indices[name]]}")
+
+
+if __name__ == '__main__':
+    main()
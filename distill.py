@@ -0,0 +1,285 @@
+"""
+Knowledge distillation of the ResNet152V2 model into a small CPU student.
+
+The fine-tuned ResNet152V2 (2048-1024 dense head, ~60M parameters) is too
+heavy for CPU-only serving. This trains a MobileNetV2 at 128x128, built like
+the transfer model in deficiency.ipynb, on the teacher's soft labels:
+
+    loss = alpha * CE(y, student) + (1 - alpha) * T^2 * CE(softmax(teacher / T), softmax(student / T))
+
+The teacher is run once over the 224x224 dataset cache and its log
+probabilities are kept next to the cache, so every epoch only runs the
+student on the 128x128 cache (pack both sizes first with
+`python dataset_cache.py pack --sizes 128 224`). The student is saved as a
+plain softmax .h5 model and registered, and a report compares accuracy,
+parameter count and CPU throughput of teacher and student.
+
+Usage:
+    python distill.py --teacher resnet152v2 --epochs 20 --fine-tune-epochs 5
+    python distill.py --teacher resnet152v2 --width 0.5 --name student_mobilenetv2_050
+"""
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from dataset_cache import DEFAULT_CACHE_DIR, DatasetCache
+from model_registry import load_class_indices, load_registered_model, register_model
+
+
+def teacher_logits(teacher, entry, cache_dir=DEFAULT_CACHE_DIR, batch_size=32):
+    """
+    Returns the teacher's log probabilities for every row of its dataset cache,
+    columns in dataset class order. Computed once and saved next to the cache.
+    Args:
+        teacher, entry: As returned by load_registered_model.
+    Returns:
+        np.ndarray: (N, num_classes) float32 logits.
+    """
+    size = entry['target_size'][0]
+    cache = DatasetCache(cache_dir, size)
+    path = os.path.join(cache_dir, f"teacher_{entry['name']}_{entry.get('version')}_{size}.npy")
+    if os.path.exists(path):
+        logits = np.load(path)
+        if len(logits) == len(cache):
+            print(f"Using teacher outputs from {path}")
+            return logits
+
+    print(f"Running teacher {entry['name']} over {len(cache)} cached images at {size}x{size}...")
+    probs, _ = cache.predict(teacher, batch_size=batch_size)
+    teacher_indices = load_class_indices(entry)
+    columns = [teacher_indices[name] for name in cache.class_labels] # Teacher column of each dataset class
+    logits = np.log(np.clip(probs[:, columns], 1e-7, 1.0)).astype(np.float32) # Logits up to a constant
+    np.save(path, logits)
+    return logits
+
+
+def build_student(num_classes, size=128, width=1.0, hidden=128):
+    """
+    MobileNetV2 student with the head of deficiency.ipynb.
+    Returns:
+        tuple: (model with softmax output, model with logits output, frozen base)
+    """
+    from tensorflow.keras.applications import MobileNetV2
+    from tensorflow.keras.layers import Activation, Dense, GlobalAveragePooling2D
+    from tensorflow.keras.models import Model
+
+    base = MobileNetV2(input_shape=(size, size, 3), include_top=False, weights='imagenet', alpha=width)
+    base.trainable = False
+    x = GlobalAveragePooling2D()(base.output)
+    x = Dense(hidden, activation='relu')(x)
+    logits = Dense(num_classes, name='logits')(x)
+    output = Activation('softmax', name='probabilities')(logits)
+    return Model(base.input, output), Model(base.input, logits), base
+
+
+def build_distiller(student_logits, temperature=4.0, alpha=0.1):
+    """
+    Wraps the student's logits model in a keras Model whose train_step
+    applies the distillation loss. Batches are (x, (y_onehot, teacher_logits)).
+    """
+    import tensorflow as tf
+
+    class Distiller(tf.keras.Model):
+        def __init__(self):
+            super().__init__()
+            self.student = student_logits
+            self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+            self.accuracy = tf.keras.metrics.CategoricalAccuracy(name='accuracy')
+
+        @property
+        def metrics(self):
+            return [self.loss_tracker, self.accuracy]
+
+        def call(self, x, training=False):
+            return self.student(x, training=training)
+
+        def _loss(self, y, soft, logits):
+            hard_loss = tf.keras.losses.categorical_crossentropy(y, logits, from_logits=True)
+            soft_loss = tf.keras.losses.categorical_crossentropy(tf.nn.softmax(soft / temperature),
+                                                                 logits / temperature, from_logits=True)
+            return tf.reduce_mean(alpha * hard_loss + (1 - alpha) * temperature ** 2 * soft_loss)
+
+        def _update(self, loss, y, logits):
+            self.loss_tracker.update_state(loss)
+            self.accuracy.update_state(y, logits)
+            return {m.name: m.result() for m in self.metrics}
+
+        def train_step(self, data):
+            x, (y, soft) = data
+            with tf.GradientTape() as tape:
+                logits = self.student(x, training=True)
+                loss = self._loss(y, soft, logits)
+            variables = self.student.trainable_variables
+            self.optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+            return self._update(loss, y, logits)
+
+        def test_step(self, data):
+            x, (y, soft) = data
+            logits = self.student(x, training=False)
+            return self._update(self._loss(y, soft, logits), y, logits)
+
+    return Distiller()
+
+
+def random_flip(batch, rng):
+    """Flips a random half of a float batch horizontally (the notebook's horizontal_flip)."""
+    flip = rng.random(len(batch)) < 0.5
+    batch[flip] = batch[flip, :, ::-1]
+    return batch
+
+
+def cpu_throughput(model, size, batch_size=32, rounds=5, single_runs=50):
+    """
+    Measures batch throughput and single-image latency on the CPU.
+    Returns:
+        dict: images_per_second and latency_ms (p50 of single-image calls).
+    """
+    import tensorflow as tf
+
+    x = np.random.default_rng(0).random((batch_size, size, size, 3), dtype=np.float32)
+    with tf.device('/CPU:0'):
+        model.predict(x, batch_size=batch_size, verbose=0) # Warm-up
+        start = time.perf_counter()
+        for _ in range(rounds):
+            model.predict(x, batch_size=batch_size, verbose=0)
+        batch_seconds = time.perf_counter() - start
+        single = x[:1]
+        model(single, training=False)
+        latencies = []
+        for _ in range(single_runs):
+            start = time.perf_counter()
+            model(single, training=False)
+            latencies.append(time.perf_counter() - start)
+    return {
+        'images_per_second': round(rounds * batch_size / batch_seconds, 1),
+        'latency_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+    }
+
+
+def distill(teacher_spec, cache_dir=DEFAULT_CACHE_DIR, size=128, width=1.0, temperature=4.0, alpha=0.1,
+            epochs=20, fine_tune_epochs=5, unfreeze=30, batch_size=32, validation_split=0.2, seed=42,
+            output='models/student_mobilenetv2_128.h5'):
+    """
+    Trains and saves the student.
+    Returns:
+        tuple: (student model, report dict)
+    """
+    from tensorflow.keras.optimizers import Adam
+
+    teacher, teacher_entry = load_registered_model(teacher_spec)
+    logits = teacher_logits(teacher, teacher_entry, cache_dir, batch_size)
+    cache = DatasetCache(cache_dir, size)
+    teacher_cache = DatasetCache(cache_dir, teacher_entry['target_size'][0])
+    if cache.files != teacher_cache.files:
+        raise ValueError(f"The {size} and {teacher_cache.size} dataset caches hold different images; "
+                         f"pack both sizes from the same dataset in one run.")
+    train_rows, val_rows = cache.split(validation_split, seed)
+    rng = np.random.default_rng(seed)
+    train = cache.keras_sequence(train_rows, batch_size, augment=lambda x: random_flip(x, rng), seed=seed,
+                                 soft_targets=logits)
+    val = cache.keras_sequence(val_rows, batch_size, shuffle=False, soft_targets=logits)
+
+    student, student_logits, base = build_student(cache.num_classes, size, width)
+    distiller = build_distiller(student_logits, temperature, alpha)
+    distiller.compile(optimizer=Adam())
+    distiller.fit(train, validation_data=val, epochs=epochs)
+    if fine_tune_epochs:
+        # Unfreeze the top of the base; BatchNormalization keeps its ImageNet statistics
+        base.trainable = True
+        for layer in base.layers[:-unfreeze]:
+            layer.trainable = False
+        for layer in base.layers:
+            if layer.__class__.__name__ == 'BatchNormalization':
+                layer.trainable = False
+        distiller.compile(optimizer=Adam(1e-5))
+        distiller.fit(train, validation_data=val, epochs=fine_tune_epochs)
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    student.save(output)
+    with open(os.path.splitext(output)[0] + '_class_indices.json', 'w') as f:
+        json.dump(cache.class_indices, f, indent=4)
+    print(f"Student saved to {output}")
+
+    probs, labels = cache.predict(student, val_rows, batch_size)
+    teacher_pred = np.argmax(logits[val_rows], axis=1)
+    student_pred = np.argmax(probs, axis=1)
+    report = {
+        'teacher': {
+            'model': teacher_spec,
+            'input_size': teacher_cache.size,
+            'val_accuracy': round(float(np.mean(teacher_pred == labels)), 4),
+            'params': int(teacher.count_params()),
+            'file_mb': round(os.path.getsize(teacher_entry['path']) / 2**20, 1),
+            **cpu_throughput(teacher, teacher_cache.size, batch_size),
+        },
+        'student': {
+            'model': f"MobileNetV2 x{width}",
+            'input_size': size,
+            'val_accuracy': round(float(np.mean(student_pred == labels)), 4),
+            'params': int(student.count_params()),
+            'file_mb': round(os.path.getsize(output) / 2**20, 1),
+            **cpu_throughput(student, size, batch_size),
+        },
+        'agreement': round(float(np.mean(student_pred == teacher_pred)), 4), # Student matches the teacher's top class
+        'val_images': int(len(val_rows)),
+        'temperature': temperature,
+        'alpha': alpha,
+    }
+    return student, report
+
+
+def print_report(report):
+    print(f"\n{'':10s} {'val acc':>8s} {'params':>12s} {'file MB':>8s} {'img/s CPU':>10s} {'1-img ms':>9s}")
+    for role in ('teacher', 'student'):
+        r = report[role]
+        print(f"{role:10s} {r['val_accuracy']:8.2%} {r['params']:12,d} {r['file_mb']:8.1f} "
+              f"{r['images_per_second']:10.1f} {r['latency_ms']:9.2f}")
+    speedup = report['student']['images_per_second'] / max(report['teacher']['images_per_second'], 1e-9)
+    print(f"Student agrees with the teacher on {report['agreement']:.2%} of {report['val_images']} validation "
+          f"images and is {speedup:.1f}x faster on CPU.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the ResNet152V2 teacher into a MobileNetV2 student.")
+    parser.add_argument('--teacher', default='resnet152v2', help="Registry spec of the teacher.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--size', type=int, default=128, help="Student input size (a packed cache size).")
+    parser.add_argument('--width', type=float, default=1.0, help="MobileNetV2 width multiplier (0.35-1.4).")
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.1, help="Weight of the hard-label loss.")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--fine-tune-epochs', type=int, default=5)
+    parser.add_argument('--unfreeze', type=int, default=30, help="Top base layers trained while fine-tuning.")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--name', default='student_mobilenetv2', help="Registry name of the student.")
+    parser.add_argument('--output', default=None, help="Student .h5 path (default: models/<name>_<size>.h5).")
+    parser.add_argument('--report', default='results/distill_report.json')
+    parser.add_argument('--no-register', action='store_true')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join('models', f"{args.name}_{args.size}.h5")
+    _, report = distill(args.teacher, args.cache_dir, args.size, args.width, args.temperature, args.alpha,
+                        args.epochs, args.fine_tune_epochs, args.unfreeze, args.batch_size,
+                        args.validation_split, args.seed, output)
+    print_report(report)
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+    if not args.no_register:
+        register_model(args.name, output, (args.size, args.size), fmt='h5',
+                       class_indices=os.path.splitext(output)[0] + '_class_indices.json',
+                       metrics={'val_accuracy': report['student']['val_accuracy'],
+                                'agreement': report['agreement'],
+                                'images_per_second': report['student']['images_per_second']},
+                       notes=f"MobileNetV2 x{args.width} distilled from {args.teacher} (T={args.temperature})",
+                       teacher=args.teacher)
+
+
+if __name__ == '__main__':
+    main()
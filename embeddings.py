@@ -0,0 +1,254 @@
+"""
+Penultimate-layer embeddings and a nearest-neighbour index for similar-case lookup.
+
+Both architectures (ResNet152V2 in vitamin-training.ipynb and MobileNetV2 in
+deficiency.ipynb) pool the backbone features with GlobalAveragePooling2D
+before the dense head. build_embedding_model() exposes that pooled vector as
+a second output of the serving model, so a single forward pass gives both
+the class probabilities and the embedding.
+
+VectorIndex stores L2-normalised embeddings of the reference dataset in a
+memory-mapped float32 file and searches it with an inverted-file (IVF)
+scheme: vectors are bucketed by their nearest k-means centroid and a query
+only scores the buckets of its `n_probe` closest centroids.
+
+Usage:
+    python embeddings.py build --model resnet152v2 --use-cache
+    python embeddings.py add --model resnet152v2 --label "Vitamin C deficiency" \
+        "dataset/vitamin_project_dataset/Vitamin C deficiency/new_"*.jpg
+
+Added images must already be inside the dataset root the index was built
+from, since that is the only place /similar serves them from.
+"""
+import os
+import json
+import argparse
+import threading
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = 'embedding_index'
+
+
+def build_embedding_model(model):
+    """
+    Wraps a trained classifier so predict() returns [probabilities, embeddings].
+    Raises:
+        ValueError: If the model has no GlobalAveragePooling2D layer.
+    """
+    from tensorflow.keras.layers import GlobalAveragePooling2D
+    from tensorflow.keras.models import Model
+
+    pooling = [layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D)]
+    if not pooling:
+        raise ValueError("Model has no GlobalAveragePooling2D layer to take embeddings from")
+    return Model(inputs=model.inputs, outputs=[model.output, pooling[-1].output])
+
+
+def normalize(vectors):
+    """L2-normalises rows so that a dot product is the cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """Spherical k-means on normalised vectors; returns (k, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # Re-seed empty clusters so every bucket stays useful
+                centroids[c] = vectors[rng.integers(len(vectors))]
+        centroids = normalize(centroids)
+    return centroids
+
+
+class VectorIndex:
+    """
+    IVF index over a memory-mapped float32 vector file.
+
+    Files in the index directory:
+        meta.json     dim, source model, dataset root
+        centroids.npy (n_lists, dim) float32
+        vectors.f32   appended rows, memory-mapped read-only
+        lists.i32     bucket id of every row
+        items.jsonl   one {"path", "label"} record per row
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.dim = self.meta['dim']
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        self._lock = threading.Lock()
+        self._size_on_disk = -1
+        self._reload()
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    @classmethod
+    def create(cls, index_dir, vectors, items, n_lists=32, **meta):
+        """
+        Builds a new index from an initial set of vectors.
+        Args:
+            vectors: (N, dim) embeddings.
+            items (list): One {"path", "label"} dict per vector.
+            n_lists (int): Number of IVF buckets.
+            **meta: Extra metadata to keep (model spec, dataset root, ...).
+        """
+        vectors = normalize(vectors)
+        os.makedirs(index_dir, exist_ok=True)
+        n_lists = max(1, min(n_lists, len(vectors)))
+        np.save(os.path.join(index_dir, 'centroids.npy'), kmeans(vectors, n_lists))
+        with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, dim=int(vectors.shape[1]), n_lists=n_lists), f, indent=2)
+        for name in ('vectors.f32', 'lists.i32', 'items.jsonl'):
+            open(os.path.join(index_dir, name), 'wb').close()
+        index = cls(index_dir)
+        index.add(vectors, items)
+        return index
+
+    @classmethod
+    def open(cls, index_dir=DEFAULT_INDEX_DIR):
+        """Opens an existing index; raises FileNotFoundError if there is none."""
+        if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+            raise FileNotFoundError(f"No embedding index in {index_dir}")
+        return cls(index_dir)
+
+    def _reload(self):
+        """Re-maps the files when another process (or add()) has appended rows."""
+        size = os.path.getsize(self._path('vectors.f32'))
+        if size == self._size_on_disk:
+            return
+        count = size // (4 * self.dim)
+        if count:
+            self.vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r', shape=(count, self.dim))
+            lists = np.fromfile(self._path('lists.i32'), dtype=np.int32)[:count]
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            lists = np.zeros(0, dtype=np.int32)
+        with open(self._path('items.jsonl')) as f:
+            self.items = [json.loads(line) for line in f][:count]
+        # Row ids per bucket, so a probe never scans the whole file
+        order = np.argsort(lists, kind='stable')
+        bounds = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+        self.buckets = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        self._size_on_disk = size
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, vectors, items):
+        """
+        Appends vectors incrementally; existing rows are never rewritten.
+        The vector file is written last, because its size defines the row count
+        other readers see.
+        """
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embeddings, got {vectors.shape[1]}")
+        if len(vectors) != len(items):
+            raise ValueError("Need exactly one item per vector")
+        lists = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        with self._lock:
+            with open(self._path('items.jsonl'), 'a') as f:
+                for item in items:
+                    f.write(json.dumps(item) + '\n')
+            with open(self._path('lists.i32'), 'ab') as f:
+                f.write(lists.tobytes())
+            with open(self._path('vectors.f32'), 'ab') as f:
+                f.write(vectors.tobytes())
+            self._reload()
+
+    def search(self, query, k=5, n_probe=4):
+        """
+        Approximate nearest neighbours by cosine similarity.
+        Returns:
+            list: Up to k dicts {"id", "score", "path", "label"}, best first.
+        """
+        query = normalize(query).reshape(-1)
+        with self._lock:
+            self._reload()
+            vectors, items, buckets = self.vectors, self.items, self.buckets
+        if not len(items):
+            return []
+        probe = np.argsort(self.centroids @ query)[::-1][:n_probe]
+        candidates = np.sort(np.concatenate([buckets[c] for c in probe]))
+        if not len(candidates):
+            return []
+        scores = vectors[candidates] @ query
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [dict(items[candidates[i]], id=int(candidates[i]), score=float(scores[i])) for i in top]
+
+
+def embed_batches(embedding_model, batches):
+    """Runs the two-output model over uint8 batches and returns the stacked embeddings."""
+    from dataset_cache import to_model_input
+
+    return np.concatenate([embedding_model.predict(to_model_input(images), verbose=0)[1] for images in batches])
+
+
+def main():
+    from dataset_cache import DEFAULT_CACHE_DIR, DEFAULT_DATASET_DIR, DatasetCache, decode_image, list_dataset
+    from model_registry import load_registered_model
+
+    parser = argparse.ArgumentParser(description="Build or extend the similar-case embedding index.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Embed the reference dataset into a new index.")
+    build.add_argument('--model', required=True)
+    build.add_argument('--dataset', default=DEFAULT_DATASET_DIR)
+    build.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    build.add_argument('--use-cache', action='store_true')
+    build.add_argument('--lists', type=int, default=32)
+    build.add_argument('--batch-size', type=int, default=32)
+    build.add_argument('--index-dir', default=DEFAULT_INDEX_DIR)
+    add = sub.add_parser('add', help="Append new reference images to an existing index.")
+    add.add_argument('--model', required=True)
+    add.add_argument('--label', required=True, help="Class name of the images being added.")
+    add.add_argument('--index-dir', default=DEFAULT_INDEX_DIR)
+    add.add_argument('images', nargs='+')
+    args = parser.parse_args()
+
+    model, entry = load_registered_model(args.model)
+    embedding_model = build_embedding_model(model)
+    size = entry['target_size'][0]
+
+    if args.command == 'build':
+        if args.use_cache:
+            cache = DatasetCache(args.cache_dir, size)
+            files, labels, class_indices, root = cache.files, cache.labels, cache.class_indices, cache.dataset_dir
+            batches = (images for images, _, _ in cache.batches(batch_size=args.batch_size))
+        else:
+            files, labels, class_indices = list_dataset(args.dataset)
+            root = os.path.abspath(args.dataset)
+            batches = (np.stack([decode_image(os.path.join(root, f), size) for f in files[i:i + args.batch_size]])
+                       for i in range(0, len(files), args.batch_size))
+        names = sorted(class_indices, key=class_indices.get)
+        vectors = embed_batches(embedding_model, batches)
+        items = [{'path': f, 'label': names[l]} for f, l in zip(files, labels)]
+        index = VectorIndex.create(args.index_dir, vectors, items, args.lists, model=args.model, dataset_dir=root)
+    else:
+        index = VectorIndex.open(args.index_dir)
+        root = os.path.abspath(index.meta['dataset_dir']) if index.meta.get('dataset_dir') else None
+        # /similar/image serves files from the dataset root only, so the images must live under it
+        outside = [p for p in args.images if root is None or os.path.commonpath([os.path.abspath(p), root]) != root]
+        if outside:
+            parser.error(f"Images must be inside the index's dataset root ({root or 'none recorded'}); "
+                         f"copy them there first: {', '.join(outside)}")
+        vectors = embed_batches(embedding_model, [np.stack([decode_image(p, size) for p in args.images])])
+        items = [{'path': os.path.relpath(os.path.abspath(p), root), 'label': args.label} for p in args.images]
+        index.add(vectors, items)
+    print(f"Index at {args.index_dir} now holds {len(index)} vectors")
+
+
+if __name__ == '__main__':
+    main()
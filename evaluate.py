@@ -0,0 +1,222 @@
+"""
+Command-line evaluation runner.
+
+Replaces the evaluation cells of vitamin-training.ipynb (model.evaluate,
+classification_report, confusion_matrix). By default only the validation
+split is scored (the same file-keyed split train.py, distill.py and
+compress_model.py hold out), since the rest are the model's own training
+images; --split all is meant for a separate held-out --dataset folder.
+The images are streamed through a pool of decode processes in batches
+while the main process runs the model, so decoding and inference overlap.
+If a dataset cache exists for the model's input size (see dataset_cache.py)
+it is used instead and nothing is decoded at all.
+
+Usage:
+    python evaluate.py --model resnet152v2 --dataset dataset/vitamin_project_dataset
+    python evaluate.py --model mobilenet:1 --use-cache --output results/mobilenet.json
+    python evaluate.py --model resnet152v2 --dataset dataset/clinic_holdout --split all
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+from itertools import islice
+from collections import deque
+
+import numpy as np
+
+from dataset_cache import (DEFAULT_CACHE_DIR, DEFAULT_DATASET_DIR, DatasetCache,
+                           decode_image, list_dataset, split_files, to_model_input)
+from model_registry import load_class_indices, load_registered_model
+
+
+def _decode_batch(args):
+    """Pool worker: decodes one batch of images, returning (rows, pixels, decode_seconds)."""
+    rows, paths, size = args
+    start = time.perf_counter()
+    kept, pixels = [], []
+    for row, path in zip(rows, paths):
+        try:
+            pixels.append(decode_image(path, size))
+            kept.append(row)
+        except Exception as e:
+            print(f"Skipping unreadable image {path}: {e}")
+    if not pixels:
+        return np.asarray(kept, dtype=np.int64), np.zeros((0, size, size, 3), dtype=np.uint8), 0.0
+    return np.asarray(kept), np.stack(pixels), time.perf_counter() - start
+
+
+def stream_from_dataset(dataset_dir, files, rows, size, batch_size, workers):
+    """
+    Yields (rows, uint8 batch, decode_seconds) decoded by a process pool.
+    A sliding window keeps `workers` batches submitted at a time, so the
+    next batches are being decoded while the current one is on the model,
+    but decoded batches never pile up when the model is the slower side
+    (Pool.imap would queue every batch up front).
+    """
+    jobs = ((rows[i:i + batch_size], [os.path.join(dataset_dir, files[r]) for r in rows[i:i + batch_size]], size)
+            for i in range(0, len(rows), batch_size))
+    # spawn, not fork: the parent already holds TensorFlow's thread pools
+    with mp.get_context('spawn').Pool(processes=workers) as pool:
+        pending = deque(pool.apply_async(_decode_batch, (job,)) for job in islice(jobs, workers))
+        while pending:
+            result = pending.popleft().get()
+            for job in islice(jobs, 1): # Refill the window before handing the batch to the model
+                pending.append(pool.apply_async(_decode_batch, (job,)))
+            yield result
+
+
+def stream_from_cache(cache, rows, batch_size):
+    """Yields (rows, uint8 batch, 0.0) straight from the memory-mapped cache."""
+    for images, _, batch_rows in cache.batches(rows, batch_size):
+        yield batch_rows, images, 0.0
+
+
+def classification_metrics(y_true, y_pred, probs, class_labels):
+    """Computes accuracy, loss, the classification report and the confusion matrix."""
+    from sklearn.metrics import classification_report, confusion_matrix
+
+    labels = list(range(len(class_labels)))
+    eps = 1e-7
+    loss = float(-np.mean(np.log(np.clip(probs[np.arange(len(y_true)), y_true], eps, 1.0))))
+    return {
+        'accuracy': float(np.mean(y_true == y_pred)),
+        'loss': loss,
+        'classification_report': classification_report(y_true, y_pred, labels=labels, target_names=class_labels,
+                                                        output_dict=True, zero_division=0),
+        'confusion_matrix': confusion_matrix(y_true, y_pred, labels=labels).tolist(),
+    }
+
+
+def latency_by_class(y_true, per_image_seconds, class_labels):
+    """Per-class latency summary in milliseconds (amortized over each batch)."""
+    summary = {}
+    for index, name in enumerate(class_labels):
+        times = per_image_seconds[y_true == index] * 1000.0
+        if len(times) == 0:
+            continue
+        summary[name] = {
+            'count': int(len(times)),
+            'mean_ms': float(np.mean(times)),
+            'p50_ms': float(np.percentile(times, 50)),
+            'p95_ms': float(np.percentile(times, 95)),
+        }
+    return summary
+
+
+def validation_rows(files, validation_split=0.2, seed=42):
+    """Rows of the validation split, the same one train.py, distill.py and compress_model.py use."""
+    return split_files(files, validation_split, seed)[1]
+
+
+def evaluate(model_spec, dataset_dir=DEFAULT_DATASET_DIR, cache_dir=DEFAULT_CACHE_DIR, use_cache=False,
+             split='val', validation_split=0.2, seed=42, batch_size=32, workers=None):
+    """
+    Evaluates one registered model on the dataset.
+    Args:
+        split (str): 'val' scores the held-out validation split; 'all' every image,
+            which only makes sense for a dataset the model was not trained on.
+    Returns:
+        dict: Machine-readable results (metrics, confusion matrix, latency).
+    """
+    model, entry = load_registered_model(model_spec)
+    size = entry['target_size'][0]
+    model_indices = load_class_indices(entry)
+    class_labels = sorted(model_indices, key=model_indices.get)
+
+    cache = None
+    if use_cache:
+        cache = DatasetCache(cache_dir, size)
+        files, labels, data_indices = cache.files, cache.labels, cache.class_indices
+    else:
+        files, labels, data_indices = list_dataset(dataset_dir)
+    # Map dataset folder indices onto the model's own class indices
+    to_model_index = np.array([model_indices[name] for name in sorted(data_indices, key=data_indices.get)])
+    labels = to_model_index[np.asarray(labels)]
+
+    rows = np.arange(len(labels))
+    if split == 'val':
+        rows = validation_rows(files, validation_split, seed)
+
+    if cache is not None:
+        stream = stream_from_cache(cache, rows, batch_size)
+    else:
+        stream = stream_from_dataset(dataset_dir, files, rows, size, batch_size, workers or os.cpu_count())
+
+    probs = np.zeros((len(rows), len(class_labels)), dtype=np.float32)
+    per_image_seconds = np.zeros(len(rows))
+    position = {row: i for i, row in enumerate(rows)}
+    decode_seconds = 0.0
+    started = time.perf_counter()
+    evaluated = np.zeros(len(rows), dtype=bool)
+    for batch_rows, pixels, decode_time in stream:
+        decode_seconds += decode_time
+        if len(batch_rows) == 0:
+            continue
+        start = time.perf_counter()
+        batch_probs = model.predict(to_model_input(pixels), verbose=0)
+        elapsed = time.perf_counter() - start
+        slots = [position[row] for row in batch_rows]
+        probs[slots] = batch_probs
+        per_image_seconds[slots] = elapsed / len(batch_rows)
+        evaluated[slots] = True
+    wall_seconds = time.perf_counter() - started
+
+    # Unreadable images are left out of the metrics
+    rows, probs, per_image_seconds = rows[evaluated], probs[evaluated], per_image_seconds[evaluated]
+    y_true = labels[rows]
+    y_pred = np.argmax(probs, axis=1)
+    results = {
+        'model': {k: entry.get(k) for k in ('name', 'version', 'path', 'format', 'target_size')},
+        'dataset': cache.dataset_dir if cache is not None else os.path.abspath(dataset_dir),
+        'split': split,
+        'num_images': int(len(rows)),
+        'class_labels': class_labels,
+        **classification_metrics(y_true, y_pred, probs, class_labels),
+        'latency_by_class': latency_by_class(y_true, per_image_seconds, class_labels),
+        'throughput': {
+            'wall_seconds': wall_seconds,
+            'images_per_second': len(rows) / wall_seconds if wall_seconds else 0.0,
+            'inference_seconds': float(per_image_seconds.sum()),
+            'decode_cpu_seconds': decode_seconds,
+        },
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a registered model on the vitamin dataset.")
+    parser.add_argument('--model', required=True, help="Registry spec (name or name:version) or a model path.")
+    parser.add_argument('--dataset', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--use-cache', action='store_true', help="Read the packed dataset cache instead of decoding.")
+    parser.add_argument('--split', choices=('val', 'all'), default='val',
+                        help="'val': the validation split training held out; 'all': every image of a held-out --dataset.")
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: CPU count).")
+    parser.add_argument('--output', default=None, help="Write the JSON results here.")
+    args = parser.parse_args()
+    if args.split == 'all' and os.path.abspath(args.dataset) == os.path.abspath(DEFAULT_DATASET_DIR):
+        print("Warning: --split all on the training dataset scores the model on its own training images.")
+
+    results = evaluate(args.model, args.dataset, args.cache_dir, args.use_cache, args.split,
+                       args.validation_split, args.seed, args.batch_size, args.workers)
+
+    print(f"\nTest Accuracy: {results['accuracy']:.2%}  (loss {results['loss']:.4f}, {results['num_images']} images)")
+    print(f"Throughput: {results['throughput']['images_per_second']:.1f} images/s")
+    for name, report in results['classification_report'].items():
+        if isinstance(report, dict):
+            print(f"  {name:45s} precision {report['precision']:.2f}  recall {report['recall']:.2f}  "
+                  f"f1 {report['f1-score']:.2f}")
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Export a registered Keras model to a SavedModel and a TFLite flatbuffer.
+
+load_model() on the .h5 file parses HDF5 and copies every weight into
+process memory, so each worker pays seconds of start-up and a few hundred
+MB of private RSS for ResNet152V2. A .tflite file is a flatbuffer that the
+interpreter memory-maps read-only: weights stay in the page cache, are
+shared by every worker process on the host, and start-up is mostly graph
+preparation. TFLiteModel below gives the interpreter the small Keras-style
+surface the app uses (predict, input_shape), and the registry loads it
+for entries with format 'tflite'.
+
+XNNPACK (TFLite's default CPU delegate) repacks weights into private
+memory for speed. That is usually the better trade, but with many workers
+per host and tight memory, xnnpack=False keeps the weights shared. The
+benchmark reports both.
+
+Usage:
+    python export_model.py --model resnet152v2
+    python export_model.py --model student_mobilenetv2 --quantize float16 --benchmark
+"""
+import os
+import shutil
+import argparse
+import threading
+
+import numpy as np
+
+try:
+    import tflite_runtime.interpreter as tflite # Interpreter without the full TensorFlow package
+except ImportError:
+    tflite = None
+
+from model_registry import load_registered_model, register_model
+
+
+def _interpreter_module():
+    if tflite is not None:
+        return tflite
+    import tensorflow as tf
+    return tf.lite
+
+
+class TFLiteModel:
+    """Keras-like wrapper around a memory-mapped TFLite interpreter."""
+
+    layers = [] # No Keras layers: embeddings and Grad-CAM need the .h5/SavedModel model
+
+    def __init__(self, path, num_threads=None, xnnpack=True):
+        """
+        Args:
+            path (str): The .tflite file (memory-mapped, not read into memory).
+            num_threads (int): Interpreter threads (None lets TFLite decide).
+            xnnpack (bool): Use the XNNPACK delegate (faster, but weights become private memory).
+        """
+        module = _interpreter_module()
+        options = {'model_path': path, 'num_threads': num_threads}
+        if not xnnpack:
+            resolver = getattr(module, 'OpResolverType', None) or module.experimental.OpResolverType
+            options['experimental_op_resolver_type'] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.path = path
+        self._interpreter = module.Interpreter(**options)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in self._input['shape'][1:])
+        self._lock = threading.Lock() # An interpreter must not be invoked from two threads at once
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """
+        Predicts a batch image by image with the batch-1 interpreter (resizing the
+        input would re-prepare the delegate on every new batch size).
+        Returns:
+            np.ndarray: (N, num_classes) probabilities.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        outputs = np.empty((len(x),) + tuple(self._output['shape'][1:]), dtype=np.float32)
+        with self._lock:
+            for i in range(len(x)):
+                self._interpreter.set_tensor(self._input['index'], x[i:i + 1])
+                self._interpreter.invoke()
+                outputs[i] = self._interpreter.get_tensor(self._output['index'])[0]
+        return outputs
+
+    def __call__(self, x, training=False):
+        return self.predict(x)
+
+
+def export_savedmodel(model, path):
+    """Writes an inference SavedModel (Keras 3 model.export, or tf.saved_model.save on tf.keras 2)."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    if hasattr(model, 'export'):
+        model.export(path)
+    else:
+        import tensorflow as tf
+        tf.saved_model.save(model, path)
+
+
+def convert_tflite(savedmodel_path, output, quantize='none'):
+    """
+    Converts a SavedModel to a .tflite flatbuffer.
+    Args:
+        quantize (str): 'none' keeps float32 weights (memory-mapped as is); 'float16'
+            halves the file but the weights are expanded to float32 in private memory
+            at load; 'dynamic' stores int8 weights used directly by the hybrid kernels.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(savedmodel_path)
+    if quantize != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantize == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+    flatbuffer = converter.convert()
+    with open(output + '.tmp', 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(output + '.tmp', output)
+    return output
+
+
+def compare_outputs(model, tflite_model, batch):
+    """Largest absolute probability difference and top-1 agreement between the two artifacts."""
+    expected = model.predict(batch, verbose=0)
+    actual = tflite_model.predict(batch)
+    return {
+        'max_abs_diff': float(np.max(np.abs(expected - actual))),
+        'top1_agreement': float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+    }
+
+
+def verification_batch(size, count, cache_dir):
+    """Up to `count` images from the dataset cache, or random inputs when there is no cache."""
+    from dataset_cache import DatasetCache, to_model_input
+
+    try:
+        cache = DatasetCache(cache_dir, size)
+    except FileNotFoundError:
+        return np.random.default_rng(0).random((count, size, size, 3), dtype=np.float32)
+    rows = np.linspace(0, len(cache) - 1, min(count, len(cache))).astype(int)
+    return to_model_input(cache.images[rows])
+
+
+def benchmark(h5_path, tflite_path):
+    """Cold start, RSS split into private and file-backed (shareable) pages, and latency, each in a fresh process."""
+    from compress_model import measure_in_subprocess
+
+    runs = (('h5', h5_path, ()), ('tflite', tflite_path, ()), ('tflite (no XNNPACK)', tflite_path, ('--no-xnnpack',)))
+    print(f"\n{'artifact':20s} {'file MB':>8s} {'load s':>7s} {'private MB':>11s} {'shared MB':>10s} {'1-img ms':>9s}")
+    results = {}
+    for name, path, extra in runs:
+        r = results[name] = measure_in_subprocess(path, extra)
+        print(f"{name:20s} {r['file_mb']:8.1f} {r['load_seconds']:7.2f} {r['rss_anon_mb']:11.1f} "
+              f"{r['rss_file_mb']:10.1f} {r['latency_ms']:9.2f}")
+    return results
+
+
+def main():
+    from dataset_cache import DEFAULT_CACHE_DIR
+
+    parser = argparse.ArgumentParser(description="Export a model to SavedModel and a memory-mapped TFLite file.")
+    parser.add_argument('--model', default='resnet152v2', help="Registry spec or .h5 path.")
+    parser.add_argument('--output-dir', default='models')
+    parser.add_argument('--quantize', choices=('none', 'float16', 'dynamic'), default='none')
+    parser.add_argument('--verify', type=int, default=32, help="Images compared between the .h5 and .tflite outputs.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--benchmark', action='store_true', help="Compare cold start, RSS and latency.")
+    parser.add_argument('--no-register', action='store_true')
+    args = parser.parse_args()
+
+    model, entry = load_registered_model(args.model)
+    savedmodel_path = os.path.join(args.output_dir, f"{entry['name']}_savedmodel")
+    suffix = '' if args.quantize == 'none' else f"_{args.quantize}"
+    tflite_path = os.path.join(args.output_dir, f"{entry['name']}{suffix}.tflite")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    export_savedmodel(model, savedmodel_path)
+    print(f"SavedModel written to {savedmodel_path}")
+    convert_tflite(savedmodel_path, tflite_path, args.quantize)
+    print(f"TFLite model written to {tflite_path} ({os.path.getsize(tflite_path) / 2**20:.1f} MB)")
+
+    size = entry['target_size'][0]
+    check = compare_outputs(model, TFLiteModel(tflite_path), verification_batch(size, args.verify, args.cache_dir))
+    print(f"Max probability difference {check['max_abs_diff']:.2e}, top-1 agreement {check['top1_agreement']:.2%}")
+    if args.benchmark:
+        benchmark(entry['path'], tflite_path)
+    if not args.no_register:
+        register_model(f"{entry['name']}_tflite", tflite_path, entry['target_size'], fmt='tflite',
+                       class_indices=entry.get('class_indices'), metrics=check,
+                       notes=f"TFLite export of {args.model} (quantize={args.quantize})",
+                       source=args.model, savedmodel=savedmodel_path)
+
+
+if __name__ == '__main__':
+    main()
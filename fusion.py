@@ -0,0 +1,76 @@
+"""
+Fusing the image prediction with symptoms the user ticks.
+
+Every symptom listed in VITAMIN_DATA becomes a checkbox. When the app
+starts, each symptom text is scored against the symptom lists of all
+classes with the BM25 index from symptom_search. "Fatigue" matches many
+classes, while "Swollen, purple, spongy, and bleeding gums" matches almost
+only Vitamin C. These scores become a (symptoms x classes) matrix of log
+likelihood ratios. Ticked symptoms are then fused with the model's output
+in log space:
+
+    fused = softmax(log p_image + weight * sum of the ticked rows)
+
+That is a few NumPy operations on an 11-wide vector, so it adds nothing
+noticeable to a prediction.
+"""
+import numpy as np
+
+from symptom_search import SymptomIndex, field_texts
+
+
+class SymptomFusion:
+    """Precomputed symptom-to-class weights and the fusion step."""
+
+    def __init__(self, vitamin_data, class_labels, class_map, weight=1.0, floor=0.1):
+        """
+        Args:
+            vitamin_data (dict): VITAMIN_DATA.
+            class_labels (dict): Model output index -> class name.
+            class_map (dict): Class name -> VITAMIN_DATA key.
+            weight (float): How much the symptoms count relative to the image.
+            floor (float): Affinity added to every class so no symptom rules a class out.
+        """
+        self.weight = weight
+        index = SymptomIndex(vitamin_data, field_weights={'symptoms': 1.0})
+        doc_of_key = {key: doc for doc, key in enumerate(index.keys)}
+        columns = [doc_of_key.get(class_map.get(class_labels[c])) for c in range(len(class_labels))]
+
+        self.symptoms = [] # [{'id', 'text', 'key'}], ids index the rows of log_lr
+        seen = set()
+        rows = []
+        for key, entry in vitamin_data.items():
+            for text in field_texts(entry, 'symptoms'):
+                if text.lower() in seen:
+                    continue
+                seen.add(text.lower())
+                scores = index.scores(text)
+                affinity = np.array([scores[doc] if doc is not None else 0.0 for doc in columns], dtype=np.float32)
+                affinity = affinity / max(affinity.max(), 1e-9) + floor
+                rows.append(np.log(affinity / affinity.mean()))
+                self.symptoms.append({'id': len(self.symptoms), 'text': text, 'key': key})
+        self.log_lr = np.array(rows, dtype=np.float32).reshape(len(rows), len(columns))
+
+    def parse(self, values):
+        """Turns submitted checkbox values into valid, unique symptom ids."""
+        ids = set()
+        for value in values:
+            try:
+                symptom_id = int(value)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= symptom_id < len(self.symptoms):
+                ids.add(symptom_id)
+        return sorted(ids)
+
+    def fuse(self, probabilities, symptom_ids):
+        """
+        Combines the model's probability vector with the ticked symptoms.
+        Returns:
+            np.ndarray: Fused probabilities (the input unchanged when nothing is ticked).
+        """
+        if not symptom_ids:
+            return probabilities
+        logits = np.log(np.clip(probabilities, 1e-7, 1.0)) + self.weight * self.log_lr[symptom_ids].sum(axis=0)
+        fused = np.exp(logits - logits.max())
+        return fused / fused.sum()
@@ -0,0 +1,203 @@
+"""
+Grad-CAM heatmaps for past predictions, computed lazily off the request path.
+
+Prediction routes hand the exact model input of each request (as uint8,
+150 KB for 224x224) to an ExplanationService, which keeps the most recent
+ones in memory. Nothing else happens during /predict. When a heatmap is
+asked for, the service schedules one compiled gradient pass on a
+background thread:
+
+    conv, probs = grad_model(x)                       # feature map feeding GlobalAveragePooling2D
+    weights     = mean over H, W of d probs[class] / d conv
+    heatmap     = relu(sum_k weights_k * conv_k), scaled to [0, 1]
+
+and writes the overlay next to the upload as <id>_gradcam.png. Later
+requests are served from that file. If the cached input has been evicted
+(or the app restarted), the input is rebuilt from the upload.
+"""
+import os
+import re
+import glob
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+OVERLAY_SIZE = 448 # Side of the written PNG
+_PREDICTION_ID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+class GradCam:
+    """One compiled Grad-CAM pass on a Keras classifier."""
+
+    def __init__(self, model, layer_name=None):
+        """
+        Args:
+            model: The trained Keras classifier.
+            layer_name (str): Convolutional layer to explain; by default the
+                feature map feeding the last GlobalAveragePooling2D (or the
+                last layer with a 4-D output).
+        """
+        import tensorflow as tf
+        from tensorflow.keras.layers import GlobalAveragePooling2D
+        from tensorflow.keras.models import Model
+
+        if layer_name is not None:
+            target = model.get_layer(layer_name).output
+        else:
+            pooling = [layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D)]
+            if pooling:
+                target = pooling[-1].input
+            else:
+                convs = [layer for layer in model.layers if len(layer.output.shape) == 4]
+                if not convs:
+                    raise ValueError("Model has no 4-D feature map to explain")
+                target = convs[-1].output
+        grad_model = Model(inputs=model.inputs, outputs=[target, model.output])
+        height, width = model.input_shape[1:3]
+
+        @tf.function(input_signature=[tf.TensorSpec((1, height, width, 3), tf.float32),
+                                      tf.TensorSpec((), tf.int32)])
+        def heatmap(x, class_index):
+            with tf.GradientTape() as tape:
+                conv, probs = grad_model(x, training=False)
+                score = tf.gather(probs[0], class_index)
+            grads = tape.gradient(score, conv)
+            weights = tf.reduce_mean(grads, axis=(1, 2)) # (1, channels)
+            cam = tf.nn.relu(tf.reduce_sum(conv * weights[:, tf.newaxis, tf.newaxis, :], axis=-1))[0]
+            return cam / (tf.reduce_max(cam) + 1e-8), probs[0]
+
+        self._heatmap = heatmap
+
+    def __call__(self, x, class_index=None):
+        """
+        Args:
+            x: (1, H, W, 3) or (H, W, 3) normalized model input.
+            class_index (int): Class to explain; the predicted class when None.
+        Returns:
+            tuple: (heatmap (h, w) in [0, 1], class_index)
+        """
+        x = np.asarray(x, dtype=np.float32).reshape((1,) + np.shape(x)[-3:])
+        if class_index is None:
+            _, probs = self._heatmap(x, np.int32(0))
+            class_index = int(np.argmax(probs))
+        cam, _ = self._heatmap(x, np.int32(class_index))
+        return cam.numpy(), class_index
+
+
+def render_overlay(pixels, heatmap, size=OVERLAY_SIZE, alpha=0.4):
+    """Blends a JET-coloured heatmap over the RGB uint8 model input; returns PNG bytes."""
+    base = cv2.resize(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), (size, size), interpolation=cv2.INTER_LINEAR)
+    heat = cv2.applyColorMap(np.uint8(255 * cv2.resize(heatmap, (size, size))), cv2.COLORMAP_JET)
+    ok, png = cv2.imencode('.png', cv2.addWeighted(heat, alpha, base, 1 - alpha, 0))
+    if not ok:
+        raise ValueError("Could not encode the overlay")
+    return png.tobytes()
+
+
+class ExplanationService:
+    """Remembers recent model inputs and builds heatmaps for them on demand."""
+
+    PENDING, READY, FAILED, UNKNOWN = 'pending', 'ready', 'failed', 'unknown'
+
+    def __init__(self, explainer_factory, upload_folder, loader, cache_size=64, workers=1):
+        """
+        Args:
+            explainer_factory: Zero-argument callable returning a GradCam (built
+                on the first request, so startup does not pay for it).
+            upload_folder (str): Where uploads and the cached PNGs live.
+            loader: Callable(upload_path) -> normalized (1, H, W, 3) input, used
+                when a request's input is no longer cached.
+            cache_size (int): Model inputs kept in memory.
+            workers (int): Heatmaps computed at once.
+        """
+        self.explainer_factory = explainer_factory
+        self.upload_folder = upload_folder
+        self.loader = loader
+        self.cache_size = cache_size
+        self._explainer = None
+        self._inputs = OrderedDict() # prediction id -> (uint8 pixels, class index, upload path)
+        self._jobs = {} # prediction id -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gradcam')
+
+    @staticmethod
+    def prediction_id(upload_path):
+        """The id of a prediction is the uuid file name of its upload."""
+        return os.path.splitext(os.path.basename(upload_path))[0]
+
+    def overlay_path(self, prediction_id):
+        return os.path.join(self.upload_folder, f"{prediction_id}_gradcam.png")
+
+    def remember(self, upload_path, model_input, class_index):
+        """Keeps the exact model input of a prediction (cheap: one uint8 copy)."""
+        pixels = np.asarray(model_input)
+        pixels = pixels.reshape(pixels.shape[-3:])
+        if pixels.dtype != np.uint8:
+            pixels = np.clip(np.rint(pixels * 255.0), 0, 255).astype(np.uint8) # Exact for x/255 inputs
+        prediction_id = self.prediction_id(upload_path)
+        with self._lock:
+            self._inputs[prediction_id] = (pixels, int(class_index), upload_path)
+            self._inputs.move_to_end(prediction_id)
+            while len(self._inputs) > self.cache_size:
+                self._inputs.popitem(last=False)
+
+    def _find_upload(self, prediction_id):
+        base = os.path.join(self.upload_folder, prediction_id)
+        matches = glob.glob(base + '.*') + ([base] if os.path.isfile(base) else [])
+        return matches[0] if matches else None
+
+    def request(self, prediction_id):
+        """
+        Returns the state of a heatmap, scheduling its computation if needed.
+        Returns:
+            tuple: (state, detail) where detail is the PNG path when ready or
+            the error message when failed.
+        """
+        if not _PREDICTION_ID.match(prediction_id):
+            return self.UNKNOWN, None
+        path = self.overlay_path(prediction_id)
+        if os.path.exists(path):
+            with self._lock:
+                self._jobs.pop(prediction_id, None)
+            return self.READY, path
+        with self._lock:
+            job = self._jobs.get(prediction_id)
+            if job is None:
+                cached = self._inputs.get(prediction_id)
+                upload_path = cached[2] if cached else self._find_upload(prediction_id)
+                if upload_path is None:
+                    return self.UNKNOWN, None
+                job = self._jobs[prediction_id] = self._executor.submit(self._build, prediction_id, upload_path)
+        if not job.done():
+            return self.PENDING, None
+        with self._lock:
+            self._jobs.pop(prediction_id, None) # Failed jobs may be retried
+        error = job.exception()
+        if error is not None:
+            return self.FAILED, str(error)
+        return self.READY, path
+
+    def _build(self, prediction_id, upload_path):
+        with self._lock:
+            cached = self._inputs.get(prediction_id)
+        if cached is not None:
+            pixels, class_index, _ = cached
+        else:
+            x = np.asarray(self.loader(upload_path))
+            pixels = np.clip(np.rint(x.reshape(x.shape[-3:]) * 255.0), 0, 255).astype(np.uint8)
+            class_index = None # Explain whatever the model predicts now
+        if self._explainer is None:
+            self._explainer = self.explainer_factory()
+        heatmap, _ = self._explainer(pixels.astype(np.float32)[np.newaxis] / 255.0, class_index)
+        png = render_overlay(pixels, heatmap)
+        path = self.overlay_path(prediction_id)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(png)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,124 @@
+"""
+Minimal model registry.
+
+models/registry.json lists every servable model artifact by name and
+version, together with the input size and class indices it was trained
+with, so the app and the offline tools load models the same way.
+
+A model spec is "name" (latest version), "name:<version>", or a plain path
+to a model file that is not registered.
+"""
+import os
+import json
+from datetime import datetime
+
+REGISTRY_PATH = os.path.join('models', 'registry.json')
+DEFAULT_CLASS_INDICES = 'class_indices.json'
+
+
+def load_registry(path=REGISTRY_PATH):
+    """Reads the registry file, returning an empty registry if it is missing."""
+    if not os.path.exists(path):
+        return {'models': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_registry(registry, path=REGISTRY_PATH):
+    """Writes the registry atomically so a concurrent reader never sees half a file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def register_model(name, path, target_size, fmt='h5', class_indices=DEFAULT_CLASS_INDICES,
+                   metrics=None, notes=None, registry_path=REGISTRY_PATH, **extra):
+    """
+    Adds a new version of a model to the registry.
+    Args:
+        name (str): Model name, e.g. 'resnet152v2'.
+        path (str): Path of the artifact.
+        target_size (tuple): (height, width) the model expects.
+        fmt (str): Artifact format, e.g. 'h5'.
+        class_indices (str): Path of the class_indices.json used in training.
+        metrics (dict): Optional evaluation metrics to record.
+    Returns:
+        dict: The new registry entry.
+    """
+    registry = load_registry(registry_path)
+    versions = registry['models'].setdefault(name, [])
+    entry = {
+        'version': max((v['version'] for v in versions), default=0) + 1,
+        'path': path,
+        'format': fmt,
+        'target_size': list(target_size),
+        'class_indices': class_indices,
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if metrics:
+        entry['metrics'] = metrics
+    if notes:
+        entry['notes'] = notes
+    entry.update(extra)
+    versions.append(entry)
+    save_registry(registry, registry_path)
+    print(f"Registered {name}:{entry['version']} -> {path}")
+    return dict(entry, name=name)
+
+
+def resolve_model(spec, registry_path=REGISTRY_PATH):
+    """
+    Resolves a model spec to a registry entry.
+    Returns:
+        dict: The entry with its 'name' added. Unregistered file paths get a
+        synthetic entry whose target_size is None (read from the model).
+    """
+    registry = load_registry(registry_path)
+    name, _, version = spec.partition(':')
+    if name in registry['models']:
+        versions = registry['models'][name]
+        if not versions:
+            raise KeyError(f"Model '{name}' has no registered versions")
+        if version in ('', 'latest'):
+            entry = max(versions, key=lambda v: v['version'])
+        else:
+            matches = [v for v in versions if str(v['version']) == version]
+            if not matches:
+                raise KeyError(f"Model '{name}' has no version {version}")
+            entry = matches[0]
+        return dict(entry, name=name)
+    if os.path.exists(spec):
+        return {'name': os.path.splitext(os.path.basename(spec))[0], 'version': None, 'path': spec,
+                'format': os.path.splitext(spec)[1].lstrip('.') or 'savedmodel',
+                'target_size': None, 'class_indices': DEFAULT_CLASS_INDICES}
+    raise KeyError(f"Unknown model '{spec}': not registered in {registry_path} and not a file")
+
+
+def load_class_indices(entry):
+    """Returns the {class name: index} mapping recorded for a registry entry."""
+    with open(entry.get('class_indices') or DEFAULT_CLASS_INDICES) as f:
+        return json.load(f)
+
+
+def load_registered_model(spec, registry_path=REGISTRY_PATH, **tflite_options):
+    """
+    Loads the model for a spec.
+    Args:
+        tflite_options: Passed to export_model.TFLiteModel for 'tflite' entries
+            (num_threads, xnnpack).
+    Returns:
+        tuple: (model, entry). entry['target_size'] is filled in from the
+        model's input shape when the registry did not record it.
+    """
+    entry = resolve_model(spec, registry_path)
+    if entry.get('format') == 'tflite':
+        from export_model import TFLiteModel
+        model = TFLiteModel(entry['path'], **tflite_options) # Memory-mapped, shared between processes
+    else:
+        from tensorflow.keras.models import load_model
+        model = load_model(entry['path'], compile=False)
+    if not entry.get('target_size'):
+        entry['target_size'] = list(model.input_shape[1:3])
+    return model, entry
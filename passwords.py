@@ -0,0 +1,93 @@
+"""
+Password hashing off the inference workers.
+
+pbkdf2/scrypt are deliberately CPU-expensive. Run on the request threads,
+a burst of logins (a whole class signing in at once) competes with /predict
+for every core. CredentialVerifier runs all hashing on its own small
+thread pool (hashlib releases the GIL, so these threads really run in
+parallel, but never more than `max_workers` of them), sheds work beyond
+`max_pending` queued jobs, and transparently upgrades stored hashes to the
+configured scheme (memory-hard scrypt by default) on the next successful
+login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1' # n=2**15, r=8, p=1: ~32 MiB of memory per hash
+
+
+class CredentialBusy(Exception):
+    """Raised when too many hashing jobs are already queued, or one did not finish in time."""
+
+
+def hash_method(stored_hash):
+    """Returns the method part of a werkzeug hash, e.g. 'pbkdf2:sha256:600000'."""
+    return stored_hash.split('$', 1)[0]
+
+
+class CredentialVerifier:
+    """Bounded executor for password hashing and verification."""
+
+    def __init__(self, method=DEFAULT_METHOD, max_workers=2, max_pending=32, timeout=30.0):
+        """
+        Args:
+            method (str): werkzeug hash method new hashes are created with.
+            max_workers (int): Hashes computed at once.
+            max_pending (int): Jobs allowed to run or wait; more raise CredentialBusy.
+            timeout (float): Seconds a caller waits for its result before CredentialBusy.
+        """
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='credentials')
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a verifier from the PASSWORD_HASH_* keys of a Flask config."""
+        return cls(method=config['PASSWORD_HASH_METHOD'],
+                   max_workers=config['PASSWORD_HASH_WORKERS'],
+                   max_pending=config['PASSWORD_HASH_MAX_PENDING'])
+
+    def _run(self, fn, *args):
+        if not self._pending.acquire(blocking=False):
+            raise CredentialBusy("Too many sign-in requests are being processed")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel() # Drops it if it never started; a running hash finishes and releases its slot
+            raise CredentialBusy("Sign-in is taking too long, please try again") from None
+
+    def needs_rehash(self, stored_hash):
+        """True when a stored hash was made with a different method or parameters."""
+        return hash_method(stored_hash) != self.method
+
+    def hash(self, password):
+        """Hashes a new password with the configured method."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def _verify_job(self, stored_hash, password):
+        if not check_password_hash(stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, generate_password_hash(password, self.method)
+        return True, None
+
+    def verify(self, stored_hash, password):
+        """
+        Checks a password against its stored hash.
+        Returns:
+            tuple: (is_valid, new_hash) where new_hash is set when the stored
+            hash should be replaced with one using the configured method.
+        """
+        return self._run(self._verify_job, stored_hash, password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
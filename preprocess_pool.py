@@ -0,0 +1,416 @@
+"""
+Pipelined preprocessing: a process pool decodes, a single thread infers.
+
+Decoding and resizing an upload (PIL / OpenCV) holds the GIL for as long as
+it runs, so doing it on the request thread adds straight onto model latency
+and keeps the other cores idle. PreprocessPipeline instead:
+
+1. hands each upload to a pool of worker processes, which decode, resize
+   and normalize it directly into a slot of one shared-memory float32
+   array (N, H, W, 3),
+2. lets a single inference thread pick up the slots that are ready, group
+   them into a batch and run model.predict on a view of the shared array
+   (no copy when the slots are adjacent, which the lowest-free-slot
+   allocator makes the common case),
+3. returns each request's probability vector through a Future.
+
+Decoding of the next uploads therefore overlaps with the current forward pass.
+
+The slots come from a SlabAllocator: one preallocated shared-memory float32
+array that is reused for the life of the process, so a request allocates
+no input array of its own. decode_into() writes each image straight into
+its slot. With the OpenCV path the only per-request allocation is the
+full-size decode: resizing goes into a reusable uint8 scratch buffer, the
+channel swap happens in place and the /255 normalization writes into the
+slot. With workers=0 the request thread decodes into the slot itself,
+from the upload bytes it already holds, and nothing crosses a process
+boundary. bench_preprocess.py measures allocations per request and RSS
+against the old per-request arrays.
+
+The workers are `python -m preprocess_worker` subprocesses rather than
+multiprocessing children, so they never re-import the app (see _DecodeWorkers).
+"""
+import io
+import os
+import sys
+import time
+import heapq
+import queue
+import pickle
+import itertools
+import threading
+import subprocess
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+# Worker-process globals, set by _attach()
+_SHM = None
+_BUFFER = None
+_SCRATCH = None
+
+
+def _attach(shm_name, shape):
+    """Worker start-up: maps the parent's shared buffer into this worker."""
+    global _SHM, _BUFFER, _SCRATCH
+    _SHM = shared_memory.SharedMemory(name=shm_name)
+    if os.name == 'posix':
+        # Attaching registers the segment with a resource tracker of this worker's
+        # own, which would unlink it when the worker exits; the parent unlinks it.
+        resource_tracker.unregister('/' + _SHM.name, 'shared_memory')
+    _BUFFER = np.ndarray(shape, dtype=np.float32, buffer=_SHM.buf)
+    _SCRATCH = np.empty(shape[1:], dtype=np.uint8) # One image at a time per worker
+
+
+def _is_encoded(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def decode_to_array(img_path, size, method='keras'):
+    """
+    Decodes and resizes an image to an (H, W, 3) uint8 RGB array.
+    Args:
+        img_path: File path, or the encoded bytes of an upload.
+        method (str): 'keras' matches image.load_img (PIL, nearest neighbour);
+            'cv2' matches the cv2.imread/cv2.resize path of /predict_camera;
+            'roi' crops to the skin/tissue region first (see roi.py; file paths only).
+    """
+    if method == 'roi':
+        from roi import decode_roi
+        return decode_roi(img_path, size)[0]
+    if method == 'cv2':
+        return _decode_cv2(img_path, size)
+    from PIL import Image
+    with Image.open(io.BytesIO(img_path) if _is_encoded(img_path) else img_path) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (size[1], size[0]):
+            img = img.resize((size[1], size[0]), Image.NEAREST)
+        return np.asarray(img)
+
+
+def _decode_cv2(source, size, out=None):
+    """
+    OpenCV decode and resize into `out` (uint8, allocated if None).
+    Resizing before the BGR->RGB swap gives the same pixels as swapping first,
+    and lets the swap run in place on the small image.
+    """
+    import cv2
+
+    if _is_encoded(source):
+        img = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(source)
+    if img is None:
+        raise ValueError("Could not read image" + ("" if _is_encoded(source) else f" {source}"))
+    out = cv2.resize(img, (size[1], size[0]), dst=out)
+    return cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+
+
+def decode_into(source, out, method='keras', scratch=None):
+    """
+    Decodes an image straight into a float32 (H, W, 3) buffer, normalized to [0, 1].
+    Args:
+        source: File path or encoded upload bytes.
+        out (np.ndarray): Destination, e.g. a slab slot.
+        scratch (np.ndarray): Reusable uint8 (H, W, 3) buffer for the 'cv2' path.
+    """
+    if method == 'cv2':
+        pixels = _decode_cv2(source, out.shape[:2], scratch)
+    else:
+        pixels = decode_to_array(source, out.shape[:2], method)
+    np.multiply(pixels, 1.0 / 255.0, out=out, casting='unsafe') # Normalize in place
+    return out
+
+
+def _decode_into(source, slot, method):
+    """Worker task: decodes one image straight into its shared-memory slot."""
+    decode_into(source, _BUFFER[slot], method, _SCRATCH)
+    return slot
+
+
+class SlabAllocator:
+    """
+    Fixed-size float32 buffers in one shared-memory segment, allocated once and
+    reused. Slots are handed out lowest index first, so buffers in use at the
+    same time tend to be adjacent and a batch of them is one contiguous view.
+    """
+
+    def __init__(self, slots, item_shape):
+        """
+        Args:
+            slots (int): Buffers in the slab; acquire() blocks while all are in use.
+            item_shape (tuple): Shape of one buffer, e.g. (224, 224, 3).
+        """
+        self.shape = (slots,) + tuple(item_shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)) * 4)
+        # Pages are only backed once written; the lowest-slot-first order keeps the
+        # touched part of the slab as small as the peak concurrency
+        self.array = np.ndarray(self.shape, dtype=np.float32, buffer=self._shm.buf)
+        self._free = list(range(slots)) # Min-heap of free slot indices
+        self._cond = threading.Condition()
+        self.stats = {'acquired': 0, 'waited': 0, 'high_water': 0}
+
+    @property
+    def name(self):
+        """Shared-memory name other processes attach to."""
+        return self._shm.name
+
+    def __len__(self):
+        return self.shape[0]
+
+    def acquire(self, timeout=None):
+        """Returns the lowest free slot index, waiting up to `timeout` seconds for one."""
+        with self._cond:
+            if not self._free:
+                self.stats['waited'] += 1
+                if not self._cond.wait_for(lambda: self._free, timeout):
+                    raise TimeoutError("No free slab buffer")
+            slot = heapq.heappop(self._free)
+            self.stats['acquired'] += 1
+            self.stats['high_water'] = max(self.stats['high_water'], len(self) - len(self._free))
+            return slot
+
+    def release(self, slots):
+        with self._cond:
+            for slot in slots:
+                heapq.heappush(self._free, slot)
+            self._cond.notify(len(slots))
+
+    def gather(self, slots, out):
+        """
+        Batch view of sorted slots: a zero-copy slice when they are adjacent,
+        else a gather into `out`.
+        Returns:
+            tuple: (batch array, copied)
+        """
+        if slots[-1] - slots[0] == len(slots) - 1:
+            return self.array[slots[0]:slots[-1] + 1], False
+        return np.take(self.array, slots, axis=0, out=out[:len(slots)]), True
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+class _DecodeWorker:
+    def __init__(self, proc):
+        self.proc = proc
+        self.lock = threading.Lock() # Guards stdin and pending
+        self.pending = {} # task id -> Future
+        self.alive = True
+
+
+class _DecodeWorkers:
+    """
+    Decode processes started as `python -m preprocess_worker`. Children of
+    multiprocessing (spawn or forkserver) first re-run the parent's __main__,
+    which here is the whole app, so the workers are plain subprocesses that
+    import only the decode code. Tasks and results are pickled over each
+    worker's stdin and stdout; a reader thread per worker resolves the futures.
+    """
+
+    def __init__(self, workers, shm_name, shape):
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [here, env.get('PYTHONPATH')]))
+        command = [sys.executable, '-m', 'preprocess_worker', shm_name, ','.join(str(n) for n in shape)]
+        self._ids = itertools.count()
+        self._workers = []
+        self._readers = []
+        for _ in range(workers):
+            worker = _DecodeWorker(subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env))
+            reader = threading.Thread(target=self._read_results, args=(worker,), name='decode-results', daemon=True)
+            reader.start()
+            self._workers.append(worker)
+            self._readers.append(reader)
+        self.pids = [worker.proc.pid for worker in self._workers]
+
+    def submit(self, source, slot, method):
+        """
+        Sends one decode task to the least busy live worker.
+        Returns:
+            Future: Resolves to None once the slot holds the image.
+        Raises:
+            BrokenProcessPool: No worker is left to take the task.
+        """
+        future = Future()
+        for worker in sorted(self._workers, key=lambda w: len(w.pending)):
+            with worker.lock:
+                if not worker.alive:
+                    continue
+                task_id = next(self._ids)
+                try:
+                    pickle.dump((task_id, source, slot, method), worker.proc.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                    worker.proc.stdin.flush()
+                except OSError:
+                    continue # Exited; its reader thread fails whatever it still had pending
+                worker.pending[task_id] = future
+            return future
+        raise BrokenProcessPool("All decode workers have exited")
+
+    def _read_results(self, worker):
+        while True:
+            try:
+                task_id, error = pickle.load(worker.proc.stdout)
+            except Exception: # EOF or a truncated result: the worker is gone
+                break
+            with worker.lock:
+                future = worker.pending.pop(task_id)
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+        with worker.lock:
+            worker.alive = False
+            pending, worker.pending = worker.pending, {}
+        for future in pending.values():
+            future.set_exception(BrokenProcessPool(f"Decode worker {worker.proc.pid} exited"))
+
+    def shutdown(self):
+        """Lets the workers finish their queued tasks, then waits for them to exit."""
+        for worker in self._workers:
+            with worker.lock:
+                try:
+                    worker.proc.stdin.close() # EOF: the worker exits after its last task
+                except OSError:
+                    pass
+        for worker, reader in zip(self._workers, self._readers):
+            try:
+                worker.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.proc.kill()
+                worker.proc.wait()
+            reader.join()
+
+
+class PreprocessPipeline:
+    """Process-pool decoding into shared memory feeding one batching inference thread."""
+
+    def __init__(self, model, target_size, workers=2, slots=32, max_batch=8, batch_window=0.005):
+        """
+        Args:
+            model: Anything with a Keras-style predict(batch).
+            target_size (tuple): (height, width) of the model input.
+            workers (int): Decode processes; 0 decodes on the calling thread.
+            slots (int): Images that can be decoded or waiting at once.
+            max_batch (int): Largest batch the inference thread builds.
+            batch_window (float): Seconds to wait for more ready images before predicting.
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.slab = SlabAllocator(slots, (target_size[0], target_size[1], 3))
+        self.buffer = self.slab.array
+        self._batch_buffer = np.empty((max_batch,) + self.slab.shape[1:], dtype=np.float32) # For non-adjacent slots
+        self._ready = queue.Queue()
+        self._pool = None
+        self._scratch = None
+        if workers > 0:
+            # Fresh interpreters: the workers must not inherit TensorFlow's threads from this process
+            self._pool = _DecodeWorkers(workers, self.slab.name, self.slab.shape)
+        else:
+            self._scratch = np.empty(self.slab.shape, dtype=np.uint8) # One per slot: request threads come and go
+        self._thread = threading.Thread(target=self._inference_loop, name='inference', daemon=True)
+        self._thread.start()
+        self.stats = {'batches': 0, 'images': 0, 'copied_batches': 0}
+
+    def submit(self, img_path, method='keras', timeout=30.0, keep_input=False):
+        """
+        Queues an image for decoding and inference.
+        Args:
+            img_path: File path, or the encoded upload bytes ('keras' and 'cv2' methods).
+            keep_input (bool): Also return a uint8 copy of the model input, taken
+                before the slot is reused (for explanations of this prediction).
+        Returns:
+            Future: Resolves to the (num_classes,) probability vector, or to
+            (probabilities, (H, W, 3) uint8 input) with keep_input.
+        """
+        slot = self.slab.acquire(timeout)
+        result = Future()
+        if self._pool is None:
+            try:
+                decode_into(img_path, self.buffer[slot], method, self._scratch[slot])
+            except Exception as e:
+                self.slab.release([slot])
+                result.set_exception(e)
+                return result
+            self._ready.put((slot, result, keep_input))
+            return result
+        try:
+            decoded = self._pool.submit(img_path, slot, method)
+        except Exception as e: # e.g. BrokenProcessPool: the slot was never handed over
+            self.slab.release([slot])
+            result.set_exception(e)
+            return result
+
+        def on_decoded(f):
+            if f.exception() is not None:
+                self.slab.release([slot])
+                result.set_exception(f.exception())
+            else:
+                self._ready.put((slot, result, keep_input))
+        decoded.add_done_callback(on_decoded)
+        return result
+
+    def predict(self, img_path, method='keras', timeout=30.0, keep_input=False):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(img_path, method, timeout, keep_input).result(timeout)
+
+    def _next_batch(self):
+        """Blocks for one ready image, then gathers more for up to batch_window seconds."""
+        first = self._ready.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._ready.get(timeout=remaining) if remaining > 0 else self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._ready.put(None) # Let the loop see the shutdown after this batch
+                break
+            batch.append(item)
+        return sorted(batch, key=lambda item: item[0])
+
+    def _inference_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            slots = [item[0] for item in batch]
+            inputs, copied = self.slab.gather(slots, self._batch_buffer) # Usually a zero-copy view
+            self.stats['copied_batches'] += copied
+            try:
+                predictions = self.model.predict(inputs, verbose=0)
+                for i, (_, result, keep_input) in enumerate(batch):
+                    probabilities = np.array(predictions[i])
+                    if keep_input:
+                        pixels = np.rint(inputs[i] * 255.0).astype(np.uint8) # Copied before the slot is released
+                        result.set_result((probabilities, pixels))
+                    else:
+                        result.set_result(probabilities)
+            except Exception as e:
+                for _, result, _ in batch:
+                    result.set_exception(e)
+            finally:
+                self.slab.release(slots)
+            self.stats['batches'] += 1
+            self.stats['images'] += len(batch)
+
+    def close(self):
+        """Stops the inference thread and the pool, then frees the shared memory."""
+        if self.buffer is None:
+            return # Already closed
+        self._ready.put(None)
+        self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+        self.buffer = None
+        self.slab.close()
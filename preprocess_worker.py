@@ -0,0 +1,49 @@
+"""
+Decode worker of the PreprocessPipeline.
+
+Usage:
+    python -m preprocess_worker <shm_name> <N,H,W,3>
+
+multiprocessing's spawn and forkserver children first re-run the parent's
+__main__ module, which for `python test.py` or `python asgi.py` means
+importing TensorFlow, opening the databases and building another pipeline
+just to decode images. The pipeline therefore starts its workers as plain
+subprocesses of this module, which imports only the decode code.
+
+Tasks arrive on stdin and results leave on stdout, one pickle each:
+(task_id, source, slot, method) in, (task_id, exception or None) out.
+"""
+import os
+import sys
+import pickle
+
+from preprocess_pool import _attach, _decode_into
+
+
+def main():
+    shm_name = sys.argv[1]
+    shape = tuple(int(n) for n in sys.argv[2].split(','))
+    tasks = sys.stdin.buffer
+    results = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno()) # Stray prints must not corrupt the result stream
+    _attach(shm_name, shape)
+    while True:
+        try:
+            task_id, source, slot, method = pickle.load(tasks)
+        except EOFError:
+            return # The pipeline closed our stdin
+        error = None
+        try:
+            _decode_into(source, slot, method)
+        except Exception as e:
+            error = e
+        try:
+            payload = pickle.dumps((task_id, error))
+        except Exception: # e.g. cv2.error does not pickle
+            payload = pickle.dumps((task_id, RuntimeError(f"{type(error).__name__}: {error}")))
+        results.write(payload)
+        results.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Cheap quality checks on webcam frames before they reach the model.
+
+A blurry, dark or empty capture still costs a full forward pass and the
+user retakes it anyway. assess_frame() decodes the upload at reduced
+resolution (the JPEG decoder skips most of the work), shrinks it to
+at most 160 px wide and measures:
+
+* empty frame  standard deviation of the grey image (lens covered, blank canvas)
+* exposure     mean brightness and the share of crushed/blown-out pixels
+* sharpness    variance of the Laplacian (few edges = blurry)
+* skin         share of pixels in the YCrCb skin range
+
+It takes a millisecond or two and returns a reason code the client can
+show straight away.
+"""
+import time
+
+import cv2
+import numpy as np
+
+ANALYSIS_WIDTH = 160
+
+# Default thresholds; the app overrides them from its QUALITY_* config keys
+DEFAULT_THRESHOLDS = {
+    'min_contrast': 1.0, # Grey-level std below this is a uniform, empty frame
+    'min_brightness': 45.0, # Mean grey level
+    'max_brightness': 215.0,
+    'max_clipped': 0.5, # Share of pixels that are nearly black or nearly white
+    'min_sharpness': 20.0, # Laplacian variance on the downscaled frame
+    'min_skin': 0.04, # Share of skin-coloured pixels
+}
+
+MESSAGES = {
+    'unreadable': "The image could not be read.",
+    'empty_frame': "The picture is empty. Check that the camera is not covered.",
+    'too_dark': "The picture is too dark. Move to better light.",
+    'too_bright': "The picture is overexposed. Avoid direct light or glare.",
+    'blurry': "The picture is blurry. Hold the camera still and focus on the area.",
+    'no_skin': "No skin, nail, eye or tongue area was found. Fill the frame with the affected area.",
+}
+
+
+def skin_mask(image_bgr):
+    """Binary mask (uint8, 0/255) of skin-coloured pixels using fixed YCrCb bounds."""
+    ycrcb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2YCrCb)
+    return cv2.inRange(ycrcb, (0, 133, 77), (255, 173, 127))
+
+
+def decode_reduced(data, max_width=ANALYSIS_WIDTH):
+    """Decodes image bytes at reduced resolution and shrinks the result to at most max_width."""
+    buffer = np.frombuffer(data, np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    if width > max_width:
+        image = cv2.resize(image, (max_width, max(1, height * max_width // width)), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def frame_metrics(image_bgr):
+    """Computes the quality measurements of a (downscaled) BGR image."""
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    mean, std = cv2.meanStdDev(gray)
+    clipped = (np.count_nonzero(gray < 16) + np.count_nonzero(gray > 240)) / gray.size
+    return {
+        'contrast': float(std[0][0]),
+        'brightness': float(mean[0][0]),
+        'clipped': float(clipped),
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+        'skin': cv2.countNonZero(skin_mask(image_bgr)) / gray.size,
+    }
+
+
+def check_metrics(metrics, thresholds=DEFAULT_THRESHOLDS):
+    """Returns the reason code of the first failed check, or None."""
+    if metrics['contrast'] < thresholds['min_contrast']:
+        return 'empty_frame'
+    if metrics['brightness'] < thresholds['min_brightness']:
+        return 'too_dark'
+    if metrics['brightness'] > thresholds['max_brightness']:
+        return 'too_bright'
+    if metrics['clipped'] > thresholds['max_clipped']:
+        return 'too_dark' if metrics['brightness'] < 128 else 'too_bright'
+    if metrics['sharpness'] < thresholds['min_sharpness']:
+        return 'blurry'
+    if metrics['skin'] < thresholds['min_skin']:
+        return 'no_skin'
+    return None
+
+
+def assess_frame(data, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Runs the quality gate on an uploaded image.
+    Args:
+        data (bytes): The encoded image as uploaded.
+        thresholds (dict): See DEFAULT_THRESHOLDS.
+    Returns:
+        dict: ok (bool), reason (code or None), message, metrics and ms (time taken).
+    """
+    start = time.perf_counter()
+    image = decode_reduced(data)
+    if image is None:
+        reason, metrics = 'unreadable', {}
+    else:
+        metrics = frame_metrics(image)
+        reason = check_metrics(metrics, thresholds)
+    return {
+        'ok': reason is None,
+        'reason': reason,
+        'message': MESSAGES.get(reason),
+        'metrics': {name: round(value, 3) for name, value in metrics.items()},
+        'ms': round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def thresholds_from_config(config):
+    """Reads the QUALITY_* keys of a Flask config into a thresholds dict."""
+    return {name: config.get(f'QUALITY_{name.upper()}', default) for name, default in DEFAULT_THRESHOLDS.items()}
@@ -0,0 +1,136 @@
+"""
+Read-only JSON API over the vitamin reference data.
+
+The data never changes while the app runs, so every representation is
+serialized, hashed and compressed once: the whole collection and each
+vitamin at startup, and each sparse fieldset (?fields=name,symptoms) the
+first time it is asked for. A request then costs a dict lookup and,
+for a client that already has the data, a 304 with an empty body:
+
+    GET /api/vitamins                    -> {"count": 11, "vitamins": [{"key": ..., ...}, ...]}
+    GET /api/vitamins/vitamin_c          -> {"key": "vitamin_c", "name": ..., ...}
+    GET /api/vitamins?fields=name,symptoms
+    If-None-Match: "<etag>"              -> 304 Not Modified
+
+ETags are strong and differ per content coding ("<hash>", "<hash>-gzip",
+"<hash>-br"); any of a representation's ETags revalidates it.
+"""
+import gzip
+import json
+import hashlib
+from functools import lru_cache
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 512 # Smaller bodies are sent as they are
+
+
+class Representation:
+    """One serialized JSON body with its ETag and precompressed copies."""
+
+    def __init__(self, payload):
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:24]
+        self.encoded = {}
+        if len(self.body) >= MIN_COMPRESS_BYTES:
+            self.encoded['gzip'] = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(self.body, quality=11)
+
+    def etag_for(self, encoding):
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def matches(self, if_none_match):
+        """True when an If-None-Match header names any variant of this representation."""
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-')[0] == self.etag:
+                return True
+        return False
+
+
+class ReferenceApi:
+    """Serves the vitamin reference data as precomputed JSON representations."""
+
+    def __init__(self, data, max_age=300, fieldset_cache_size=256):
+        """
+        Args:
+            data (dict): VITAMIN_DATA (key -> vitamin details).
+            max_age (int): Seconds clients may use a response before revalidating.
+            fieldset_cache_size (int): Sparse fieldset representations kept.
+        """
+        self.data = data
+        self.max_age = max_age
+        self.fields = sorted({field for entry in data.values() for field in entry})
+        self._representation = lru_cache(maxsize=fieldset_cache_size)(self._build)
+        # Serialize the full representations up front
+        self._representation(None, None)
+        for key in data:
+            self._representation(key, None)
+
+    def _select(self, key, fields):
+        entry = {'key': key}
+        entry.update((f, v) for f, v in self.data[key].items() if fields is None or f in fields)
+        return entry
+
+    def _build(self, key, fields):
+        if key is None:
+            vitamins = [self._select(k, fields) for k in self.data]
+            return Representation({'count': len(vitamins), 'vitamins': vitamins})
+        return Representation(self._select(key, fields))
+
+    def parse_fields(self, fields_arg):
+        """
+        Turns ?fields=a,b into a sorted tuple (the fieldset cache key).
+        Returns:
+            tuple: (fields or None for all, error message or None)
+        """
+        if not fields_arg:
+            return None, None
+        fields = tuple(sorted({f.strip() for f in fields_arg.split(',') if f.strip()} - {'key'}))
+        unknown = [f for f in fields if f not in self.fields]
+        if unknown:
+            return None, f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(self.fields)}"
+        return fields, None
+
+    def respond(self, key=None):
+        """Builds the response for the current request (collection when key is None)."""
+        if key is not None and key not in self.data:
+            return self._error(f"No vitamin '{key}'", 404)
+        fields, error = self.parse_fields(request.args.get('fields'))
+        if error:
+            return self._error(error, 400)
+        representation = self._representation(key, fields)
+
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in representation.encoded and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        headers = {
+            'ETag': representation.etag_for(encoding),
+            'Cache-Control': f'public, max-age={self.max_age}',
+            'Vary': 'Accept-Encoding',
+        }
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and representation.matches(if_none_match):
+            return Response(status=304, headers=headers)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            body = representation.encoded[encoding]
+        else:
+            body = representation.body
+        return Response(body, mimetype='application/json', headers=headers)
+
+    @staticmethod
+    def _error(message, status):
+        return Response(json.dumps({'error': message}), status=status, mimetype='application/json')
@@ -0,0 +1,232 @@
+"""
+Region-of-interest cropping before the resize to the model input.
+
+Phone photos are squashed from several megapixels to 224x224, so the
+skin, nail, eye or tongue area the model should look at often ends up a
+few dozen pixels wide. find_roi() segments skin and red tissue (lips,
+tongue, inner eyelid) on a 256 px wide copy with fixed YCrCb/HSV ranges,
+keeps the largest connected region and returns a square box around it
+with some margin, in full-resolution coordinates. When nothing plausible
+is found, or the region already fills the frame, the whole image is used.
+
+predict_multi_crop() batches several views of one upload (ROI, tight
+ROI, full frame, centre) into a single forward pass and averages them.
+
+Usage:
+    python roi.py --benchmark --model resnet152v2 --split val
+    python roi.py --benchmark --limit 200          # timing only, no model
+"""
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from quality_gate import skin_mask
+
+ANALYSIS_WIDTH = 256
+# Decode JPEGs at 1/2, 1/4 or 1/8 scale while the short side stays this many times the model input
+MIN_DECODE_FACTOR = 3
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+DEFAULT_CROPS = ('roi', 'tight', 'full', 'center')
+
+
+def tissue_mask(image_bgr):
+    """Skin pixels plus saturated reds (lips, tongue, conjunctiva)."""
+    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    red = cv2.inRange(hsv, (0, 60, 50), (12, 255, 255)) | cv2.inRange(hsv, (168, 60, 50), (180, 255, 255))
+    return skin_mask(image_bgr) | red
+
+
+def find_roi(image_bgr, margin=0.15, min_fraction=0.02, max_fraction=0.85):
+    """
+    Locates the largest skin/tissue region.
+    Args:
+        image_bgr: Full-resolution image as decoded by OpenCV.
+        margin (float): Context added around the region, relative to its size.
+        min_fraction, max_fraction (float): Region sizes (share of the frame) outside
+            which cropping is pointless and None is returned.
+    Returns:
+        tuple: (x0, y0, x1, y1) square box in full-resolution pixels, or None.
+    """
+    height, width = image_bgr.shape[:2]
+    scale = min(1.0, ANALYSIS_WIDTH / width)
+    small = cv2.resize(image_bgr, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA) if scale < 1 else image_bgr
+    mask = tissue_mask(small)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((7, 7), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count < 2:
+        return None
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    x, y, w, h, area = stats[largest]
+    if area < min_fraction * mask.size:
+        return None
+
+    # Square box with margin around the region, back in full-resolution pixels
+    side = max(w, h) * (1 + 2 * margin) / scale
+    cx, cy = (x + w / 2) / scale, (y + h / 2) / scale
+    side = min(side, width, height)
+    x0 = int(round(min(max(cx - side / 2, 0), width - side)))
+    y0 = int(round(min(max(cy - side / 2, 0), height - side)))
+    box = (x0, y0, x0 + int(side), y0 + int(side))
+    if (box[2] - box[0]) * (box[3] - box[1]) > max_fraction * width * height:
+        return None
+    return box
+
+
+def crop_views(image_bgr, crops=DEFAULT_CROPS, box=None):
+    """Returns the requested crops of an image ('roi', 'tight', 'full', 'center')."""
+    height, width = image_bgr.shape[:2]
+    views = []
+    for crop in crops:
+        if crop == 'roi':
+            b = box if box is not None else find_roi(image_bgr)
+        elif crop == 'tight':
+            b = find_roi(image_bgr, margin=0.0)
+        elif crop == 'center':
+            side = int(min(width, height) * 0.8)
+            b = ((width - side) // 2, (height - side) // 2, (width + side) // 2, (height + side) // 2)
+        elif crop == 'full':
+            b = None
+        else:
+            raise ValueError(f"Unknown crop '{crop}'")
+        views.append(image_bgr if b is None else image_bgr[b[1]:b[3], b[0]:b[2]])
+    return views
+
+
+def read_reduced(img_path, min_side):
+    """
+    Reads an image with OpenCV, letting the JPEG decoder downscale it as far
+    as possible while its short side stays at least min_side pixels. Phone
+    photos are decoded 4-8x faster this way.
+    """
+    from PIL import Image
+
+    flag = cv2.IMREAD_COLOR
+    try:
+        with Image.open(img_path) as probe: # Reads the header only
+            short_side = min(probe.size)
+            if probe.format == 'JPEG':
+                flag = next((f for factor, f in _REDUCED_FLAGS if short_side // factor >= min_side), flag)
+    except OSError:
+        pass
+    image = cv2.imread(img_path, flag)
+    if image is None:
+        raise ValueError(f"Could not read image {img_path}")
+    return image
+
+
+def decode_roi(img_path, size, crops=('roi',)):
+    """
+    Decodes an image, crops it and resizes each crop like image.load_img (nearest neighbour).
+    Returns:
+        np.ndarray: (len(crops), H, W, 3) uint8 RGB batch.
+    """
+    image = read_reduced(img_path, MIN_DECODE_FACTOR * max(size))
+    views = crop_views(image, crops)
+    batch = np.empty((len(views), size[0], size[1], 3), dtype=np.uint8)
+    for i, view in enumerate(views):
+        batch[i] = cv2.cvtColor(cv2.resize(view, (size[1], size[0]), interpolation=cv2.INTER_NEAREST),
+                                cv2.COLOR_BGR2RGB)
+    return batch
+
+
+def predict_multi_crop(model, img_path, size, crops=DEFAULT_CROPS):
+    """
+    Predicts several crops of one upload in a single forward pass.
+    Returns:
+        tuple: (mean_probabilities, agreement) as in tta.aggregate_predictions.
+    """
+    from tta import aggregate_predictions
+
+    batch = decode_roi(img_path, size, crops).astype(np.float32) / 255.0
+    return aggregate_predictions(model.predict(batch, batch_size=len(batch), verbose=0))
+
+
+def benchmark(dataset_dir, model_spec=None, split='val', limit=None, batch_size=16):
+    """Times ROI cropping against the plain decode and, with a model, compares accuracy on the split."""
+    from dataset_cache import list_dataset
+    from preprocess_pool import decode_to_array
+    from evaluate import validation_rows
+
+    files, labels, data_indices = list_dataset(dataset_dir)
+    rows = validation_rows(files) if split == 'val' else np.arange(len(files))
+    files = [os.path.join(dataset_dir, f) for f in files]
+    labels = np.asarray(labels)
+    if limit:
+        rows = rows[:limit]
+
+    model = None
+    size = (224, 224)
+    to_model_index = None
+    if model_spec:
+        from model_registry import load_class_indices, load_registered_model
+        model, entry = load_registered_model(model_spec)
+        size = tuple(entry['target_size'])
+        model_indices = load_class_indices(entry)
+        to_model_index = np.array([model_indices[n] for n in sorted(data_indices, key=data_indices.get)])
+
+    modes = {
+        'full': lambda path: decode_to_array(path, size)[np.newaxis],
+        'roi': lambda path: decode_roi(path, size),
+        'multi-crop': lambda path: decode_roi(path, size, DEFAULT_CROPS),
+    }
+    found = 0
+    print(f"{len(rows)} images from {dataset_dir} ({split}), input {size[0]}x{size[1]}")
+    print(f"{'mode':12s} {'decode ms/img':>14s} {'accuracy':>9s}")
+    for mode, decode in modes.items():
+        seconds, correct, evaluated = 0.0, 0, 0
+        pending, pending_labels = [], []
+
+        def flush():
+            nonlocal correct, evaluated
+            batch = np.concatenate(pending).astype(np.float32) / 255.0
+            # Average the views of each image (multi-crop) before taking the top class
+            probs = model.predict(batch, verbose=0).reshape(len(pending), len(pending[0]), -1).mean(axis=1)
+            correct += int(np.sum(np.argmax(probs, axis=1) == np.array(pending_labels)))
+            evaluated += len(pending)
+            pending.clear()
+            pending_labels.clear()
+
+        for row in rows:
+            start = time.perf_counter()
+            try:
+                views = decode(files[row])
+            except Exception:
+                continue
+            seconds += time.perf_counter() - start
+            if mode == 'roi':
+                found += find_roi(read_reduced(files[row], MIN_DECODE_FACTOR * max(size))) is not None
+            if model is None:
+                evaluated += 1
+                continue
+            pending.append(views)
+            pending_labels.append(to_model_index[labels[row]])
+            if len(pending) == batch_size:
+                flush()
+        if pending:
+            flush()
+        accuracy = f"{correct / evaluated:.4f}" if model is not None and evaluated else '-'
+        print(f"{mode:12s} {seconds / max(evaluated, 1) * 1000:14.2f} {accuracy:>9s}")
+    print(f"ROI found in {found}/{len(rows)} images (others fall back to the full frame)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ROI cropping: added milliseconds vs accuracy.")
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--dataset', default='dataset/vitamin_project_dataset')
+    parser.add_argument('--model', default=None, help="Registry spec; without one only timings are reported.")
+    parser.add_argument('--split', choices=('all', 'val'), default='val')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.error("only --benchmark is supported; the app uses roi.py as a library")
+    benchmark(args.dataset, args.model, args.split, args.limit, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
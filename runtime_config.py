@@ -0,0 +1,118 @@
+"""
+Inference runtime settings: TensorFlow thread pools, CPU pinning and a
+single-inference-thread mode.
+
+By default every op may use all cores (intra-op pool), and each Flask
+thread calling model.predict runs its own graph, so N concurrent requests
+ask for N x cores threads and latency collapses. The app applies these
+settings before it loads the model:
+
+* RUNTIME_INTRA_OP_THREADS / RUNTIME_INTER_OP_THREADS size TensorFlow's pools
+  (0 keeps TensorFlow's default). TFLite models get the intra-op count as
+  their num_threads.
+* RUNTIME_CPU_AFFINITY pins the process: a list of CPU ids, or 'auto' to
+  split the available CPUs between RUNTIME_PROCESSES worker processes, the
+  slice chosen by the WORKER_INDEX environment variable.
+* RUNTIME_SINGLE_INFERENCE_THREAD routes every direct model call through
+  one thread (SerializedModel), so only one forward pass runs at a time and
+  it gets the whole intra-op pool. The preprocessing pipeline gets the bare
+  model: its inference thread already serializes predict.
+
+tune_runtime.py sweeps these on the machine and writes runtime_config.json,
+which load_runtime_config() merges into the app config.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULTS = {
+    'RUNTIME_INTRA_OP_THREADS': 0,
+    'RUNTIME_INTER_OP_THREADS': 0,
+    'RUNTIME_CPU_AFFINITY': None,
+    'RUNTIME_PROCESSES': 1,
+    'RUNTIME_SINGLE_INFERENCE_THREAD': False,
+}
+
+
+def load_runtime_config(path):
+    """Returns the RUNTIME_* settings stored by tune_runtime.py, or {} when there is no file."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        settings = json.load(f).get('settings', {})
+    return {key: value for key, value in settings.items() if key in DEFAULTS}
+
+
+def available_cpus():
+    """CPUs this process may run on (all CPUs where affinity is not supported)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_slice(processes, index, cpus=None):
+    """Contiguous share of the CPUs for worker `index` of `processes` (the last ones absorb the remainder)."""
+    cpus = sorted(cpus if cpus is not None else available_cpus())
+    processes = max(1, min(processes, len(cpus)))
+    index %= processes
+    start = index * len(cpus) // processes
+    return cpus[start:(index + 1) * len(cpus) // processes]
+
+
+def resolve_affinity(setting, processes=1, index=None):
+    """Turns RUNTIME_CPU_AFFINITY into a CPU list (None: leave the process unpinned)."""
+    if setting in (None, '', []):
+        return None
+    if setting == 'auto':
+        if index is None:
+            index = int(os.environ.get('WORKER_INDEX', 0))
+        return cpu_slice(processes, index)
+    return sorted(int(cpu) for cpu in setting)
+
+
+def apply_runtime(config):
+    """
+    Pins the process and sizes TensorFlow's thread pools. Must run before the
+    model is loaded: TensorFlow ignores (and rejects) pool changes once its
+    runtime has started.
+    Args:
+        config: Mapping with the RUNTIME_* keys (e.g. app.config).
+    Returns:
+        dict: The settings in effect, for logging.
+    """
+    settings = dict(DEFAULTS, **{key: config[key] for key in DEFAULTS if key in config})
+    cpus = resolve_affinity(settings['RUNTIME_CPU_AFFINITY'], settings['RUNTIME_PROCESSES'])
+    if cpus is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus) # Decode workers spawned later inherit the mask
+        else:
+            print("CPU pinning is not supported on this platform; RUNTIME_CPU_AFFINITY ignored.")
+            cpus = None
+
+    intra = settings['RUNTIME_INTRA_OP_THREADS']
+    inter = settings['RUNTIME_INTER_OP_THREADS']
+    if intra or inter:
+        import tensorflow as tf
+        try:
+            if intra:
+                tf.config.threading.set_intra_op_parallelism_threads(intra)
+            if inter:
+                tf.config.threading.set_inter_op_parallelism_threads(inter)
+        except RuntimeError as e:
+            print(f"TensorFlow thread pools already initialized, settings not applied: {e}")
+    return {'cpus': cpus, 'intra_op_threads': intra, 'inter_op_threads': inter,
+            'single_inference_thread': settings['RUNTIME_SINGLE_INFERENCE_THREAD']}
+
+
+class SerializedModel:
+    """Runs every predict() of a model on one dedicated thread; everything else passes through."""
+
+    def __init__(self, model):
+        self._model = model
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+
+    def predict(self, *args, **kwargs):
+        return self._executor.submit(self._model.predict, *args, **kwargs).result()
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
@@ -22,6 +22,42 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Grad-CAM heatmaps: /explain answers 202 until the background job has written the PNG
+    async function showExplanation(button) {
+        button.disabled = true;
+        button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Computing heatmap...';
+        try {
+            for (let attempt = 0; attempt < 60; attempt++) {
+                const response = await fetch(button.dataset.explainUrl);
+                if (response.status === 202) {
+                    const wait = parseFloat(response.headers.get('Retry-After')) || 1;
+                    await new Promise(resolve => setTimeout(resolve, wait * 1000));
+                    continue;
+                }
+                if (!response.ok) {
+                    const result = await response.json();
+                    throw new Error(result.error || 'Unknown error');
+                }
+                const heatmap = document.createElement('img');
+                heatmap.className = 'explain-heatmap';
+                heatmap.alt = 'Areas the model focused on';
+                heatmap.src = URL.createObjectURL(await response.blob());
+                button.replaceWith(heatmap);
+                return;
+            }
+            throw new Error('Timed out');
+        } catch (error) {
+            button.disabled = false;
+            button.innerHTML = `<i class="fas fa-redo"></i> Heatmap failed (${error.message}), retry`;
+        }
+    }
+    document.addEventListener('click', (event) => {
+        const button = event.target.closest('.explain-btn');
+        if (button && !button.disabled) {
+            showExplanation(button);
+        }
+    });
+
     // Camera functionality
     const startCameraButton = document.getElementById('startCameraButton');
     const videoFeed = document.getElementById('videoFeed');
@@ -110,7 +146,9 @@ document.addEventListener('DOMContentLoaded', () => {
             // Convert canvas content to Blob and send to server
             canvas.toBlob(async (blob) => {
                 const formData = new FormData();
-                formData.append('image', blob, 'captured_image.png');
+                formData.append('image', blob, 'captured_image.jpg');
+                // Symptoms ticked on the upload form also refine camera predictions
+                document.querySelectorAll('input[name="symptoms"]:checked').forEach(box => formData.append('symptoms', box.value));
 
                 try {
                     const response = await fetch('/predict_camera', {
@@ -145,7 +183,21 @@ document.addEventListener('DOMContentLoaded', () => {
                             camKnowMoreLinkContainer.style.display = 'block'; // Make the container visible for the message
                         }
                         // --- END ADDED/MODIFIED ---
+                        if (result.explain_url) {
+                            const explainButton = document.createElement('button');
+                            explainButton.type = 'button';
+                            explainButton.classList.add('btn', 'btn-secondary', 'explain-btn');
+                            explainButton.dataset.explainUrl = result.explain_url;
+                            explainButton.innerHTML = '<i class="fas fa-eye"></i> Show what the model looked at';
+                            camKnowMoreLinkContainer.appendChild(explainButton);
+                        }
 
+                    } else if (response.status === 422) {
+                        // Rejected by the quality gate before inference: ask for a retake straight away
+                        cameraStatus.textContent = `Please retake the photo: ${result.error}`;
+                        cameraPredictionResults.style.display = 'none';
+                        camKnowMoreLinkContainer.innerHTML = '';
+                        camKnowMoreLinkContainer.style.display = 'none';
                     } else {
                         cameraStatus.textContent = `Prediction failed: ${result.error || 'Unknown error'}`;
                         cameraPredictionResults.style.display = 'none'; // Hide results on error
@@ -161,7 +213,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 } finally {
                     cameraSpinner.style.display = 'none';
                 }
-            }, 'image/png');
+            }, 'image/jpeg', 0.92); // JPEG: a fraction of the PNG size, and the server can decode it at reduced resolution
         });
     }
 
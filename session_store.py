@@ -0,0 +1,417 @@
+"""
+Server-side sessions with compact signed tokens.
+
+Flask's default session is the whole session dict serialized, signed and
+sent in a cookie on every request, and Flask-Login then reloads the user
+from SQLite on every request. ServerSideSessionInterface keeps the session
+data on the server and puts only a short signed token in the cookie:
+
+    <22-char random id>.<16-char HMAC-SHA256 tag>
+
+Stores (all with the same get/set/delete/revoke_user API). Saving a
+session that already existed passes existing=True, and the store then only
+overwrites it if it still has it, so a session revoked or deleted while a
+request was using it (possibly in another worker) is never written back:
+
+* MemoryLRUStore      per-process LRU, fastest, not shared
+* SQLiteSessionStore  shared by every worker process on the box; expired
+                      rows are purged every `purge_every` saves
+* CacheSessionStore   any Redis-like client (get/setex/delete); LocalSharedCache
+                      is an in-process stand-in with the same API
+* TieredSessionStore  an LRU in front of a shared store; front entries
+                      live only `front_ttl` seconds, which bounds how long a
+                      revoked session can survive in another worker's LRU
+
+Usage:
+    python session_store.py --rounds 20000    # lookup cost of each store vs. the users-table query
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import sqlite3
+import argparse
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_ID_BYTES = 16
+TAG_BYTES = 12
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def sign_token(session_id, secret_key):
+    """Returns '<session_id>.<tag>' for a session id."""
+    tag = hmac.new(secret_key.encode(), session_id.encode(), hashlib.sha256).digest()[:TAG_BYTES]
+    return f"{session_id}.{_b64(tag)}"
+
+
+def unsign_token(token, secret_key):
+    """Returns the session id of a correctly signed token, otherwise None."""
+    session_id, _, _ = (token or '').partition('.')
+    if not session_id or not hmac.compare_digest(sign_token(session_id, secret_key), token):
+        return None
+    return session_id
+
+
+def new_session_id():
+    return _b64(secrets.token_bytes(SESSION_ID_BYTES))
+
+
+class MemoryLRUStore:
+    """Bounded in-process store; entries expire after `ttl` seconds."""
+
+    def __init__(self, capacity=10000, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._data = OrderedDict() # sid -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return entry[1]
+
+    def set(self, sid, data, ttl, existing=False):
+        """Stores a session; with existing=True only if it is still stored. Returns whether it was written."""
+        ttl = min(ttl, self.ttl) if self.ttl else ttl
+        with self._lock:
+            if existing and sid not in self._data:
+                return False
+            self._data[sid] = (time.time() + ttl, data)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for sid in [sid for sid, (_, data) in self._data.items() if data.get('_user_id') == str(user_id)]:
+                del self._data[sid]
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite table (WAL mode), shared across worker processes."""
+
+    def __init__(self, path='sessions.db', purge_every=1000):
+        """
+        Args:
+            path (str): SQLite database file.
+            purge_every (int): Saves between deletions of expired sessions (0 never purges).
+        """
+        self.path = path
+        self.purge_every = purge_every
+        self._saves = 0
+        self._saves_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                user_id TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)') # For purge_expired
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread, kept open: no connect cost per request
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute('SELECT data, expires_at FROM sessions WHERE sid = ?', (sid,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, sid, data, ttl, existing=False):
+        conn = self._conn()
+        values = (data.get('_user_id'), json.dumps(data), time.time() + ttl, sid)
+        if existing:
+            written = conn.execute('UPDATE sessions SET user_id = ?, data = ?, expires_at = ? WHERE sid = ?',
+                                   values).rowcount > 0
+        else:
+            conn.execute('INSERT OR REPLACE INTO sessions (user_id, data, expires_at, sid) VALUES (?, ?, ?, ?)',
+                         values)
+            written = True
+        conn.commit()
+        if self.purge_every:
+            with self._saves_lock:
+                self._saves += 1
+                due = self._saves % self.purge_every == 0
+            if due:
+                self.purge_expired() # Every worker process counts its own saves
+        return written
+
+    def delete(self, sid):
+        conn = self._conn()
+        conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        conn.commit()
+
+    def revoke_user(self, user_id):
+        conn = self._conn()
+        conn.execute('DELETE FROM sessions WHERE user_id = ?', (str(user_id),))
+        conn.commit()
+
+    def purge_expired(self):
+        """Deletes expired sessions; returns how many."""
+        conn = self._conn()
+        deleted = conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+
+class LocalSharedCache:
+    """
+    In-process stand-in for a shared cache such as Redis, implementing the
+    small subset of its client API the sessions need. Swap in redis.Redis()
+    to share sessions between machines.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                self._data.pop(key, None)
+                return None
+            return entry[1]
+
+    def setex(self, key, ttl, value):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value if isinstance(value, bytes) else str(value).encode())
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+class CacheSessionStore:
+    """Sessions in a Redis-like cache; a per-user key lists the user's sessions for revocation."""
+
+    def __init__(self, client, prefix='session:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, sid):
+        raw = self.client.get(self.prefix + sid)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, sid, data, ttl, existing=False):
+        if existing and self.client.get(self.prefix + sid) is None:
+            return False
+        self.client.setex(self.prefix + sid, int(ttl), json.dumps(data))
+        user_id = data.get('_user_id')
+        if user_id is not None:
+            key = f"{self.prefix}user:{user_id}"
+            sids = set(json.loads(self.client.get(key) or '[]')) | {sid}
+            self.client.setex(key, int(ttl), json.dumps(sorted(sids)))
+        return True
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def revoke_user(self, user_id):
+        key = f"{self.prefix}user:{user_id}"
+        sids = json.loads(self.client.get(key) or '[]')
+        self.client.delete(key, *(self.prefix + sid for sid in sids))
+
+
+class TieredSessionStore:
+    """Per-process LRU in front of a shared store (write-through, short-lived front entries)."""
+
+    def __init__(self, back, capacity=10000, front_ttl=5.0):
+        self.front = MemoryLRUStore(capacity, ttl=front_ttl)
+        self.back = back
+
+    def get(self, sid):
+        data = self.front.get(sid)
+        if data is None:
+            data = self.back.get(sid)
+            if data is not None:
+                self.front.set(sid, data, self.front.ttl)
+        return data
+
+    def set(self, sid, data, ttl, existing=False):
+        # The back store decides: revoke_user in another worker only cleared that worker's front
+        if not self.back.set(sid, data, ttl, existing):
+            self.front.delete(sid)
+            return False
+        self.front.set(sid, data, ttl)
+        return True
+
+    def delete(self, sid):
+        self.back.delete(sid)
+        self.front.delete(sid)
+
+    def revoke_user(self, user_id):
+        self.back.revoke_user(user_id)
+        self.front.revoke_user(user_id)
+
+
+def store_from_config(config):
+    """Builds the store named by SESSION_BACKEND ('memory', 'sqlite', 'cache' or 'tiered')."""
+    backend = config['SESSION_BACKEND']
+    if backend == 'memory':
+        return MemoryLRUStore(config['SESSION_LRU_CAPACITY'])
+    if backend == 'sqlite':
+        return SQLiteSessionStore(config['SESSION_DB'], config['SESSION_PURGE_EVERY'])
+    if backend == 'cache':
+        return CacheSessionStore(LocalSharedCache())
+    if backend == 'tiered':
+        return TieredSessionStore(SQLiteSessionStore(config['SESSION_DB'], config['SESSION_PURGE_EVERY']),
+                                  config['SESSION_LRU_CAPACITY'], config['SESSION_LRU_TTL'])
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}'")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it was read or modified."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.rotate_from = None
+
+    # Reads mark the session accessed, like Flask's cookie session, so the response varies by cookie
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def rotate(self):
+        """Moves the data to a fresh session id (call on login to prevent session fixation)."""
+        self.rotate_from = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface storing the data server-side and only a signed token in the cookie."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        sid = unsign_token(token, app.secret_key) if token else None
+        if sid is not None:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie') # The page depends on who is signed in: shared caches must not reuse it
+        if session.rotate_from:
+            self.store.delete(session.rotate_from)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return # Nothing to write: the common case, a pure lookup per request
+        ttl = app.permanent_session_lifetime.total_seconds()
+        existing = not session.new and not session.rotate_from
+        if not self.store.set(session.sid, dict(session), ttl, existing):
+            response.delete_cookie(name, domain=domain, path=path) # Revoked meanwhile: stay signed out
+            return
+        response.set_cookie(name, sign_token(session.sid, app.secret_key),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def benchmark(rounds=20000):
+    """Times a session lookup in each store against the per-request users-table query."""
+    import tempfile
+    from database import get_db_connection, init_db
+
+    with tempfile.TemporaryDirectory() as tmp:
+        users_db = os.path.join(tmp, 'users.db')
+        init_db(users_db)
+        conn = get_db_connection(users_db)
+        conn.execute("INSERT INTO users (username, email, password, registered_at) VALUES ('u', 'u@x', 'h', 'now')")
+        conn.commit()
+        conn.close()
+
+        def users_query():
+            # What load_user did on every request: a fresh connection and a SELECT
+            conn = get_db_connection(users_db)
+            conn.execute('SELECT * FROM users WHERE id = ?', (1,)).fetchone()
+            conn.close()
+
+        data = {'_user_id': '1', '_fresh': True, '_user_profile': {'id': 1, 'username': 'u', 'email': 'u@x'}}
+        stores = {
+            'memory LRU': MemoryLRUStore(),
+            'sqlite': SQLiteSessionStore(os.path.join(tmp, 'sessions.db')),
+            'shared cache': CacheSessionStore(LocalSharedCache()),
+            'tiered': TieredSessionStore(SQLiteSessionStore(os.path.join(tmp, 'sessions2.db'))),
+        }
+        timings = {'users table (before)': users_query}
+        for name, store in stores.items():
+            store.set('sid', data, 3600)
+            timings[name] = lambda store=store: store.get('sid')
+
+        for name, fn in timings.items():
+            start = time.perf_counter()
+            for _ in range(rounds):
+                fn()
+            print(f"{name:22s} {(time.perf_counter() - start) / rounds * 1e6:8.1f} us/lookup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session lookups against the users-table query.")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+    benchmark(args.rounds)
+
+
+if __name__ == '__main__':
+    main()
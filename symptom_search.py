@@ -0,0 +1,224 @@
+"""
+Full-text symptom search over VITAMIN_DATA.
+
+Each vitamin is one document made of its symptoms, common_foods, remedies
+and description fields (symptoms weighted highest). Text is lower-cased,
+split into words, stop words dropped and words reduced with a small
+suffix-stripping stemmer, so "bleeding gums" also finds "Gums that bleed".
+Ranking is BM25F-style: the BM25 contribution of every (term, document)
+pair does not depend on the query, so it is computed once when the index
+is built and a query only adds up a few precomputed NumPy arrays.
+
+Usage:
+    python symptom_search.py "bleeding gums"
+    python symptom_search.py --benchmark --scale 2000
+"""
+import re
+import ast
+import time
+import random
+import argparse
+from functools import lru_cache
+from collections import Counter, defaultdict
+
+import numpy as np
+
+FIELD_WEIGHTS = {'symptoms': 3.0, 'description': 1.0, 'common_foods': 1.0, 'remedies': 1.0}
+
+STOP_WORDS = frozenset('''
+a an and are as at be by can especially for from if in into is it its like of on or such that the their
+these this to under which while with e g eg etc may also some more most other than very
+'''.split())
+
+_WORD = re.compile(r'[a-z0-9]+')
+# Longest suffixes first; a suffix is only removed if at least 3 letters remain
+_SUFFIXES = ('ational', 'ization', 'fulness', 'iveness', 'ations', 'nesses', 'ments', 'ation', 'ities',
+             'ness', 'ment', 'ings', 'ity', 'ies', 'ing', 'ive', 'ous', 'ful', 'ed', 'ly', 's')
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Light suffix-stripping stemmer (bleeding -> bleed, infections -> infection, cracking -> crack)."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if (suffix == 'ed' and word.endswith('eed')) or (suffix == 's' and word.endswith(('ss', 'us', 'is'))):
+                break # bleed, loss, status
+            word = word[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+            break
+    if len(word) >= 4 and word[-1] == word[-2] and word[-1] not in 'aeiouylsz':
+        word = word[:-1] # runn(ing) -> run
+    if len(word) > 4 and word.endswith('e'):
+        word = word[:-1] # tingle and tingl(ing) -> tingl
+    return word
+
+
+def tokenize(text):
+    """Returns the stemmed terms of a text, stop words removed."""
+    return [stem(w) for w in _WORD.findall(text.lower()) if w not in STOP_WORDS and len(w) > 1]
+
+
+def field_texts(entry, field):
+    """The list of text items of a VITAMIN_DATA field (remedies are flattened)."""
+    value = entry.get(field)
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [item for items in value.values() for item in items]
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+class SymptomIndex:
+    """In-memory inverted index with precomputed BM25F impacts."""
+
+    def __init__(self, data, field_weights=FIELD_WEIGHTS, k1=1.2, b=0.75):
+        """
+        Args:
+            data (dict): VITAMIN_DATA (key -> vitamin details).
+            field_weights (dict): Field -> weight of its term frequencies.
+            k1, b (float): BM25 parameters.
+        """
+        self.keys = list(data)
+        self.names = [data[key].get('name', key) for key in self.keys]
+        self.snippets = [] # Per document: list of (field, text, term set) for highlighting matches
+        term_freqs, lengths = [], []
+        for key in self.keys:
+            tf, length, snippets = Counter(), 0.0, []
+            for field, weight in field_weights.items():
+                for text in field_texts(data[key], field):
+                    terms = tokenize(text)
+                    for term in terms:
+                        tf[term] += weight
+                    length += weight * len(terms)
+                    snippets.append((field, text, frozenset(terms)))
+            term_freqs.append(tf)
+            lengths.append(length)
+            self.snippets.append(snippets)
+
+        n_docs = len(self.keys)
+        lengths = np.array(lengths, dtype=np.float32)
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1e-9))
+        postings = defaultdict(lambda: ([], []))
+        for doc, tf in enumerate(term_freqs):
+            for term, freq in tf.items():
+                ids, freqs = postings[term]
+                ids.append(doc)
+                freqs.append(freq)
+        # term -> (doc ids, BM25 impact of the term in each of those documents)
+        self.postings = {}
+        for term, (ids, freqs) in postings.items():
+            ids = np.array(ids, dtype=np.int32)
+            freqs = np.array(freqs, dtype=np.float32)
+            idf = np.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (ids, (idf * freqs * (k1 + 1) / (freqs + norm[ids])).astype(np.float32))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def scores(self, query):
+        """Returns the BM25 score of every document (in self.keys order) for a query."""
+        scores = np.zeros(len(self.keys), dtype=np.float32) # Per query: search runs on many request threads
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def search(self, query, k=5, snippets=3):
+        """
+        Ranks vitamins for a free-text query.
+        Returns:
+            list: Dicts with key, name, score and the matching text items, best first.
+        """
+        terms = set(tokenize(query))
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+
+        results = []
+        for doc in hits:
+            matches = sorted(((len(terms & item_terms), field, text) for field, text, item_terms in self.snippets[doc]
+                              if terms & item_terms), key=lambda m: -m[0])
+            results.append({
+                'key': self.keys[doc],
+                'name': self.names[doc],
+                'score': round(float(scores[doc]), 4),
+                'matches': [{'field': field, 'text': text} for _, field, text in matches[:snippets]],
+            })
+        return results
+
+
+def read_vitamin_data(app_file='test.py'):
+    """Reads the VITAMIN_DATA literal from the app source without importing it (and TensorFlow)."""
+    with open(app_file, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'VITAMIN_DATA' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"No VITAMIN_DATA in {app_file}")
+
+
+def enlarge_corpus(data, scale, seed=0):
+    """Synthetic corpus of len(data) * scale documents mixing items from random vitamins."""
+    rng = random.Random(seed)
+    entries = list(data.values())
+    corpus = {}
+    for i in range(len(entries) * scale):
+        base = entries[i % len(entries)]
+        entry = {'name': f"{base['name']} #{i}"}
+        for field in FIELD_WEIGHTS:
+            items = field_texts(base, field)
+            donor = field_texts(rng.choice(entries), field)
+            entry[field] = rng.sample(items, max(1, len(items) // 2)) + rng.sample(donor, min(2, len(donor)))
+        corpus[f"doc_{i}"] = entry
+    return corpus
+
+
+def benchmark(corpus, queries, rounds=200):
+    start = time.perf_counter()
+    index = SymptomIndex(corpus)
+    build_seconds = time.perf_counter() - start
+    print(f"{len(index)} documents, {len(index.postings)} terms, built in {build_seconds:.2f}s")
+
+    latencies = []
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append(time.perf_counter() - start)
+    us = np.array(latencies) * 1e6
+    print(f"{len(latencies)} queries: mean {us.mean():.0f} us, p50 {np.percentile(us, 50):.0f} us, "
+          f"p99 {np.percentile(us, 99):.0f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search VITAMIN_DATA by symptoms, or benchmark the index.")
+    parser.add_argument('query', nargs='?')
+    parser.add_argument('--app-file', default='test.py', help="Source file defining VITAMIN_DATA.")
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--scale', type=int, default=1000, help="Benchmark corpus size, in copies of VITAMIN_DATA.")
+    args = parser.parse_args()
+
+    data = read_vitamin_data(args.app_file)
+    if args.benchmark:
+        queries = ['bleeding gums', 'night blindness', 'tingling numbness in hands', 'fatigue',
+                   'mouth ulcers and cracked lips', 'bone pain', 'hair loss dermatitis']
+        print("Original corpus:")
+        benchmark(data, queries)
+        print(f"Enlarged corpus (x{args.scale}):")
+        benchmark(enlarge_corpus(data, args.scale), queries, rounds=20)
+        return
+    if not args.query:
+        parser.error("a query is required unless --benchmark is given")
+    for result in SymptomIndex(data).search(args.query, args.k):
+        print(f"{result['score']:7.3f}  {result['name']}")
+        for match in result['matches']:
+            print(f"         [{match['field']}] {match['text']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,118 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort, session
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 # Ensure you have TensorFlow and Keras installed, or comment out if not using AI model
-from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import image
 import numpy as np
 import uuid # For unique filenames
+import atexit
 from datetime import datetime # For tracking registration time
 import urllib.parse 
 import cv2
+from embeddings import build_embedding_model, VectorIndex
+from tta import predict_tta
+from admission import AdmissionController, INTERACTIVE, BULK
+from preprocess_pool import PreprocessPipeline
+from passwords import CredentialVerifier, CredentialBusy
+from database import get_db_connection, init_db, duplicate_field
+from session_store import ServerSideSessionInterface, store_from_config
+from assets import AssetManifest
+from reference_api import ReferenceApi
+from symptom_search import SymptomIndex
+from fusion import SymptomFusion
+from quality_gate import assess_frame, thresholds_from_config
+from roi import decode_roi, predict_multi_crop
+from gradcam import ExplanationService, GradCam
+from model_registry import load_class_indices, load_registered_model
+from runtime_config import apply_runtime, load_runtime_config, SerializedModel
+import active_learning
+from traffic_replay import TrafficRecorder
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
-app.config['SECRET_KEY'] = '020679' # !! IMPORTANT: CHANGE THIS TO A STRONG, RANDOM KEY !!
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '020679') # !! IMPORTANT: SET SECRET_KEY TO A STRONG, RANDOM KEY IN PRODUCTION !!
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
+# Registry spec ('name' or 'name:version', e.g. the distilled student_mobilenetv2) or a model file
+app.config['MODEL_SPEC'] = os.environ.get('MODEL_SPEC', 'vitamin_deficiency_model.h5')
+app.config['EMBEDDING_INDEX_DIR'] = 'embedding_index' # Built with `python embeddings.py build`
+app.config['SIMILAR_RESULTS'] = 5 # Number of similar reference images returned by /similar
+app.config['TTA_ENABLED'] = False # Default for test-time augmentation; requests can override with tta=1/0
+# Admission control in front of inference (see admission.py)
+app.config['ADMISSION_MAX_IN_FLIGHT'] = 4 # Predictions running at once
+app.config['ADMISSION_RESERVED_INTERACTIVE'] = 1 # Slots kept free for camera requests
+app.config['ADMISSION_MAX_QUEUE'] = 8 # Predictions allowed to wait for a slot
+app.config['ADMISSION_QUEUE_TIMEOUT'] = 2.0 # Seconds a prediction may wait before a 503
+app.config['ADMISSION_USER_RATE'] = 0.5 # Sustained predictions per second per user
+app.config['ADMISSION_USER_BURST'] = 5 # Predictions a user may make in a burst
+# Decode uploads in worker processes and batch them on one inference thread (see preprocess_pool.py)
+app.config['PREPROCESS_WORKERS'] = 2 # Decode processes; 0 decodes on the request thread, straight into a shared slot
+app.config['PREPROCESS_SLOTS'] = 32 # Preallocated shared-memory input buffers, reused by every request
+app.config['PREPROCESS_MAX_BATCH'] = 8 # Largest batch the inference thread builds
+# Password hashing runs on its own bounded pool (see passwords.py)
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1' # Older hashes are upgraded on the next login
+app.config['PASSWORD_HASH_WORKERS'] = 2 # Hashes computed at once
+app.config['PASSWORD_HASH_MAX_PENDING'] = 32 # Sign-ins allowed to wait before they are turned away
+# Server-side sessions; the cookie only carries a signed token (see session_store.py)
+app.config['SESSION_BACKEND'] = 'tiered' # 'memory', 'sqlite', 'cache' or 'tiered' (memory LRU over sqlite)
+app.config['SESSION_DB'] = 'sessions.db' # Shared by all worker processes
+app.config['SESSION_LRU_CAPACITY'] = 10000 # Sessions cached per process
+app.config['SESSION_LRU_TTL'] = 5.0 # Seconds a revoked session may linger in another worker's LRU
+app.config['SESSION_PURGE_EVERY'] = 1000 # Session saves between deletions of expired sqlite rows
+app.config['VITAMIN_API_MAX_AGE'] = 300 # Seconds clients may cache /api/vitamins responses before revalidating
+app.config['SYMPTOM_FUSION_WEIGHT'] = 1.0 # Weight of ticked symptoms relative to the image (see fusion.py)
+# Webcam frames failing these checks are rejected before inference (see quality_gate.py)
+app.config['QUALITY_GATE_ENABLED'] = True
+app.config['QUALITY_MIN_CONTRAST'] = 1.0 # Grey-level std below this is a uniform, empty frame
+app.config['QUALITY_MIN_BRIGHTNESS'] = 45.0 # Mean grey level (0-255)
+app.config['QUALITY_MAX_BRIGHTNESS'] = 215.0
+app.config['QUALITY_MAX_CLIPPED'] = 0.5 # Share of nearly black or nearly white pixels
+app.config['QUALITY_MIN_SHARPNESS'] = 20.0 # Laplacian variance on a 160 px wide copy
+app.config['QUALITY_MIN_SKIN'] = 0.04 # Share of skin-coloured pixels
+# Crop uploads to the skin/tissue region before resizing (see roi.py; check `python roi.py --benchmark` first)
+app.config['ROI_ENABLED'] = False
+app.config['ROI_MULTI_CROP'] = False # Average ROI, tight ROI, full and centre crops in one forward pass
+# Grad-CAM heatmaps on /explain/<id>, computed in the background on first request (see gradcam.py)
+app.config['GRADCAM_CACHE_SIZE'] = 64 # Recent model inputs kept in memory for explanations
+app.config['GRADCAM_WORKERS'] = 1 # Heatmaps computed at once
+# Inference runtime (see runtime_config.py); `python tune_runtime.py` measures the best values for the machine
+app.config['RUNTIME_INTRA_OP_THREADS'] = 0 # Threads inside one op (0 = TensorFlow default: all cores)
+app.config['RUNTIME_INTER_OP_THREADS'] = 0 # Ops run side by side (0 = TensorFlow default)
+app.config['RUNTIME_CPU_AFFINITY'] = None # CPU ids to pin to, or 'auto' to split them between RUNTIME_PROCESSES by WORKER_INDEX
+app.config['RUNTIME_PROCESSES'] = 1 # Worker processes sharing the machine
+app.config['RUNTIME_SINGLE_INFERENCE_THREAD'] = False # Run every model call on one thread
+app.config['RUNTIME_CONFIG'] = 'runtime_config.json' # Written by tune_runtime.py; overrides the RUNTIME_* values above
+app.config.update(load_runtime_config(app.config['RUNTIME_CONFIG']))
+# Low-confidence predictions kept for labeling (see active_learning.py)
+app.config['ACTIVE_LEARNING_ENABLED'] = True
+app.config['ACTIVE_LEARNING_DIR'] = 'active_learning' # Prediction log and exported class-folder batches
+app.config['ACTIVE_LEARNING_CAPACITY'] = 500 # Most informative uploads kept as labeling candidates
+app.config['ACTIVE_LEARNING_SCORE'] = 'margin' # 'margin', 'entropy' or 'least_confident'
+# Request shapes recorded for `python traffic_replay.py replay` (no pixels or credentials are stored)
+app.config['TRAFFIC_RECORD_ENABLED'] = os.environ.get('TRAFFIC_RECORD', '0') == '1'
+app.config['TRAFFIC_RECORD_PATH'] = 'traffic.jsonl'
+app.config['TRAFFIC_RECORD_SAMPLE'] = 1.0 # Share of requests recorded
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+admission = AdmissionController.from_config(app.config)
+credentials = CredentialVerifier.from_config(app.config)
+session_store = store_from_config(app.config)
+app.session_interface = ServerSideSessionInterface(session_store)
+# Bundled, fingerprinted CSS/JS built with `python assets.py build`
+asset_manifest = AssetManifest()
+app.jinja_env.globals['asset_url'] = asset_manifest.url
+
 # --- User Management (Flask-Login and SQLite) ---
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-DATABASE = 'users.db'
-
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row # Allows accessing columns by name
-    return conn
-
-def init_db():
-    """Initializes the database by creating the users table if it doesn't exist."""
-    with app.app_context(): # Ensure app context for database operations outside of requests
-        conn = get_db_connection()
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                registered_at TEXT NOT NULL
-            );
-        ''')
-        conn.commit()
-        conn.close()
+traffic_recorder = TrafficRecorder.from_config(app.config)
+if traffic_recorder is not None:
+    traffic_recorder.install(app, user_id=lambda: current_user.get_id() if current_user.is_authenticated else None)
 
 class User(UserMixin):
     """User class for Flask-Login."""
@@ -76,7 +140,7 @@ class User(UserMixin):
     def get_by_username(username):
         """Retrieves a user by their username."""
         conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        user_data = conn.execute('SELECT * FROM users WHERE username = ? COLLATE NOCASE', (username,)).fetchone()
         conn.close()
         if user_data:
             return User(user_data['id'], user_data['username'], user_data['email'], user_data['password'])
@@ -86,7 +150,7 @@ class User(UserMixin):
     def get_by_email(email):
         """Retrieves a user by their email address."""
         conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        user_data = conn.execute('SELECT * FROM users WHERE email = ? COLLATE NOCASE', (email,)).fetchone()
         conn.close()
         if user_data:
             return User(user_data['id'], user_data['username'], user_data['email'], user_data['password'])
@@ -94,7 +158,10 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Callback for Flask-Login to load a user from the database."""
+    """Callback for Flask-Login to load a user, from the session profile when possible."""
+    profile = session.get('_user_profile')
+    if profile and str(profile['id']) == user_id:
+        return User(profile['id'], profile['username'], profile['email'], None) # No database round trip
     return User.get(user_id)
 
 # Initialize the database on application startup
@@ -102,9 +169,13 @@ init_db()
 
 # --- Load the AI Model ---
 model = None # Initialize model to None
+model_entry = None # Registry entry of the served model (input size, class indices)
 try:
-    model = load_model('vitamin_deficiency_model.h5')
-    print("vitamin_deficiency_model.h5 loaded successfully.")
+    runtime = apply_runtime(app.config) # Thread pools can only be sized before TensorFlow starts
+    print(f"Inference runtime: {runtime}")
+    model, model_entry = load_registered_model(app.config['MODEL_SPEC'],
+                                               num_threads=app.config['RUNTIME_INTRA_OP_THREADS'] or None)
+    print(f"{app.config['MODEL_SPEC']} loaded successfully.")
 except Exception as e:
     print(f"Error loading model: {e}")
     # Consider what to do if the model fails to load:
@@ -112,9 +183,29 @@ except Exception as e:
     # - Show an error message to the user
     # For now, `model` remains `None`, and `predict_image` handles it.
 
-# Define class indices (ensure this matches your training)
-# IMPORTANT: Replace these with the actual class indices from your training script's val_generator.class_indices
-CLASS_INDICES = {
+# Same model with a second output: the GlobalAveragePooling2D embedding.
+# One forward pass gives both the prediction and the vector for similar-case lookup.
+embedding_model = None
+pipeline_model = model # The preprocessing pipeline already runs every predict on its one inference thread
+if model is not None:
+    try:
+        embedding_model = build_embedding_model(model)
+    except ValueError as e:
+        print(f"Embeddings unavailable: {e}")
+    if app.config['RUNTIME_SINGLE_INFERENCE_THREAD']: # For the direct calls (TTA, embeddings)
+        model = SerializedModel(model)
+        embedding_model = SerializedModel(embedding_model) if embedding_model is not None else None
+
+similar_index = None
+try:
+    similar_index = VectorIndex.open(app.config['EMBEDDING_INDEX_DIR'])
+    print(f"Embedding index loaded with {len(similar_index)} reference images.")
+except FileNotFoundError as e:
+    print(f"{e}; /similar is disabled until the index is built.")
+
+# Class indices recorded with the served model (the training run's class_indices.json).
+# The list below is only a fallback for when the registry entry or its file is missing.
+FALLBACK_CLASS_INDICES = {
     'Vitamin A deficiency': 0,
     'Vitamin B-12 deficiency': 1,
     'Vitamin B1 deficiency': 2,
@@ -127,6 +218,12 @@ CLASS_INDICES = {
     'Vitamin K deficiency': 9,
     'zinc, iron, biotin, or protein deficiency': 10
 }
+CLASS_INDICES = FALLBACK_CLASS_INDICES
+if model_entry:
+    try:
+        CLASS_INDICES = load_class_indices(model_entry)
+    except (OSError, ValueError) as e:
+        print(f"Could not read the class indices of {app.config['MODEL_SPEC']} ({e}); using the built-in list.")
 
 
 
@@ -146,36 +243,112 @@ class_map={
 }
 # Reverse mapping for prediction output
 CLASS_LABELS = {v: k for k, v in CLASS_INDICES.items()}
-TARGET_SIZE = (224, 224) # Ensure this matches your model's expected input size
+# Input size recorded in the registry (or read from the model), e.g. 128x128 for the MobileNetV2 student
+TARGET_SIZE = tuple(model_entry['target_size']) if model_entry else (224, 224)
+
+preprocess_pipeline = None
+if model is not None:
+    preprocess_pipeline = PreprocessPipeline(pipeline_model, TARGET_SIZE,
+                                             workers=app.config['PREPROCESS_WORKERS'],
+                                             slots=app.config['PREPROCESS_SLOTS'],
+                                             max_batch=app.config['PREPROCESS_MAX_BATCH'])
+    atexit.register(preprocess_pipeline.close) # Release the shared memory on shutdown
+
+def load_image_array(img_path):
+    """Loads an image file as a normalized (1, height, width, 3) batch for the model."""
+    if app.config['ROI_ENABLED']:
+        return decode_roi(img_path, TARGET_SIZE).astype(np.float32) / 255.0
+    img = image.load_img(img_path, target_size=TARGET_SIZE)
+    img_array = image.img_to_array(img) / 255.0 # Normalize pixel values
+    return np.expand_dims(img_array, axis=0) # Add batch dimension: (1, height, width, 3)
+
+def load_camera_array(img_path):
+    """Loads a webcam capture with OpenCV as a normalized (1, height, width, 3) batch."""
+    img = cv2.imread(img_path)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, (TARGET_SIZE[1], TARGET_SIZE[0]))
+    img = image.img_to_array(img)
+    img = np.expand_dims(img, axis=0)
+    return img / 255.0  # normalize
+
+explanations = None
+if model is not None and model_entry.get('format') != 'tflite': # Grad-CAM needs the Keras graph
+    explanations = ExplanationService(lambda: GradCam(model), app.config['UPLOAD_FOLDER'], load_image_array,
+                                      cache_size=app.config['GRADCAM_CACHE_SIZE'],
+                                      workers=app.config['GRADCAM_WORKERS'])
+
+labeling_queue = None
+if model is not None:
+    labeling_queue = active_learning.from_config(app.config)
+    if labeling_queue is not None:
+        atexit.register(labeling_queue.close)
 
-def predict_image(img_path):
+def use_tta():
+    """Whether the current request asked for test-time augmentation (falls back to the app default)."""
+    value = request.values.get('tta')
+    if value is None:
+        return app.config['TTA_ENABLED']
+    return value.lower() in ('1', 'true', 'on', 'yes')
+
+def predict_probabilities(img_path, tta=False):
+    """
+    Returns the model's probability vector for an image file and the model input it
+    was computed from (kept for /explain; None for multi-crop predictions).
+    """
+    if app.config['ROI_MULTI_CROP']:
+        probabilities, _ = predict_multi_crop(model, img_path, TARGET_SIZE)
+        return probabilities, None
+    if tta:
+        img_array = load_image_array(img_path)
+        probabilities, _ = predict_tta(model, img_array)
+        return probabilities, img_array
+    if preprocess_pipeline is not None:
+        # Decoded by a worker process, batched with concurrent requests
+        return preprocess_pipeline.predict(img_path, method='roi' if app.config['ROI_ENABLED'] else 'keras',
+                                           keep_input=True)
+    img_array = load_image_array(img_path)
+    return model.predict(img_array)[0], img_array
+
+def predict_image(img_path, tta=False, symptoms=None):
     """
     Performs a prediction on an image using the loaded Keras model.
     Args:
         img_path (str): The file path to the image.
+        tta (bool): Average over flipped/rotated/cropped views in one batched forward pass.
+        symptoms (list): Ids of symptoms the user ticked, fused with the image prediction.
     Returns:
         tuple: (predicted_class, confidence, status)
     """
     if model is None:
         return "Model not loaded", 0.0, "error"
     try:
-        # Load and preprocess the image
-        img = image.load_img(img_path, target_size=TARGET_SIZE)
-        img_array = image.img_to_array(img) / 255.0 # Normalize pixel values
-        img_array = np.expand_dims(img_array, axis=0) # Add batch dimension: (1, height, width, 3)
-
-        # Make prediction
-        predictions = model.predict(img_array)
+        # Load, preprocess and predict
+        probabilities, model_input = predict_probabilities(img_path, tta)
+        predictions = symptom_fusion.fuse(probabilities, symptoms)[np.newaxis]
         predicted_index = np.argmax(predictions[0])
         confidence = predictions[0][predicted_index]
+        if model_input is not None and explanations is not None:
+            explanations.remember(img_path, model_input, predicted_index) # The heatmap itself is built on demand
 
         predicted_class = CLASS_LABELS.get(predicted_index, "Unknown")
+        if labeling_queue is not None:
+            labeling_queue.record(img_path, probabilities, predicted_class) # The model's own uncertainty, before symptoms
 
         return predicted_class, float(confidence), "success" # Convert numpy float to Python float for JSON
     except Exception as e:
         print(f"Error during prediction: {e}")
         return "Prediction Error", 0.0, f"error: {e}"
 
+def predict_with_embedding(img_path):
+    """
+    Predicts an image and returns its embedding from the same forward pass.
+    Returns:
+        tuple: (predicted_class, confidence, embedding)
+    """
+    predictions, embeddings = embedding_model.predict(load_image_array(img_path))
+    predicted_index = int(np.argmax(predictions[0]))
+    return CLASS_LABELS.get(predicted_index, "Unknown"), float(predictions[0][predicted_index]), embeddings[0]
+
 # --- Vitamin Data Structure for Description Pages ---
 # This dictionary will hold all the detailed information for each vitamin.
 # Use concise keys like 'vitamin_a', 'vitamin_b12' to match URL parameters.
@@ -597,8 +770,20 @@ VITAMIN_DATA = {
     }
 }
 
+# Serialized, hashed and compressed once for /api/vitamins (see reference_api.py)
+vitamin_api = ReferenceApi(VITAMIN_DATA, app.config['VITAMIN_API_MAX_AGE'])
+# Inverted index for /search (see symptom_search.py)
+symptom_index = SymptomIndex(VITAMIN_DATA)
+# Symptom checkboxes on /predict and their precomputed symptom-to-class weights
+symptom_fusion = SymptomFusion(VITAMIN_DATA, CLASS_LABELS, class_map, app.config['SYMPTOM_FUSION_WEIGHT'])
+
 # --- Routes ---
 
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Serves CSS/JS bundles (fingerprinted files are cached by browsers for a year)."""
+    return asset_manifest.send(filename)
+
 @app.route('/')
 @app.route('/home')
 def home():
@@ -634,6 +819,28 @@ def deficiency_detail(vitamin_name):
         return redirect(url_for('description')) # Redirect back to the main description page
     return render_template('deficiency_detail.html', vitamin=vitamin)
 
+@app.route('/api/vitamins')
+def api_vitamins():
+    """JSON list of all vitamins; supports ?fields=, ETag/If-None-Match and gzip/br."""
+    return vitamin_api.respond()
+
+@app.route('/api/vitamins/<string:key>')
+def api_vitamin(key):
+    """JSON details of one vitamin, e.g. /api/vitamins/vitamin_c?fields=name,symptoms."""
+    return vitamin_api.respond(key)
+
+@app.route('/search')
+def search():
+    """Ranks deficiencies for free-text symptoms, e.g. /search?q=bleeding+gums."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query (?q=...)'}), 400
+    k = min(max(request.args.get('k', 5, type=int), 1), len(symptom_index))
+    results = symptom_index.search(query, k)
+    for result in results:
+        result['url'] = url_for('deficiency_detail', vitamin_name=result['key'])
+    return jsonify({'query': query, 'results': results})
+
 @app.route('/contact_us')
 def contact_us():
     """Renders the Contact Us page."""
@@ -663,24 +870,30 @@ def register():
             flash('Passwords do not match!', 'danger')
             return redirect(url_for('register'))
 
-        conn = get_db_connection()
-        user_by_username = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        user_by_email = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        try:
+            hashed_password = credentials.hash(password)
+        except CredentialBusy:
+            flash('The server is busy, please try again in a moment.', 'warning')
+            return redirect(url_for('register'))
+        registered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        if user_by_username:
-            flash('Username already taken!', 'danger')
-        elif user_by_email:
-            flash('Email already registered!', 'danger')
-        else:
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-            registered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # One atomic INSERT; the case-insensitive UNIQUE indexes reject duplicates,
+        # so there is no window between checking a name and claiming it.
+        conn = get_db_connection()
+        try:
             conn.execute('INSERT INTO users (username, email, password, registered_at) VALUES (?, ?, ?, ?)',
                          (username, email, hashed_password, registered_at))
             conn.commit()
-            flash('Registration successful! Please log in.', 'success')
-            conn.close() # Close connection after successful commit
-            return redirect(url_for('login'))
-        conn.close() # Close connection if there was an error and redirect
+        except sqlite3.IntegrityError as e:
+            if duplicate_field(e) == 'email':
+                flash('Email already registered!', 'danger')
+            else:
+                flash('Username already taken!', 'danger')
+            return render_template('register.html')
+        finally:
+            conn.close()
+        flash('Registration successful! Please log in.', 'success')
+        return redirect(url_for('login'))
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -693,13 +906,26 @@ def login():
         password = request.form['password']
 
         conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        user_data = conn.execute('SELECT * FROM users WHERE username = ? COLLATE NOCASE', (username,)).fetchone()
         conn.close()
 
         if user_data:
             user = User(user_data['id'], user_data['username'], user_data['email'], user_data['password'])
-            if check_password_hash(user.password, password):
+            try:
+                valid, new_hash = credentials.verify(user.password, password)
+            except CredentialBusy:
+                flash('The server is busy, please try again in a moment.', 'warning')
+                return render_template('login.html'), 503
+            if valid:
+                if new_hash:
+                    # Transparently upgrade the stored hash to the configured scheme
+                    conn = get_db_connection()
+                    conn.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user.id))
+                    conn.commit()
+                    conn.close()
+                session.rotate() # New session id on login (prevents session fixation)
                 login_user(user)
+                session['_user_profile'] = {'id': user.id, 'username': user.username, 'email': user.email}
                 flash('Logged in successfully!', 'success')
                 return redirect(url_for('home'))
             else:
@@ -713,9 +939,20 @@ def login():
 def logout():
     """Handles user logout."""
     logout_user()
+    session.pop('_user_profile', None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('home'))
 
+@app.route('/logout/all')
+@login_required
+def logout_all():
+    """Revokes every session of the current user, on all devices."""
+    session_store.revoke_user(current_user.id)
+    logout_user()
+    session.clear()
+    flash('You have been logged out on all devices.', 'info')
+    return redirect(url_for('home'))
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
@@ -724,6 +961,7 @@ def dashboard():
 
 @app.route('/predict', methods=['GET', 'POST'])
 @login_required
+@admission.limit(BULK, page=lambda: render_template('predict.html', symptoms=symptom_fusion.symptoms))
 def predict():
     """Handles image upload for prediction."""
     prediction_result = None
@@ -747,8 +985,9 @@ def predict():
             file.save(filepath)
             image_path = url_for('static', filename=f'uploads/{filename}')
 
-            # Perform prediction
-            predicted_class, confidence, status = predict_image(filepath)
+            # Perform prediction, adjusted by any symptoms the user ticked
+            symptoms = symptom_fusion.parse(request.form.getlist('symptoms'))
+            predicted_class, confidence, status = predict_image(filepath, tta=use_tta(), symptoms=symptoms)
             vitamin_key=class_map.get(predicted_class)
           
 
@@ -756,20 +995,24 @@ def predict():
             if status == "success":
                 prediction_result = {
                     'class': predicted_class,
-                    'confidence': f"{confidence*100:.2f}%"
+                    'confidence': f"{confidence*100:.2f}%",
+                    'symptoms': len(symptoms),
+                    'explain_url': url_for('explain', prediction_id=os.path.splitext(filename)[0]) if explanations else None
                 }
                 
             else:
                 flash(f"Error during prediction: {predicted_class}", 'danger')
                 # Optionally remove the uploaded file if prediction failed
                 # os.remove(filepath)
-            return render_template('predict.html', prediction_result=prediction_result, image_path=image_path,deficiency_details=vitamin_key)
+            return render_template('predict.html', prediction_result=prediction_result, image_path=image_path,deficiency_details=vitamin_key,
+                                   symptoms=symptom_fusion.symptoms, selected_symptoms=symptoms)
             
 
-    return render_template('predict.html')
+    return render_template('predict.html', symptoms=symptom_fusion.symptoms)
 
 @app.route('/predict_camera', methods=['POST'])
 @login_required
+@admission.limit(INTERACTIVE)
 def predict_camera():
     """Handle image upload from webcam and predict vitamin deficiency."""
     if 'image' not in request.files:
@@ -781,25 +1024,42 @@ def predict_camera():
 
     if file:
         try:
-            # Save the uploaded file
-            filename = str(uuid.uuid4()) + '.png'
+            data = file.read()
+            # Reject blurry, dark or empty frames before paying for a forward pass
+            if app.config['QUALITY_GATE_ENABLED']:
+                quality = assess_frame(data, thresholds_from_config(app.config))
+                if not quality['ok']:
+                    return jsonify({'error': quality['message'], 'reason': quality['reason'],
+                                    'quality': quality['metrics']}), 422
+
+            # Save the uploaded file (captures arrive as JPEG, older clients send PNG)
+            filename = str(uuid.uuid4()) + (os.path.splitext(file.filename)[1] or '.png')
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            with open(filepath, 'wb') as f:
+                f.write(data)
 
-            # Load and preprocess image
-            img_size = 224
-            img = cv2.imread(filepath)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img = cv2.resize(img, (img_size, img_size))
-            img = image.img_to_array(img)
-            img = np.expand_dims(img, axis=0)
-            img = img / 255.0  # normalize
-
-            # Predict
-            predictions = model.predict(img)
+            # Load, preprocess and predict
+            if use_tta():
+                img_array = load_camera_array(filepath)
+                probabilities, _ = predict_tta(model, img_array)
+                predictions = probabilities[np.newaxis]
+            elif preprocess_pipeline is not None:
+                # Decoded from the bytes already in memory into a preallocated slot
+                probabilities, img_array = preprocess_pipeline.predict(data, method='cv2', keep_input=True)
+                predictions = probabilities[np.newaxis]
+            else:
+                img_array = load_camera_array(filepath)
+                predictions = model.predict(img_array)
+            symptoms = symptom_fusion.parse(request.form.getlist('symptoms'))
+            model_probabilities = predictions[0]
+            predictions = symptom_fusion.fuse(predictions[0], symptoms)[np.newaxis]
             predicted_index = np.argmax(predictions, axis=1)[0]
             predicted_class = CLASS_LABELS[predicted_index]
             confidence = np.max(predictions)
+            if labeling_queue is not None:
+                labeling_queue.record(filepath, model_probabilities, predicted_class, source='camera')
+            if explanations is not None:
+                explanations.remember(filepath, img_array, predicted_index)
 
             # Map to vitamin key
             vitamin_key = class_map.get(predicted_class)
@@ -812,7 +1072,8 @@ def predict_camera():
                 'confidence': f"{confidence * 100:.2f}%",
                 'image_url': url_for('static', filename=f'uploads/{filename}'),
                 'deficiency_details': vitamin_key,
-                'know_more_link': know_more_link
+                'know_more_link': know_more_link,
+                'explain_url': url_for('explain', prediction_id=os.path.splitext(filename)[0]) if explanations else None
             })
 
         except Exception as e:
@@ -820,6 +1081,67 @@ def predict_camera():
 
     return jsonify({'error': 'Prediction failed'}), 500
 
+@app.route('/explain/<string:prediction_id>')
+@login_required
+def explain(prediction_id):
+    """Grad-CAM overlay of a past prediction: 202 while it is computed in the background, then the PNG."""
+    if explanations is None:
+        return jsonify({'error': 'Model not loaded'}), 503
+    state, detail = explanations.request(prediction_id)
+    if state == ExplanationService.READY:
+        return send_from_directory(os.path.abspath(app.config['UPLOAD_FOLDER']), os.path.basename(detail),
+                                   mimetype='image/png')
+    if state == ExplanationService.PENDING:
+        response = jsonify({'status': 'pending', 'url': url_for('explain', prediction_id=prediction_id)})
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    if state == ExplanationService.FAILED:
+        return jsonify({'error': f'Explanation failed: {detail}'}), 500
+    return jsonify({'error': 'Unknown prediction'}), 404
+
+@app.route('/similar', methods=['POST'])
+@login_required
+@admission.limit(BULK)
+def similar():
+    """API endpoint returning the reference images most similar to an uploaded image."""
+    if embedding_model is None or similar_index is None:
+        return jsonify({'error': 'Similar-case lookup is not available'}), 503
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image provided'}), 400
+
+    file = request.files['image']
+    if file.filename == '':
+        return jsonify({'error': 'No selected image file'}), 400
+
+    filename = str(uuid.uuid4()) + (os.path.splitext(file.filename)[1] or '.png')
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file.save(filepath)
+    try:
+        predicted_class, confidence, embedding = predict_with_embedding(filepath)
+        k = min(max(request.args.get('k', app.config['SIMILAR_RESULTS'], type=int), 1), 50)
+        neighbours = similar_index.search(embedding, k=k)
+    except Exception as e:
+        return jsonify({'error': f'Similar-case lookup failed: {str(e)}'}), 500
+
+    return jsonify({
+        'predicted_class': predicted_class,
+        'confidence': f"{confidence * 100:.2f}%",
+        'image_url': url_for('static', filename=f'uploads/{filename}'),
+        'similar': [{
+            'label': n['label'],
+            'similarity': round(n['score'], 4),
+            'image_url': url_for('similar_image', item_id=n['id']),
+        } for n in neighbours]
+    })
+
+@app.route('/similar/image/<int:item_id>')
+@login_required
+def similar_image(item_id):
+    """Serves a reference image from the embedding index."""
+    if similar_index is None or item_id >= len(similar_index):
+        abort(404)
+    return send_from_directory(similar_index.meta['dataset_dir'], similar_index.items[item_id]['path'])
+
 if __name__ == '__main__':
     # Ensure the database is initialized before running the app
     # This init_db() call outside app_context is generally safer for first run.
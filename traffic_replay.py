@@ -0,0 +1,507 @@
+"""
+Record the shape of production traffic and replay it as a load test.
+
+Recording: with TRAFFIC_RECORD_ENABLED the app appends one JSON line per
+request to TRAFFIC_RECORD_PATH (traffic.jsonl). A line holds the start time
+and the gap to the previous request, the method, the route rule and path,
+status and server time, a pseudonymous user id and, for uploads, only the
+shape of each image (width, height, format, bytes). No pixels, passwords,
+usernames, symptom choices or search terms are stored: form fields and
+query parameters are reduced to counts, apart from the tta flag and the
+result count k.
+
+Replay: requests are sent at their recorded offsets divided by --speedup
+(open loop: a slow server does not slow the schedule down, it shows up as
+start lag), except that a user's next request waits for their previous
+response, as a browser would. Every recorded user gets a replay account,
+logged in up front if the user was already signed in at the first
+recorded request; recorded logins, logouts and registrations are replayed
+with those accounts' credentials. Uploads are rebuilt at the recorded size and format
+from a local image source: a folder of real images (e.g. the dataset) or
+synthetic skin-toned textures that pass the webcam quality gate. The
+report gives throughput, errors and latency percentiles per route.
+
+Usage:
+    python traffic_replay.py summary --log traffic.jsonl
+    python traffic_replay.py replay --log traffic.jsonl --base-url http://127.0.0.1:5000 --speedup 4
+    python traffic_replay.py replay --log traffic.jsonl --images dataset/vitamin_project_dataset --output results/replay.json
+"""
+import io
+import os
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_LOG = 'traffic.jsonl'
+SKIPPED_ENDPOINTS = ('static', 'asset') # Served by the CDN/proxy in production
+FLAG_FIELDS = ('tta',) # Form values recorded as they are; every other field only as a count
+QUERY_FIELDS = ('k',) # Query values recorded as they are; every other parameter only as a count
+REPLAY_QUERY_TERM = 'fatigue' # Stands in for counted query values (a common symptom, so /search does real work)
+IMAGE_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'BMP': '.bmp', 'WEBP': '.webp', 'GIF': '.gif', 'MPO': '.jpg'}
+REPLAY_PASSWORD = 'replay-pass-123'
+
+
+# --- Recording ---
+
+class TrafficRecorder:
+    """Flask hooks appending the shape of every request to a JSONL file."""
+
+    def __init__(self, path=DEFAULT_LOG, sample_rate=1.0, salt=''):
+        """
+        Args:
+            path (str): JSONL file to append to (shared by all worker processes).
+            sample_rate (float): Share of requests recorded.
+            salt (str): Mixed into the user pseudonyms (e.g. the secret key).
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.salt = salt
+        self._last_start = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """The app's recorder from TRAFFIC_RECORD_* settings, or None when recording is off."""
+        if not config.get('TRAFFIC_RECORD_ENABLED'):
+            return None
+        return cls(config['TRAFFIC_RECORD_PATH'], config['TRAFFIC_RECORD_SAMPLE'], config.get('SECRET_KEY', ''))
+
+    def install(self, app, user_id=None):
+        """
+        Registers the before/after request hooks.
+        Args:
+            user_id: Callable returning the signed-in user's id (or None) for the current request.
+        """
+        from flask import g, request
+
+        @app.before_request
+        def _traffic_start():
+            g.traffic_start = (time.time(), time.perf_counter(), user_id() if user_id else None)
+
+        @app.after_request
+        def _traffic_record(response):
+            start = g.pop('traffic_start', None)
+            if start is None or request.endpoint in SKIPPED_ENDPOINTS or random.random() >= self.sample_rate:
+                return response
+            try:
+                # The user who sent it: signed in at the start, or by this request (login)
+                user = start[2] if start[2] is not None else (user_id() if user_id else None)
+                self._write(self._describe(request, response, start[:2], user))
+            except Exception as e: # Recording must never fail a request
+                print(f"Traffic recording failed: {e}")
+            return response
+
+    def pseudonym(self, user):
+        if user is None:
+            return None
+        return hashlib.sha256(f"{self.salt}:{user}".encode()).hexdigest()[:12]
+
+    def _describe(self, request, response, start, user):
+        started, perf_start = start
+        with self._lock:
+            gap = None if self._last_start is None else started - self._last_start
+            self._last_start = started
+        record = {
+            'ts': round(started, 4),
+            'gap_ms': round(gap * 1000, 1) if gap is not None else None,
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'path': request.path,
+            'query': {key: (request.args.get(key) if key in QUERY_FIELDS else len(request.args.getlist(key)))
+                      for key in request.args},
+            'status': response.status_code,
+            'server_ms': round((time.perf_counter() - perf_start) * 1000, 2),
+            'user': self.pseudonym(user),
+        }
+        if request.method == 'POST':
+            record['form'] = {key: (request.form.get(key) if key in FLAG_FIELDS else len(request.form.getlist(key)))
+                              for key in request.form}
+            record['files'] = [self._image_shape(field, storage) for field, storage in request.files.items(multi=True)]
+        return record
+
+    @staticmethod
+    def _image_shape(field, storage):
+        """Size and format of an uploaded image (reads only its header)."""
+        shape = {'field': field, 'extension': os.path.splitext(storage.filename or '')[1].lower()}
+        try:
+            storage.stream.seek(0, os.SEEK_END)
+            shape['bytes'] = storage.stream.tell()
+            storage.stream.seek(0)
+            with Image.open(storage.stream) as img:
+                shape.update(width=img.width, height=img.height, format=img.format)
+        except Exception:
+            pass # Not an image (or the stream is gone): replayed as a default-sized JPEG
+        return shape
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line) # One short append per line, safe across worker processes
+
+
+def load_log(path, routes=None):
+    """Reads a traffic log (optionally only some routes), sorted by start time."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # A line torn by a crash
+            if routes and (record.get('route') or record['path']) not in routes:
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r['ts'])
+    return records
+
+
+# --- Replay ---
+
+class ImageSource:
+    """Upload bodies for replay: real images from a folder, or synthetic ones, encoded at the recorded shape."""
+
+    def __init__(self, directory=None, variants=8, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.variants = variants
+        self.files = []
+        if directory:
+            for root, _, filenames in os.walk(directory):
+                self.files += [os.path.join(root, name) for name in filenames
+                               if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
+            if not self.files:
+                raise ValueError(f"No images found under {directory}")
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _pixels(self, width, height):
+        if self.files:
+            with Image.open(self.files[int(self.rng.integers(len(self.files)))]) as img:
+                return img.convert('RGB').resize((width, height))
+        # Skin tone with texture: passes the quality gate's contrast, sharpness and skin checks
+        base = np.array([205, 150, 125], dtype=np.float32) * self.rng.uniform(0.85, 1.1)
+        noise = self.rng.normal(0, 18, (height // 4 + 1, width // 4 + 1, 1)).astype(np.float32)
+        texture = np.kron(noise, np.ones((4, 4, 1), dtype=np.float32))[:height, :width]
+        return Image.fromarray(np.clip(base + texture, 0, 255).astype(np.uint8))
+
+    def body(self, shape):
+        """Returns (filename, bytes, content type) for a recorded image shape; a few variants per shape are reused."""
+        width, height = shape.get('width') or 640, shape.get('height') or 480
+        fmt = shape.get('format') or 'JPEG'
+        fmt = fmt if fmt in IMAGE_FORMATS else 'JPEG'
+        key = (width, height, fmt)
+        with self._lock:
+            bodies = self._cache.setdefault(key, [])
+            if len(bodies) < self.variants:
+                buffer = io.BytesIO()
+                self._pixels(width, height).save(buffer, 'JPEG' if fmt == 'MPO' else fmt)
+                bodies.append(buffer.getvalue())
+            data = bodies[int(self.rng.integers(len(bodies)))]
+        extension = shape.get('extension') or IMAGE_FORMATS[fmt]
+        return f"replay{extension}", data, Image.MIME.get(fmt, 'application/octet-stream')
+
+
+def encode_multipart(fields, files):
+    """multipart/form-data body for urllib. files: [(field, filename, data, content_type)]."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for field, filename, data, content_type in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None # Time the recorded request only, not the page it redirects to
+
+
+class ReplayClient:
+    """One cookie jar per recorded user, so sessions behave as they did in production."""
+
+    def __init__(self, base_url, timeout=30.0, run_id=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.run_id = run_id or uuid.uuid4().hex[:6]
+        self._openers = {}
+        self._lock = threading.Lock()
+
+    def opener(self, user):
+        with self._lock:
+            if user not in self._openers:
+                jar = http.cookiejar.CookieJar()
+                self._openers[user] = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar),
+                                                                  _NoRedirect)
+            return self._openers[user]
+
+    def username(self, user):
+        return f"replay_{self.run_id}_{user}"
+
+    def send(self, user, method, path, fields=(), files=(), form=None):
+        """Returns (status, seconds); status is None when the request failed without a response."""
+        url = self.base_url + path
+        data, headers = None, {}
+        if files:
+            data, headers['Content-Type'] = encode_multipart(fields, files)
+        elif method == 'POST':
+            data = urllib.parse.urlencode(list(fields)).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener(user).open(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = None
+        return status, time.perf_counter() - start
+
+    def register(self, user, unique=''):
+        name = self.username(user) + unique
+        return self.send(user, 'POST', '/register', [('username', name), ('email', f"{name}@replay.invalid"),
+                                                     ('password', REPLAY_PASSWORD),
+                                                     ('confirm_password', REPLAY_PASSWORD)])
+
+    def login(self, user):
+        return self.send(user, 'POST', '/login', [('username', self.username(user)), ('password', REPLAY_PASSWORD)])
+
+
+def replay_request(client, images, record):
+    """Rebuilds one recorded request and sends it; returns (status, seconds)."""
+    user = record.get('user') or 'anonymous'
+    route = record.get('route') or record['path']
+    query = []
+    for key, value in (record.get('query') or {}).items():
+        query += [(key, value)] if key in QUERY_FIELDS else [(key, REPLAY_QUERY_TERM)] * value
+    path = record['path'] + (f"?{urllib.parse.urlencode(query)}" if query else '')
+    if record['method'] != 'POST':
+        return client.send(user, record['method'], path)
+    if route == '/login':
+        return client.login(user)
+    if route == '/register':
+        return client.register(user, unique=f"_{uuid.uuid4().hex[:8]}") # A new account each time, like production
+    fields = []
+    for key, value in (record.get('form') or {}).items():
+        if key in FLAG_FIELDS:
+            fields.append((key, value))
+        else:
+            fields += [(key, str(i)) for i in range(value)] # e.g. the first N symptom ids
+    files = [(shape['field'],) + images.body(shape) for shape in record.get('files') or []]
+    return client.send(user, 'POST', path, fields, files)
+
+
+def prepare_users(client, records):
+    """Creates a replay account per recorded user; logs in those who were signed in when recording began."""
+    first = {}
+    for record in records:
+        if record.get('user'):
+            first.setdefault(record['user'], record)
+    for user, record in first.items():
+        client.register(user)
+        if record.get('route') not in ('/login', '/register'):
+            status, _ = client.login(user)
+            if status not in (200, 302):
+                print(f"Warning: login of replay user {client.username(user)} returned {status}")
+    return len(first)
+
+
+class _UserChains:
+    """
+    Runs each user's requests one after the other, like a browser. A request
+    that comes due while the same user's previous one is still in flight is
+    queued and submitted to the pool when that one finishes, so no worker
+    thread is parked waiting and other users' requests keep their schedule.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._queued = {} # user -> calls waiting for the user's request in flight
+        self._unfinished = 0
+        self._condition = threading.Condition()
+
+    def submit(self, user, fn, *args):
+        with self._condition:
+            self._unfinished += 1
+            if user is not None:
+                if user in self._queued:
+                    self._queued[user].append((fn, args))
+                    return
+                self._queued[user] = deque()
+        self._pool.submit(self._run, user, fn, args)
+
+    def _run(self, user, fn, args):
+        try:
+            fn(*args)
+        finally:
+            following = self._finished(user)
+            if following is not None:
+                self._pool.submit(self._run, user, *following)
+
+    def _finished(self, user):
+        """Returns the user's next queued call, or None once they have nothing queued."""
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+            if user is None:
+                return None
+            if not self._queued[user]:
+                del self._queued[user]
+                return None
+            return self._queued[user].popleft()
+
+    def join(self):
+        """Blocks until every submitted call, queued ones included, has run."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._unfinished == 0)
+
+
+def replay(records, base_url, speedup=1.0, concurrency=32, images=None, timeout=30.0):
+    """
+    Sends the recorded requests at their (sped-up) offsets.
+    Returns:
+        dict: Overall and per-route throughput, errors and latency percentiles.
+    """
+    client = ReplayClient(base_url, timeout)
+    images = images or ImageSource()
+    users = prepare_users(client, records)
+    print(f"Replaying {len(records)} requests from {users} users at {speedup:g}x")
+
+    results = []
+    results_lock = threading.Lock()
+    t0 = records[0]['ts']
+
+    def run(record, scheduled):
+        lag = time.perf_counter() - scheduled # Includes any wait for the user's previous request
+        status, seconds = replay_request(client, images, record)
+        with results_lock:
+            results.append((record.get('route') or record['path'], record['method'], status, seconds, lag))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        chains = _UserChains(pool)
+        started = time.perf_counter()
+        for record in records:
+            scheduled = started + (record['ts'] - t0) / speedup
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            chains.submit(record.get('user'), run, record, scheduled)
+        chains.join() # Queued requests are submitted from worker threads, so the pool must stay open until then
+    wall = time.perf_counter() - started
+    return summarize_results(results, wall, speedup, records)
+
+
+def _percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    if not len(ms):
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    return {f'p{p}_ms': round(float(np.percentile(ms, p)), 2) for p in (50, 95, 99)}
+
+
+def summarize_results(results, wall, speedup, records):
+    by_route = defaultdict(list)
+    for route, method, status, seconds, lag in results:
+        by_route[f"{method} {route}"].append((status, seconds, lag))
+    routes = {}
+    for name, rows in sorted(by_route.items()):
+        ok = [seconds for status, seconds, _ in rows if status is not None and status < 500]
+        statuses = defaultdict(int)
+        for status, _, _ in rows:
+            statuses[str(status)] += 1
+        routes[name] = {'requests': len(rows), 'errors': len(rows) - len(ok), 'statuses': dict(statuses),
+                        **_percentiles(ok)}
+    ok = [seconds for _, _, status, seconds, _ in results if status is not None and status < 500]
+    recorded_span = records[-1]['ts'] - records[0]['ts'] if records else 0.0
+    return {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'wall_seconds': round(wall, 2),
+        'requests_per_second': round(len(results) / wall, 2) if wall else 0.0,
+        'speedup': speedup,
+        'recorded_seconds': round(recorded_span, 2),
+        'max_start_lag_ms': round(max((lag for *_, lag in results), default=0.0) * 1000, 1),
+        **_percentiles(ok),
+        'routes': routes,
+    }
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['wall_seconds']}s ({report['requests_per_second']} req/s), "
+          f"{report['errors']} errors, max start lag {report['max_start_lag_ms']} ms")
+    print(f"{'route':36s} {'reqs':>6s} {'errors':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8s}"
+    for name, r in report['routes'].items():
+        print(f"{name[:36]:36s} {r['requests']:6d} {r['errors']:7d} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} "
+              f"{fmt(r['p99_ms'])}")
+    print(f"{'all':36s} {report['requests']:6d} {report['errors']:7d} {fmt(report['p50_ms'])} "
+          f"{fmt(report['p95_ms'])} {fmt(report['p99_ms'])}")
+
+
+def print_summary(records):
+    span = records[-1]['ts'] - records[0]['ts'] if len(records) > 1 else 0.0
+    print(f"{len(records)} requests over {span:.1f}s from {len({r.get('user') for r in records if r.get('user')})} users")
+    by_route = defaultdict(list)
+    for record in records:
+        by_route[f"{record['method']} {record.get('route') or record['path']}"].append(record)
+    print(f"{'route':36s} {'reqs':>6s} {'server p50':>11s} {'server p95':>11s} {'images':>7s}")
+    for name, rows in sorted(by_route.items(), key=lambda item: -len(item[1])):
+        server = [r['server_ms'] for r in rows]
+        images = sum(len(r.get('files') or []) for r in rows)
+        print(f"{name[:36]:36s} {len(rows):6d} {np.percentile(server, 50):11.1f} {np.percentile(server, 95):11.1f} "
+              f"{images:7d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or replay recorded production traffic.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    summary = sub.add_parser('summary', help="Describe a traffic log.")
+    summary.add_argument('--log', default=DEFAULT_LOG)
+
+    run = sub.add_parser('replay', help="Replay a traffic log against a running app.")
+    run.add_argument('--log', default=DEFAULT_LOG)
+    run.add_argument('--base-url', default='http://127.0.0.1:5000')
+    run.add_argument('--speedup', type=float, default=1.0, help="Divide the recorded gaps by this factor.")
+    run.add_argument('--concurrency', type=int, default=32, help="Requests in flight at most.")
+    run.add_argument('--routes', nargs='+', default=None, help="Only replay these route rules, e.g. /predict /login.")
+    run.add_argument('--limit', type=int, default=None, help="Replay only the first N requests.")
+    run.add_argument('--images', default=None, help="Folder of real images for uploads (default: synthetic).")
+    run.add_argument('--timeout', type=float, default=30.0)
+    run.add_argument('--output', default=None, help="Write the JSON report here.")
+    args = parser.parse_args()
+
+    records = load_log(args.log, getattr(args, 'routes', None))
+    if not records:
+        raise SystemExit(f"No requests in {args.log}")
+    if args.command == 'summary':
+        print_summary(records)
+        return
+
+    records = records[:args.limit] if args.limit else records
+    report = replay(records, args.base_url, args.speedup, args.concurrency, ImageSource(args.images), args.timeout)
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
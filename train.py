@@ -0,0 +1,459 @@
+"""
+Resumable and incremental training of the vitamin deficiency classifier.
+
+vitamin-training.ipynb trains ResNet152V2 with a single model.fit(epochs=50)
+and saves only at the end, so an interrupted run starts over and a few
+hundred newly labeled images mean retraining on everything. This entry
+point trains batch by batch from the class-folder dataset and:
+
+* checkpoints the weights, the optimizer state and the data position
+  (epoch and next batch; each epoch's order and augmentation are derived
+  from the seed, so a resumed run sees exactly the batches it would have)
+  every --checkpoint-every steps, at the end of every epoch and on Ctrl+C,
+  under checkpoints/<run>/;
+* resumes the latest unfinished run (or a named one) with --resume;
+* records a manifest (path, size, mtime) of the dataset files each model
+  was trained on, so `incremental` fine-tunes a registered model on only
+  the images added or changed since, mixed with a replay sample of the
+  old ones so the other classes are not forgotten;
+* registers the result as a new registry version when it finishes.
+
+The validation split is chosen per file from a hash of its path, so it
+stays the same as the dataset grows and new images never leak from
+validation into training between runs.
+
+Usage:
+    python train.py full --name resnet152v2 --epochs 50
+    python train.py full --resume
+    python train.py incremental --base resnet152v2 --epochs 5
+    python train.py snapshot --model resnet152v2:1
+"""
+import os
+import json
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dataset_cache import DEFAULT_DATASET_DIR, decode_image, is_validation, list_dataset, to_model_input
+from distill import random_flip
+from model_registry import load_class_indices, load_registered_model, register_model, resolve_model
+
+DEFAULT_CHECKPOINT_DIR = 'checkpoints'
+STATE_FILE = 'state.json'
+
+
+# --- Dataset manifest ---
+
+def dataset_manifest(dataset_dir):
+    """
+    Lists the dataset with a fingerprint per file.
+    Returns:
+        tuple: (files, labels, class_indices, manifest) where manifest maps each
+        relative path to [size, mtime_ns].
+    """
+    files, labels, class_indices = list_dataset(dataset_dir)
+    manifest = {}
+    for rel in files:
+        stat = os.stat(os.path.join(dataset_dir, rel))
+        manifest[rel] = [stat.st_size, stat.st_mtime_ns]
+    return files, labels, class_indices, manifest
+
+
+def changed_files(manifest, previous):
+    """Files that are new or modified compared to a previous manifest."""
+    return [rel for rel, fingerprint in manifest.items() if previous.get(rel) != fingerprint]
+
+
+def save_manifest(path, dataset_dir, manifest):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'dataset_dir': os.path.abspath(dataset_dir),
+                   'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   'files': manifest}, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)['files']
+
+
+# --- Run state ---
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path) # A crash mid-write never leaves a torn state file
+
+
+def load_state(run_dir):
+    with open(os.path.join(run_dir, STATE_FILE)) as f:
+        return json.load(f)
+
+
+def find_run(checkpoint_dir, run=None):
+    """Returns the run directory to resume: the named run, or the newest unfinished one."""
+    if run and run != 'latest':
+        run_dir = os.path.join(checkpoint_dir, run)
+        if not os.path.exists(os.path.join(run_dir, STATE_FILE)):
+            raise FileNotFoundError(f"No training run '{run}' in {checkpoint_dir}")
+        return run_dir
+    candidates = []
+    for name in os.listdir(checkpoint_dir) if os.path.isdir(checkpoint_dir) else []:
+        path = os.path.join(checkpoint_dir, name, STATE_FILE)
+        if os.path.exists(path):
+            state = load_state(os.path.dirname(path))
+            if not state.get('finished'):
+                candidates.append((state['started_at'], os.path.dirname(path)))
+    if not candidates:
+        raise FileNotFoundError(f"No unfinished training run in {checkpoint_dir}")
+    return max(candidates)[1]
+
+
+def epoch_order(count, seed, epoch):
+    """Shuffled row order of an epoch; a function of (seed, epoch) only, so it is the same after a resume."""
+    return np.random.default_rng([seed, epoch]).permutation(count)
+
+
+def load_batch(dataset_dir, files, size):
+    """Decodes a list of relative paths into a uint8 batch (unreadable files are skipped)."""
+    pixels, kept = [], []
+    for i, rel in enumerate(files):
+        try:
+            pixels.append(decode_image(os.path.join(dataset_dir, rel), size))
+            kept.append(i)
+        except Exception as e:
+            print(f"Skipping unreadable image {rel}: {e}")
+    if not pixels:
+        return np.zeros((0, size, size, 3), dtype=np.uint8), kept
+    return np.stack(pixels), kept
+
+
+# --- Model ---
+
+def build_model(num_classes, size=224):
+    """ResNet152V2 with the head of vitamin-training.ipynb, all layers trainable."""
+    from tensorflow.keras.applications import ResNet152V2
+    from tensorflow.keras.layers import BatchNormalization, Dense, Dropout, GlobalAveragePooling2D, Input
+    from tensorflow.keras.models import Model
+
+    base_model = ResNet152V2(weights='imagenet', include_top=False, input_shape=(size, size, 3))
+    inputs = Input(shape=(size, size, 3))
+    x = base_model(inputs, training=True)
+    x = GlobalAveragePooling2D()(x)
+    x = BatchNormalization()(x)
+    x = Dense(2048, activation='relu')(x)
+    x = Dropout(0.4)(x)
+    x = Dense(1024, activation='relu')(x)
+    x = Dropout(0.3)(x)
+    outputs = Dense(num_classes, activation='softmax')(x)
+    return Model(inputs, outputs)
+
+
+class Checkpointer:
+    """Weights + optimizer checkpoints of a run (tf.train.CheckpointManager), tied to state.json."""
+
+    def __init__(self, model, run_dir, keep=3):
+        import tensorflow as tf
+
+        if hasattr(model.optimizer, 'build'):
+            model.optimizer.build(model.trainable_variables) # Create the slots so they restore eagerly
+        self.run_dir = run_dir
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, os.path.join(run_dir, 'ckpt'), max_to_keep=keep)
+
+    def restore(self, state):
+        if state.get('checkpoint'):
+            self.checkpoint.restore(state['checkpoint']).expect_partial()
+            print(f"Restored {state['checkpoint']} (epoch {state['epoch'] + 1}, batch {state['batch']})")
+
+    def save(self, state):
+        """Writes the checkpoint first, then the state pointing at it."""
+        state['checkpoint'] = self.manager.save(checkpoint_number=state['step'])
+        _write_json(os.path.join(self.run_dir, STATE_FILE), state)
+
+
+def evaluate_files(model, dataset_dir, files, labels, size, batch_size=32):
+    """Validation loss and accuracy over a list of files."""
+    correct, loss, seen = 0, 0.0, 0
+    for start in range(0, len(files), batch_size):
+        pixels, kept = load_batch(dataset_dir, files[start:start + batch_size], size)
+        if not kept:
+            continue
+        y = np.asarray(labels[start:start + batch_size])[kept]
+        probs = model.predict(to_model_input(pixels), verbose=0)
+        loss -= float(np.sum(np.log(np.clip(probs[np.arange(len(y)), y], 1e-7, 1.0))))
+        correct += int(np.sum(np.argmax(probs, axis=1) == y))
+        seen += len(y)
+    return {'val_loss': loss / max(seen, 1), 'val_accuracy': correct / max(seen, 1)}
+
+
+# --- Runs ---
+
+def start_run(mode, dataset_dir, name, base=None, since=None, epochs=50, batch_size=32, learning_rate=None,
+              validation_split=0.2, replay=1.0, seed=42, checkpoint_dir=DEFAULT_CHECKPOINT_DIR):
+    """
+    Plans a new run and writes its initial state.
+    Args:
+        mode (str): 'full' trains from ImageNet weights; 'incremental' fine-tunes `base`.
+        base (str): Registry spec of the model to fine-tune (incremental).
+        since (str): Manifest the base was trained on (defaults to the one recorded in the registry).
+        replay (float): Old training images mixed in per new image (incremental).
+    Returns:
+        str: The run directory.
+    """
+    files, labels, class_indices, manifest = dataset_manifest(dataset_dir)
+    if not files:
+        raise ValueError(f"No images found under {dataset_dir}")
+    label_of = dict(zip(files, labels))
+    val_files = [rel for rel in files if is_validation(rel, validation_split, seed)]
+    train_files = [rel for rel in files if not is_validation(rel, validation_split, seed)]
+
+    size = 224
+    if mode == 'incremental':
+        entry = resolve_model(base)
+        size = entry['target_size'][0] if entry.get('target_size') else size
+        if load_class_indices(entry) != class_indices:
+            raise ValueError(f"The dataset classes differ from those of {base}; adding a class needs a full run.")
+        since = since or entry.get('manifest')
+        if not since:
+            raise ValueError(f"{base} has no training manifest; pass --since, or record one for the dataset it "
+                             f"was trained on with `python train.py snapshot --model {base}`.")
+        new = set(changed_files(manifest, load_manifest(since)))
+        new_train = [rel for rel in train_files if rel in new]
+        if not new_train:
+            raise ValueError(f"No new training images since {since}; nothing to do.")
+        old_train = [rel for rel in train_files if rel not in new]
+        rng = np.random.default_rng(seed)
+        count = min(len(old_train), int(round(len(new_train) * replay)))
+        replayed = [old_train[i] for i in sorted(rng.choice(len(old_train), count, replace=False))]
+        print(f"{len(new_train)} new training images since {since}, replaying {len(replayed)} old ones")
+        train_files = new_train + replayed
+
+    run = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    run_dir = os.path.join(checkpoint_dir, run)
+    os.makedirs(run_dir, exist_ok=True)
+    state = {
+        'run': run,
+        'mode': mode,
+        'name': name,
+        'base': base,
+        'since': since,
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'target_size': [size, size],
+        'class_indices': class_indices,
+        'config': {'epochs': epochs, 'batch_size': batch_size, 'validation_split': validation_split, 'seed': seed,
+                   'learning_rate': learning_rate or (1e-5 if mode == 'incremental' else 1e-4), 'replay': replay},
+        'train_files': train_files,
+        'train_labels': [label_of[rel] for rel in train_files],
+        'val_files': val_files,
+        'val_labels': [label_of[rel] for rel in val_files],
+        'manifest': manifest, # What the finished model will have been trained on
+        'epoch': 0, # Data position: next epoch and next batch within it
+        'batch': 0,
+        'step': 0,
+        'epoch_totals': {}, # Sample-weighted sums of this epoch's batch logs, so a resumed epoch still averages them all
+        'epoch_samples': 0,
+        'history': [],
+        'best_val_loss': None,
+        'stale_epochs': 0,
+        'checkpoint': None,
+        'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'finished': False,
+    }
+    _write_json(os.path.join(run_dir, STATE_FILE), state)
+    print(f"Run {run}: {len(train_files)} training and {len(val_files)} validation images")
+    return run_dir
+
+
+def epoch_averages(state):
+    """Sample-weighted means of the batch logs seen so far this epoch (loss, accuracy)."""
+    return {name: total / max(state['epoch_samples'], 1) for name, total in state['epoch_totals'].items()}
+
+
+def train(run_dir, checkpoint_every=50, patience=5, lr_patience=3, lr_factor=0.2, min_lr=1e-6):
+    """
+    Trains (or continues) a run until its epochs are done or validation loss stops improving.
+    Early stopping and the learning-rate reduction mirror the notebook's callbacks;
+    the best weights are kept in the run directory and restored at the end.
+    Returns:
+        tuple: (model, state)
+    """
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.utils import to_categorical
+
+    state = load_state(run_dir)
+    state.setdefault('epoch_totals', {}) # Runs checkpointed before the epoch averages existed
+    state.setdefault('epoch_samples', 0)
+    config = state['config']
+    dataset_dir, size = state['dataset_dir'], state['target_size'][0]
+    num_classes = len(state['class_indices'])
+    best_weights = os.path.join(run_dir, 'best.weights.h5')
+
+    if state['mode'] == 'incremental':
+        model, _ = load_registered_model(state['base'])
+    else:
+        model = build_model(num_classes, size)
+    model.compile(optimizer=Adam(learning_rate=config['learning_rate']), loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    checkpointer = Checkpointer(model, run_dir)
+    checkpointer.restore(state)
+
+    files, labels = state['train_files'], np.asarray(state['train_labels'])
+    batch_size = config['batch_size']
+    batches = int(np.ceil(len(files) / batch_size))
+
+    def batch_rows(epoch, batch):
+        return np.sort(epoch_order(len(files), config['seed'], epoch)[batch * batch_size:(batch + 1) * batch_size])
+
+    def fetch(epoch, batch):
+        rows = batch_rows(epoch, batch)
+        pixels, kept = load_batch(dataset_dir, [files[r] for r in rows], size)
+        x = random_flip(to_model_input(pixels), np.random.default_rng([config['seed'], epoch, batch]))
+        return x, to_categorical(labels[rows[kept]], num_classes)
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch: # Decode the next batch while this one trains
+        try:
+            while state['epoch'] < config['epochs'] and not state['finished']:
+                epoch = state['epoch']
+                pending = prefetch.submit(fetch, epoch, state['batch']) if state['batch'] < batches else None
+                totals = state['epoch_totals']
+                while pending is not None:
+                    x, y = pending.result()
+                    following = state['batch'] + 1
+                    pending = prefetch.submit(fetch, epoch, following) if following < batches else None
+                    if len(x):
+                        # Each call's logs cover this batch only (train_on_batch resets the metrics)
+                        for name, value in model.train_on_batch(x, y, return_dict=True).items():
+                            totals[name] = totals.get(name, 0.0) + float(value) * len(x)
+                        state['epoch_samples'] += len(x)
+                    logs = epoch_averages(state)
+                    state['batch'], state['step'] = following, state['step'] + 1
+                    if state['step'] % checkpoint_every == 0:
+                        checkpointer.save(state)
+                    print(f"\repoch {epoch + 1}/{config['epochs']} batch {state['batch']}/{batches} "
+                          f"loss {float(logs.get('loss', 0.0)):.4f} acc {float(logs.get('accuracy', 0.0)):.4f}",
+                          end='', flush=True)
+
+                logs = epoch_averages(state)
+                metrics = evaluate_files(model, dataset_dir, state['val_files'], state['val_labels'], size, batch_size)
+                lr = float(model.optimizer.learning_rate.numpy())
+                state['history'].append(dict(logs, epoch=epoch + 1, learning_rate=lr, **metrics))
+                print(f" - val_loss {metrics['val_loss']:.4f} val_acc {metrics['val_accuracy']:.4f}")
+
+                if state['best_val_loss'] is None or metrics['val_loss'] < state['best_val_loss']:
+                    state['best_val_loss'], state['stale_epochs'] = metrics['val_loss'], 0
+                    model.save_weights(best_weights)
+                else:
+                    state['stale_epochs'] += 1
+                    if state['stale_epochs'] % lr_patience == 0 and lr > min_lr:
+                        model.optimizer.learning_rate.assign(max(lr * lr_factor, min_lr))
+                        print(f"Reducing learning rate to {max(lr * lr_factor, min_lr):.1e}")
+                    if state['stale_epochs'] >= patience:
+                        print(f"No improvement for {patience} epochs, stopping.")
+                        state['finished'] = True
+                state['epoch'], state['batch'] = epoch + 1, 0
+                state['epoch_totals'], state['epoch_samples'] = {}, 0
+                checkpointer.save(state)
+        except KeyboardInterrupt:
+            checkpointer.save(state)
+            print(f"\nInterrupted; checkpoint saved. Resume with `python train.py {state['mode']} "
+                  f"--resume {state['run']}`.")
+            raise SystemExit(1)
+
+    if os.path.exists(best_weights):
+        model.load_weights(best_weights)
+    state['finished'] = True
+    _write_json(os.path.join(run_dir, STATE_FILE), state)
+    return model, state
+
+
+def finish_run(model, state, output_dir='models', register=True):
+    """Saves the model, its class indices and training manifest, and registers a new version."""
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, f"{state['run']}.h5")
+    stem = os.path.splitext(output)[0]
+    model.save(output)
+    with open(stem + '_class_indices.json', 'w') as f:
+        json.dump(state['class_indices'], f, indent=4)
+    save_manifest(stem + '_manifest.json', state['dataset_dir'], state['manifest'])
+    print(f"Model saved to {output}")
+
+    best = min(state['history'], key=lambda h: h['val_loss']) if state['history'] else {}
+    if not register:
+        return None
+    notes = (f"Incremental fine-tune of {state['base']} on {len(state['train_files'])} images"
+             if state['mode'] == 'incremental' else "ResNet152V2 trained with train.py")
+    return register_model(state['name'], output, state['target_size'], fmt='h5',
+                          class_indices=stem + '_class_indices.json',
+                          metrics={k: round(best[k], 4) for k in ('val_loss', 'val_accuracy') if k in best},
+                          notes=notes, manifest=stem + '_manifest.json', base=state['base'], run=state['run'],
+                          epochs=len(state['history']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable full or incremental training.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dataset', default=DEFAULT_DATASET_DIR)
+    common.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR)
+    common.add_argument('--resume', nargs='?', const='latest', default=None,
+                        help="Continue an unfinished run (the newest one, or the run name given).")
+    common.add_argument('--epochs', type=int, default=None)
+    common.add_argument('--batch-size', type=int, default=32)
+    common.add_argument('--learning-rate', type=float, default=None)
+    common.add_argument('--validation-split', type=float, default=0.2)
+    common.add_argument('--seed', type=int, default=42)
+    common.add_argument('--checkpoint-every', type=int, default=50, help="Training steps between checkpoints.")
+    common.add_argument('--patience', type=int, default=5, help="Epochs without val_loss improvement before stopping.")
+    common.add_argument('--output-dir', default='models')
+    common.add_argument('--no-register', action='store_true')
+
+    full = sub.add_parser('full', parents=[common], help="Train from ImageNet weights on the whole dataset.")
+    full.add_argument('--name', default='resnet152v2', help="Registry name of the trained model.")
+
+    incremental = sub.add_parser('incremental', parents=[common],
+                                 help="Fine-tune a registered model on images added since it was trained.")
+    incremental.add_argument('--base', default='resnet152v2', help="Registry spec of the model to fine-tune.")
+    incremental.add_argument('--name', default=None, help="Registry name of the result (default: the base name).")
+    incremental.add_argument('--since', default=None, help="Manifest the base was trained on.")
+    incremental.add_argument('--replay', type=float, default=1.0, help="Old training images mixed in per new one.")
+
+    snapshot = sub.add_parser('snapshot', help="Record the current dataset as the manifest of an existing model.")
+    snapshot.add_argument('--model', required=True, help="Registry spec the manifest belongs to.")
+    snapshot.add_argument('--dataset', default=DEFAULT_DATASET_DIR)
+    snapshot.add_argument('--output', default=None, help="Default: models/<name>_<version>_manifest.json")
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        entry = resolve_model(args.model)
+        output = args.output or os.path.join('models', f"{entry['name']}_{entry['version']}_manifest.json")
+        _, _, _, manifest = dataset_manifest(args.dataset)
+        save_manifest(output, args.dataset, manifest)
+        print(f"Recorded {len(manifest)} files in {output}; use it with "
+              f"`python train.py incremental --base {args.model} --since {output}`.")
+        return
+
+    if args.resume:
+        run_dir = find_run(args.checkpoint_dir, args.resume)
+        if args.epochs:
+            state = load_state(run_dir)
+            state['config']['epochs'] = args.epochs # e.g. give an interrupted run more epochs
+            _write_json(os.path.join(run_dir, STATE_FILE), state)
+        print(f"Resuming {run_dir}")
+    else:
+        name = args.name or resolve_model(args.base)['name']
+        epochs = args.epochs or (5 if args.command == 'incremental' else 50)
+        run_dir = start_run(args.command, args.dataset, name, getattr(args, 'base', None),
+                            getattr(args, 'since', None), epochs, args.batch_size, args.learning_rate,
+                            args.validation_split, getattr(args, 'replay', 1.0), args.seed, args.checkpoint_dir)
+
+    model, state = train(run_dir, args.checkpoint_every, args.patience)
+    finish_run(model, state, args.output_dir, register=not args.no_register)
+
+
+if __name__ == '__main__':
+    main()
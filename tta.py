@@ -0,0 +1,85 @@
+"""
+Test-time augmentation (TTA) computed as one batched forward pass.
+
+Instead of calling model.predict once per augmented view, all views of an
+image (flips, rotations and zoomed crops) are written into one
+preallocated (N, H, W, 3) batch and predicted together; the class
+probabilities are then averaged. This stabilises predictions for the same
+lesion photographed from slightly different angles.
+"""
+import numpy as np
+import cv2
+
+DEFAULT_VIEWS = ('original', 'hflip', 'vflip', 'rot90', 'rot270', 'crop')
+CROP_FRACTION = 0.85 # Share of the image kept by the zoomed crops
+
+
+def build_tta_batch(img_array, views=DEFAULT_VIEWS):
+    """
+    Builds the augmented views of one preprocessed image.
+    Args:
+        img_array: (H, W, 3) float image, already normalized to [0, 1].
+        views (tuple): Names of the views to include. 'crop' adds a centre
+            crop plus the four corner crops, each resized back to (H, W).
+    Returns:
+        np.ndarray: (N, H, W, 3) float32 batch.
+    """
+    img_array = np.asarray(img_array, dtype=np.float32)
+    height, width = img_array.shape[:2]
+    square = height == width
+    n_views = sum(5 if v == 'crop' else 1 for v in views if square or v not in ('rot90', 'rot270'))
+    batch = np.empty((n_views,) + img_array.shape, dtype=np.float32)
+
+    i = 0
+    for view in views:
+        if view == 'original':
+            batch[i] = img_array
+        elif view == 'hflip':
+            batch[i] = img_array[:, ::-1]
+        elif view == 'vflip':
+            batch[i] = img_array[::-1]
+        elif view in ('rot90', 'rot270'):
+            if not square:
+                continue # Rotating a non-square image would change its shape
+            batch[i] = np.rot90(img_array, k=1 if view == 'rot90' else 3)
+        elif view == 'crop':
+            crop_h, crop_w = int(height * CROP_FRACTION), int(width * CROP_FRACTION)
+            top, left = (height - crop_h) // 2, (width - crop_w) // 2
+            offsets = [(top, left), (0, 0), (0, width - crop_w), (height - crop_h, 0), (height - crop_h, width - crop_w)]
+            for y, x in offsets:
+                batch[i] = cv2.resize(img_array[y:y + crop_h, x:x + crop_w], (width, height),
+                                      interpolation=cv2.INTER_LINEAR)
+                i += 1
+            continue
+        else:
+            raise ValueError(f"Unknown TTA view '{view}'")
+        i += 1
+    return batch
+
+
+def aggregate_predictions(predictions):
+    """
+    Averages the per-view class probabilities.
+    Returns:
+        tuple: (mean_probabilities, agreement) where agreement is the share of
+        views whose top class matches the averaged top class.
+    """
+    predictions = np.asarray(predictions)
+    mean = predictions.mean(axis=0)
+    agreement = float(np.mean(np.argmax(predictions, axis=1) == np.argmax(mean)))
+    return mean, agreement
+
+
+def predict_tta(model, img_array, views=DEFAULT_VIEWS):
+    """
+    Runs TTA for one image with a single model.predict call.
+    Args:
+        img_array: (H, W, 3) or (1, H, W, 3) normalized image.
+    Returns:
+        tuple: (mean_probabilities, agreement)
+    """
+    img_array = np.asarray(img_array)
+    if img_array.ndim == 4:
+        img_array = img_array[0]
+    batch = build_tta_batch(img_array, views)
+    return aggregate_predictions(model.predict(batch, batch_size=len(batch), verbose=0))
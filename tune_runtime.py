@@ -0,0 +1,232 @@
+"""
+Sweeps inference runtime settings on this machine and saves the best ones.
+
+Thread-pool sizes can only be set once per TensorFlow process, so every
+setting is measured in fresh processes. A trial starts --processes worker
+processes (pinned to disjoint CPU slices with --pin). Each worker loads
+the model, applies the settings and runs --concurrency client threads
+sending single JPEG images for --duration seconds. As in the app, the
+images go through a PreprocessPipeline: --preprocess-workers decode
+processes (the app's PREPROCESS_WORKERS) and one batching inference
+thread. With --no-pipeline the clients call model.predict directly
+instead, which the app only does for test-time augmentation and
+similar-case lookups. The sweep covers intra-op threads (powers of two up
+to the CPUs of a worker, plus TensorFlow's default) and inter-op threads;
+the single-inference-thread mode only affects direct calls, so it is
+swept with --no-pipeline only.
+
+The winner has the highest throughput among the settings whose p95
+latency stays within --latency-budget-ms (or the lowest p95 if none do).
+It is written to runtime_config.json, which the app merges into its config
+at startup (see runtime_config.py).
+
+Usage:
+    python tune_runtime.py --model resnet152v2 --concurrency 4
+    python tune_runtime.py --model student_mobilenetv2 --processes 2 --pin --latency-budget-ms 150
+    python tune_runtime.py --model resnet152v2 --no-pipeline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import threading
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+from runtime_config import apply_runtime, available_cpus, cpu_slice, SerializedModel
+
+DEFAULT_OUTPUT = 'runtime_config.json'
+
+
+def _jpeg(size, seed=0):
+    """Encoded JPEG of the model input size, standing in for an upload."""
+    import cv2
+
+    pixels = np.random.default_rng(seed).integers(0, 256, (*size, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', pixels)[1].tobytes()
+
+
+def run_trial(model_spec, intra, inter, single, concurrency, duration, cpus=None, preprocess_workers=2,
+              max_batch=8):
+    """
+    Runs one worker's share of a trial in this process.
+    Args:
+        preprocess_workers (int): Decode processes of the PreprocessPipeline; None calls model.predict directly.
+    Returns:
+        dict: The request latencies and the seconds measured.
+    """
+    from model_registry import load_registered_model
+
+    apply_runtime({'RUNTIME_INTRA_OP_THREADS': intra, 'RUNTIME_INTER_OP_THREADS': inter,
+                   'RUNTIME_CPU_AFFINITY': cpus, 'RUNTIME_SINGLE_INFERENCE_THREAD': single})
+    model, entry = load_registered_model(model_spec, num_threads=intra or None)
+    size = tuple(entry['target_size'])
+    pipeline = None
+    if preprocess_workers is not None:
+        from preprocess_pool import PreprocessPipeline
+
+        # The app hands the pipeline the bare model: its one inference thread already serializes predict
+        pipeline = PreprocessPipeline(model, size, workers=preprocess_workers, max_batch=max_batch)
+        upload = _jpeg(size)
+        predict = lambda: pipeline.predict(upload, method='cv2')
+    else:
+        if single:
+            model = SerializedModel(model)
+        x = np.random.default_rng(0).random((1, *size, 3), dtype=np.float32)
+        predict = lambda: model.predict(x, verbose=0)
+    predict() # Warm-up outside the measurement (and decode worker start-up)
+
+    latencies = []
+    stop = threading.Event()
+
+    def client():
+        while not stop.is_set():
+            start = time.perf_counter()
+            predict()
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    if pipeline is not None:
+        pipeline.close()
+    return {'latencies': latencies, 'seconds': seconds}
+
+
+def measure_setting(args, intra, inter, single):
+    """Starts the worker processes of one trial at once and merges their results."""
+    workers = []
+    for index in range(args.processes):
+        cmd = [sys.executable, os.path.abspath(__file__), 'trial', '--model', args.model, '--intra', str(intra),
+               '--inter', str(inter), '--concurrency', str(args.concurrency), '--duration', str(args.duration)]
+        if single:
+            cmd.append('--single')
+        if args.no_pipeline:
+            cmd.append('--no-pipeline')
+        else:
+            cmd += ['--preprocess-workers', str(args.preprocess_workers)]
+        if args.pin:
+            cmd += ['--cpus', ','.join(map(str, cpu_slice(args.processes, index)))]
+        workers.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True))
+    latencies, requests_per_second = [], 0.0
+    for worker in workers:
+        output, _ = worker.communicate()
+        if worker.returncode != 0:
+            raise RuntimeError(f"Trial worker failed (intra={intra}, inter={inter}, single={single})")
+        result = json.loads(output.strip().splitlines()[-1])
+        latencies += result['latencies']
+        requests_per_second += len(result['latencies']) / result['seconds']
+    ms = np.array(latencies) * 1000
+    return {
+        'intra_op_threads': intra,
+        'inter_op_threads': inter,
+        'single_inference_thread': single,
+        'throughput': round(requests_per_second, 2),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+    }
+
+
+def candidate_settings(cpus_per_process, inter_values=(1, 2), single_values=(False, True)):
+    """(intra, inter, single) grid: intra 0 (TensorFlow default) and powers of two up to the worker's CPUs."""
+    intra_values = [0] + sorted({min(2 ** i, cpus_per_process) for i in range(cpus_per_process.bit_length() + 1)})
+    return list(itertools.product(intra_values, inter_values, single_values))
+
+
+def pick_best(results, latency_budget_ms=None):
+    """Highest throughput within the latency budget, else the lowest p95."""
+    within = [r for r in results if latency_budget_ms is None or r['p95_ms'] <= latency_budget_ms]
+    if within:
+        return max(within, key=lambda r: r['throughput'])
+    return min(results, key=lambda r: r['p95_ms'])
+
+
+def save_runtime_config(best, args, results, path=DEFAULT_OUTPUT):
+    settings = {
+        'RUNTIME_INTRA_OP_THREADS': best['intra_op_threads'],
+        'RUNTIME_INTER_OP_THREADS': best['inter_op_threads'],
+        'RUNTIME_SINGLE_INFERENCE_THREAD': best['single_inference_thread'],
+        'RUNTIME_CPU_AFFINITY': 'auto' if args.pin else None,
+        'RUNTIME_PROCESSES': args.processes,
+    }
+    with open(path + '.tmp', 'w') as f:
+        json.dump({
+            'settings': settings,
+            'measured': best,
+            'sweep': {'model': args.model, 'processes': args.processes, 'concurrency': args.concurrency,
+                      'preprocess_workers': None if args.no_pipeline else args.preprocess_workers,
+                      'duration': args.duration, 'latency_budget_ms': args.latency_budget_ms,
+                      'cpus': len(available_cpus()), 'machine': platform.node(),
+                      'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'results': results},
+        }, f, indent=4)
+    os.replace(path + '.tmp', path)
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the best inference thread/affinity settings for this machine.")
+    sub = parser.add_subparsers(dest='command')
+    trial = sub.add_parser('trial', help="(internal) Run one worker of a trial and print JSON.")
+    trial.add_argument('--model', required=True)
+    trial.add_argument('--intra', type=int, default=0)
+    trial.add_argument('--inter', type=int, default=0)
+    trial.add_argument('--single', action='store_true')
+    trial.add_argument('--concurrency', type=int, default=4)
+    trial.add_argument('--duration', type=float, default=3.0)
+    trial.add_argument('--cpus', default=None, help="Comma-separated CPU ids to pin to.")
+    trial.add_argument('--preprocess-workers', type=int, default=2)
+    trial.add_argument('--no-pipeline', action='store_true')
+
+    parser.add_argument('--model', default='resnet152v2', help="Registry spec or model path.")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes serving at once.")
+    parser.add_argument('--pin', action='store_true', help="Pin each worker process to its own CPU slice.")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent requests per worker process.")
+    parser.add_argument('--duration', type=float, default=3.0, help="Seconds measured per setting.")
+    parser.add_argument('--preprocess-workers', type=int, default=2,
+                        help="Decode processes of the pipeline, as PREPROCESS_WORKERS in the app.")
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help="Time direct model.predict calls instead of the preprocessing pipeline.")
+    parser.add_argument('--latency-budget-ms', type=float, default=None)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--dry-run', action='store_true', help="Print the best setting without saving it.")
+    args = parser.parse_args()
+
+    if args.command == 'trial':
+        cpus = [int(cpu) for cpu in args.cpus.split(',')] if args.cpus else None
+        print(json.dumps(run_trial(args.model, args.intra, args.inter, args.single, args.concurrency,
+                                   args.duration, cpus, None if args.no_pipeline else args.preprocess_workers)))
+        return
+
+    cpus_per_process = len(cpu_slice(args.processes, 0)) if args.pin else len(available_cpus())
+    settings = candidate_settings(cpus_per_process, single_values=(False, True) if args.no_pipeline else (False,))
+    print(f"{len(settings)} settings, {args.processes} process(es) x {args.concurrency} concurrent requests, "
+          f"{args.duration:g}s each")
+    print(f"{'intra':>5s} {'inter':>5s} {'single':>6s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    results = []
+    for intra, inter, single in settings:
+        r = measure_setting(args, intra, inter, single)
+        results.append(r)
+        print(f"{intra or 'tf':>5} {inter:5d} {'yes' if single else 'no':>6s} {r['throughput']:8.2f} "
+              f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f}")
+
+    best = pick_best(results, args.latency_budget_ms)
+    print(f"Best: intra={best['intra_op_threads'] or 'tf default'} inter={best['inter_op_threads']} "
+          f"single={best['single_inference_thread']} ({best['throughput']} req/s, p95 {best['p95_ms']} ms)")
+    if not args.dry_run:
+        save_runtime_config(best, args, results, args.output)
+        print(f"Saved to {args.output}; the app picks it up on its next start.")
+
+
+if __name__ == '__main__':
+    main()